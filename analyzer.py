@@ -0,0 +1,168 @@
+import mmap
+import os
+import re
+import struct
+from array import array
+from functools import lru_cache
+from itertools import islice
+from postings import build_term_table, term_hash, to_bytes
+
+# Turns text into index terms. invert.py and search.py share it, so documents and queries are always
+# tokenized, stopped and stemmed the same way
+#
+# Terms are lowercased, whitespace-split and stripped of everything but letters and digits. With stemming,
+# stop words and empty terms are dropped and the rest are Porter stemmed
+#
+# Importing NLTK takes about a second, so it is only imported the first time a word has to be stemmed
+# that the stem table does not know. invert.py saves every word it stemmed, with its stem, to the table:
+#
+#   stems.bin
+#       header: magic, version, number of words, hash table size
+#       word_offsets: uint32[W + 1]  offset of each word's utf-8 string in the word blob
+#       stem_offsets: uint32[W + 1]  offset of each word's stem in the stem blob
+#       word_table:   uint32[T]      open-addressing hash table of word number + 1 (0 = empty slot), as in the lexicon
+#       word blob, stem blob
+#
+# so a query only made of words from the collection is stemmed without NLTK, exactly as the index was
+
+STEM_TABLE_FILE = 'stems.bin'
+STEMS_MAGIC = b'IRST'
+STEMS_VERSION = 1
+
+STEMS_HEADER = struct.Struct('<4sIII')
+
+# Writes the {word: stem} dict as a stem table, replacing the old one atomically
+def write_stem_table(stems, stem_table_file=STEM_TABLE_FILE):
+    words = sorted(stems)
+    encoded_words = [word.encode('utf-8') for word in words]
+    encoded_stems = [stems[word].encode('utf-8') for word in words]
+
+    word_offsets = array('I', [0])
+    stem_offsets = array('I', [0])
+    for encoded_word, encoded_stem in zip(encoded_words, encoded_stems):
+        word_offsets.append(word_offsets[-1] + len(encoded_word))
+        stem_offsets.append(stem_offsets[-1] + len(encoded_stem))
+    word_table = build_term_table(encoded_words)
+
+    with open(stem_table_file + '.tmp', 'wb') as stems_output:
+        stems_output.write(STEMS_HEADER.pack(STEMS_MAGIC, STEMS_VERSION, len(words), len(word_table)))
+        for values in (word_offsets, stem_offsets, word_table):
+            stems_output.write(to_bytes(values))
+        stems_output.write(b''.join(encoded_words))
+        stems_output.write(b''.join(encoded_stems))
+    os.replace(stem_table_file + '.tmp', stem_table_file)
+
+# Read-only, memory-mapped stem table written by write_stem_table
+class StemTable:
+
+    def __init__(self, stem_table_file=STEM_TABLE_FILE):
+
+        with open(stem_table_file, 'rb') as stems_input:
+            self.stems_map = mmap.mmap(stems_input.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_words, table_size = STEMS_HEADER.unpack_from(self.stems_map, 0)
+        if magic != STEMS_MAGIC or version != STEMS_VERSION:
+            raise ValueError(f"{stem_table_file} is not a version {STEMS_VERSION} stem table")
+
+        view = memoryview(self.stems_map)
+        start = STEMS_HEADER.size
+        self.word_offsets = view[start:start + 4 * (num_words + 1)].cast('I')
+        start += 4 * (num_words + 1)
+        self.stem_offsets = view[start:start + 4 * (num_words + 1)].cast('I')
+        start += 4 * (num_words + 1)
+        self.word_table = view[start:start + 4 * table_size].cast('I')
+        self.table_mask = table_size - 1
+        start += 4 * table_size
+        self.word_blob = view[start:start + self.word_offsets[num_words]]
+        start += self.word_offsets[num_words]
+        self.stem_blob = view[start:start + self.stem_offsets[num_words]]
+
+    # Returns the stem of the word, or None if the word is not in the table
+    def get(self, word):
+        key = word.encode('utf-8')
+        slot = term_hash(key) & self.table_mask
+
+        while True:
+            entry = self.word_table[slot]
+            if entry == 0:
+                return None
+            if self.word_blob[self.word_offsets[entry - 1]:self.word_offsets[entry]] == key:
+                return bytes(self.stem_blob[self.stem_offsets[entry - 1]:self.stem_offsets[entry]]).decode('utf-8')
+            slot = (slot + 1) & self.table_mask
+
+class Analyzer:
+
+    pattern = re.compile(r"[^0-9a-zA-Z\s]+")
+
+    def __init__(self, stemming, stopwords_file='stopwords.txt', stem_cache_size=100000, stem_table_file=STEM_TABLE_FILE):
+        self.stemming = stemming
+        self.stop_words = set()
+
+        # Every word stemmed while indexing, with its stem, for the stem table; None when not indexing (see collect_stems)
+        self.collected_stems = None
+        self.stems_taken = 0
+        self.stemmer = None
+        self.stem_table = None
+
+        # The vocabulary is small and words repeat constantly, so memoize the stemmer in a bounded LRU cache
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.lookup_stem)
+
+        if stemming:
+            # Load stop words from the provided text file into a set, once
+            with open(stopwords_file, 'r') as stopword_file:
+                self.stop_words = set(stopword_file.read().splitlines())
+
+            if os.path.exists(stem_table_file):
+                self.stem_table = StemTable(stem_table_file)
+
+    # Returns the Porter stem of the word, from the stem table if it has it. stem() is this behind the LRU memo
+    def lookup_stem(self, word):
+        stem = None
+        if self.stem_table is not None:
+            stem = self.stem_table.get(word)
+        if stem is None:
+            if self.stemmer is None:
+                from nltk.stem import PorterStemmer
+                self.stemmer = PorterStemmer()
+            stem = self.stemmer.stem(word)
+
+        # Unlike the memo, the collected stems are never evicted, so the stem table gets every word of the collection
+        if self.collected_stems is not None:
+            self.collected_stems[word] = stem
+        return stem
+
+    # Starts keeping every word stemmed from now on, for the stem table invert.py writes. The memo is emptied,
+    # as words it already holds would not be looked up, and so not collected
+    def collect_stems(self):
+        if self.collected_stems is None:
+            self.collected_stems = {}
+            self.stem.cache_clear()
+
+    # Adds stems worked out elsewhere, e.g. by the worker processes of a parallel build, to the collected stems
+    def remember_stems(self, stems):
+        self.collect_stems()
+        for word, stem in stems.items():
+            self.collected_stems.setdefault(word, stem)
+
+    # Returns the words collected since the last call, with their stems
+    def take_new_stems(self):
+        if self.collected_stems is None:
+            return {}
+        new_stems = dict(islice(self.collected_stems.items(), self.stems_taken, None))
+        self.stems_taken = len(self.collected_stems)
+        return new_stems
+
+    # Returns the terms of the text, in order, for indexing or querying
+    def tokens(self, text):
+        alphanum_terms = [self.pattern.sub("", c).strip() for c in text.lower().split()]
+
+        if self.stemming:
+            stem = self.stem
+            alphanum_terms = [stem(word) for word in alphanum_terms if word not in self.stop_words and word != ""]
+
+        return alphanum_terms
+
+# Returns this process's analyzer for the stemming mode, creating it the first time
+@lru_cache(maxsize=None)
+def get_analyzer(stemming):
+    return Analyzer(stemming)
@@ -0,0 +1,276 @@
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import numpy as np
+
+# Reproducible benchmarks of the indexer and the search engine
+#
+#   python benchmark.py [scales=1,4] [rounds=5] [stemming=Yes] [parallel] [impactOrdered] [champions=<r>] [save]
+#                       [baseline=benchmark_baseline.json] [output=benchmark_results.json]
+#
+# For each corpus, the CACM collection itself (scale 1) and synthetic ones made of `scale` copies of
+# cacm.all, invert.py builds the index in a fresh process in a scratch directory, which gives the build
+# time and the peak memory of the build (including its worker processes with parallel). A second fresh
+# process then times importing the search engine, opening the index, the first query, which loads what
+# it needs of the index, and, after an untimed warm-up pass, the queries of query.text `rounds` times one by
+# one with the result cache turned off, for the p50/p95/p99 latencies, and once more as one batch.
+#
+# The results are written as JSON and compared against a stored baseline (written with `save`): every
+# metric is lower-is-better, and the ones more than 10% above the baseline are reported as regressions.
+# Timings depend on the machine, so no baseline is shipped: the first run on a machine needs `save`
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+COLLECTION = os.path.join(REPO_DIR, 'cacm.tar')
+STOPWORDS_FILE = os.path.join(REPO_DIR, 'stopwords.txt')
+
+DEFAULT_RESULTS_FILE = 'benchmark_results.json'
+DEFAULT_BASELINE_FILE = 'benchmark_baseline.json'
+REGRESSION_TOLERANCE = 0.10
+
+# Fixed seed so every run benchmarks the same synthetic corpora
+SYNTHETIC_SEED = 842
+
+# Writes a collection tar whose cacm.all holds `scale` copies of every CACM document under new doc ids
+# Each copy is in its own seeded random order, so copies of a document are not next to each other
+def synthetic_collection(scale, output_tar, collection=COLLECTION, seed=SYNTHETIC_SEED):
+    with tarfile.open(collection, 'r') as tar:
+        text = tar.extractfile('cacm.all').read().decode('utf-8')
+
+    # Everything after each '.I <id>' line, up to the next one
+    bodies = re.split(r'^\.I[^\n]*\n', text, flags=re.M)[1:]
+
+    rng = random.Random(seed)
+    output = io.StringIO()
+    doc_id = 0
+
+    for copy in range(scale):
+        order = list(range(len(bodies)))
+        if copy > 0:
+            rng.shuffle(order)
+        for i in order:
+            doc_id += 1
+            output.write(f".I {doc_id}\n{bodies[i].rstrip()}\n")
+
+    data = output.getvalue().encode('utf-8')
+    with tarfile.open(output_tar, 'w') as tar:
+        member = tarfile.TarInfo('cacm.all')
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+
+    return doc_id
+
+# Runs one of this file's worker modes in a fresh Python process in work_dir and returns its JSON report
+def run_worker(mode, work_dir, *arguments):
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), mode, *arguments], cwd=work_dir, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"benchmark {mode} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+# Peak resident memory of this process and of its largest finished child process, in MB
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return max(own, children) / (1024 * 1024)
+
+# Worker: builds the index of the collection in the current directory with invert.py
+def build_worker(collection_tar, invert_options):
+    sys.path.insert(0, REPO_DIR)
+    import invert
+
+    sys.argv = ['invert.py', collection_tar] + invert_options
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            invert.main()
+        finally:
+            sys.stdout = stdout
+    build_seconds = time.perf_counter() - start
+
+    index_bytes = sum(os.path.getsize(index_file) for index_file in ('lexicon.bin', 'postings.bin', 'docstore.bin'))
+    print(json.dumps({'build_seconds': build_seconds, 'peak_memory_mb': peak_memory_mb(), 'index_bytes': index_bytes}))
+
+# Worker: loads the index in the current directory and times the queries
+def query_worker(user_stemming, rounds):
+    start = time.perf_counter()
+    sys.path.insert(0, REPO_DIR)
+    from search import SearchEngine
+    from eval import parse_queries
+    import_seconds = time.perf_counter() - start
+
+    with tarfile.open(COLLECTION, 'r') as tar:
+        queries = list(parse_queries(tar).values())
+
+    start = time.perf_counter()
+    engine = SearchEngine(result_cache_size=0)
+    load_seconds = time.perf_counter() - start
+
+    # The engine only builds its scorers and decodes postings once a query needs them, so the first query
+    # pays for loading the index and is reported on its own. The other queries then run once untimed as a
+    # warm-up, as some load NLTK for words that are not in stems.bin, and the latencies are steady-state
+    start = time.perf_counter()
+    engine.search(queries[0], user_stemming, query_operators=False)
+    first_query_ms = (time.perf_counter() - start) * 1000
+
+    for query in queries[1:]:
+        engine.search(query, user_stemming, query_operators=False)
+
+    latencies = []
+    for round_number in range(int(rounds)):
+        for query in queries:
+            start = time.perf_counter()
+            engine.search(query, user_stemming, query_operators=False)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    engine.search_batch(queries, user_stemming, query_operators=False)
+    batch_seconds = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    print(json.dumps({
+        'import_seconds': import_seconds,
+        'load_seconds': load_seconds,
+        'first_query_ms': first_query_ms,
+        'query_p50_ms': float(np.percentile(latencies_ms, 50)),
+        'query_p95_ms': float(np.percentile(latencies_ms, 95)),
+        'query_p99_ms': float(np.percentile(latencies_ms, 99)),
+        'query_mean_ms': float(latencies_ms.mean()),
+        'batch_seconds': batch_seconds,
+        'docs': engine.N,
+        'queries': len(queries),
+        'query_peak_memory_mb': peak_memory_mb(),
+    }))
+
+# Builds and queries one corpus in a scratch directory; returns its metrics
+def benchmark_corpus(scale, user_stemming, rounds, invert_options):
+    work_dir = tempfile.mkdtemp(prefix='irbench_')
+
+    try:
+        if os.path.exists(STOPWORDS_FILE):
+            shutil.copy(STOPWORDS_FILE, work_dir)
+
+        collection_tar = COLLECTION
+        if scale > 1:
+            collection_tar = os.path.join(work_dir, 'collection.tar')
+            synthetic_collection(scale, collection_tar)
+
+        results = run_worker('_build', work_dir, collection_tar, *invert_options)
+        results.update(run_worker('_query', work_dir, user_stemming, str(rounds)))
+        return results
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Runs every benchmark and returns the results with a description of the run
+def run_benchmarks(scales=(1, 4), user_stemming='Yes', rounds=5, invert_options=()):
+    stem_option = 'stemOn' if user_stemming == 'Yes' else 'stemOff'
+    invert_options = [stem_option] + list(invert_options)
+
+    corpora = {}
+    for scale in scales:
+        name = 'cacm' if scale == 1 else f'cacm_x{scale}'
+        print(f"Benchmarking {name}...")
+        corpora[name] = benchmark_corpus(scale, user_stemming, rounds, invert_options)
+
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'stemming': user_stemming,
+        'rounds': rounds,
+        'invert_options': invert_options,
+        'corpora': corpora,
+    }
+
+# Compares every metric found in both results; returns a list of (corpus, metric, baseline, current, change)
+def compare_results(baseline, results):
+    comparison = []
+
+    for name, metrics in results['corpora'].items():
+        baseline_metrics = baseline.get('corpora', {}).get(name, {})
+        for metric, value in metrics.items():
+            if metric in ('docs', 'queries') or metric not in baseline_metrics or baseline_metrics[metric] == 0:
+                continue
+            comparison.append((name, metric, baseline_metrics[metric], value, value / baseline_metrics[metric] - 1))
+
+    return comparison
+
+def print_results(results, comparison):
+    if comparison:
+        print(f"{'corpus':<12}{'metric':<22}{'baseline':>14}{'current':>14}{'change':>10}")
+        for name, metric, baseline_value, value, change in comparison:
+            flag = "  REGRESSION" if change > REGRESSION_TOLERANCE else ""
+            print(f"{name:<12}{metric:<22}{baseline_value:>14.4f}{value:>14.4f}{change:>+10.1%}{flag}")
+    else:
+        print(f"{'corpus':<12}{'metric':<22}{'value':>14}")
+        for name, metrics in results['corpora'].items():
+            for metric, value in metrics.items():
+                print(f"{name:<12}{metric:<22}{value:>14.4f}")
+
+def main():
+
+    if len(sys.argv) > 1 and sys.argv[1] == '_build':
+        build_worker(sys.argv[2], sys.argv[3:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '_query':
+        query_worker(sys.argv[2], sys.argv[3])
+        return
+
+    scales = (1, 4)
+    rounds = 5
+    user_stemming = 'Yes'
+    baseline_file = DEFAULT_BASELINE_FILE
+    results_file = DEFAULT_RESULTS_FILE
+    options = sys.argv[1:]
+
+    for option in options:
+        if option.startswith("scales="):
+            scales = tuple(int(scale) for scale in option.split("=")[1].split(","))
+        elif option.startswith("rounds="):
+            rounds = int(option.split("=")[1])
+        elif option.startswith("stemming="):
+            user_stemming = option.split("=")[1]
+        elif option.startswith("baseline="):
+            baseline_file = option.split("=")[1]
+        elif option.startswith("output="):
+            results_file = option.split("=")[1]
+
+    invert_options = [option for option in options if option in ('parallel', 'impactOrdered') or option.startswith('champions=')]
+    results = run_benchmarks(scales, user_stemming, rounds, invert_options)
+
+    with open(results_file, 'w') as results_output:
+        json.dump(results, results_output, indent=2)
+    print(f"Results written to {results_file}")
+
+    comparison = []
+    if "save" in options:
+        shutil.copy(results_file, baseline_file)
+        print(f"Saved as the baseline in {baseline_file}")
+    elif os.path.exists(baseline_file):
+        with open(baseline_file, 'r') as baseline_input:
+            comparison = compare_results(json.load(baseline_input), results)
+    else:
+        print(f"No baseline found at {baseline_file}; run with save to store one")
+
+    print_results(results, comparison)
+
+    regressions = [entry for entry in comparison if entry[4] > REGRESSION_TOLERANCE]
+    if regressions:
+        print(f"{len(regressions)} metrics are more than {REGRESSION_TOLERANCE:.0%} worse than the baseline")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
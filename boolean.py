@@ -0,0 +1,140 @@
+import re
+import numpy as np
+from analyzer import get_analyzer
+
+# Boolean retrieval over one segment of the index
+#
+#   information AND (retrieval OR search) NOT web
+#
+# AND binds tighter than OR, NOT applies to the operand after it, and words next to each other without
+# an operator are AND'ed. Operators must be upper case; words that are stop words match everything.
+#
+# The query is planned like a database join: the operands of an AND are evaluated from the smallest
+# estimated result up, using the dfs stored in the lexicon, and each later operand is only asked which of
+# the documents left so far it matches. For a term that is a binary search of the postings list's skips
+# plus the decoding of the few 64-posting chunks those documents can be in (PostingsIndex.filter_doc_ids),
+# so an AND with a rare term costs little however long the other postings lists are. NOT operands are
+# applied last, against the smallest candidate set
+
+QUERY_TOKEN = re.compile(r'\(|\)|[^\s()]+')
+OPERATORS = ('AND', 'OR', 'NOT', '(', ')')
+
+# Parses a Boolean query into a tree of ('term', word), ('and', [nodes]), ('or', [nodes]) and ('not', node)
+# analyze_tree adds ('all',), the node of a stop word, which matches every document
+def parse_boolean_query(user_string):
+    tokens = QUERY_TOKEN.findall(user_string)
+    node, position = parse_or(tokens, 0)
+
+    if position < len(tokens):
+        raise ValueError(f"Unexpected '{tokens[position]}' in Boolean query")
+
+    return node
+
+def parse_or(tokens, position):
+    nodes = []
+    node, position = parse_and(tokens, position)
+    nodes.append(node)
+
+    while position < len(tokens) and tokens[position] == 'OR':
+        node, position = parse_and(tokens, position + 1)
+        nodes.append(node)
+
+    return (nodes[0] if len(nodes) == 1 else ('or', nodes)), position
+
+def parse_and(tokens, position):
+    nodes = []
+    node, position = parse_not(tokens, position)
+    nodes.append(node)
+
+    while position < len(tokens) and tokens[position] not in ('OR', ')'):
+        if tokens[position] == 'AND':
+            position += 1
+        node, position = parse_not(tokens, position)
+        nodes.append(node)
+
+    return (nodes[0] if len(nodes) == 1 else ('and', nodes)), position
+
+def parse_not(tokens, position):
+    if position < len(tokens) and tokens[position] == 'NOT':
+        node, position = parse_not(tokens, position + 1)
+        return ('not', node), position
+
+    if position >= len(tokens):
+        raise ValueError("Boolean query ends where an operand was expected")
+
+    if tokens[position] == '(':
+        node, position = parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ')':
+            raise ValueError("Missing ')' in Boolean query")
+        return node, position + 1
+
+    if tokens[position] in OPERATORS:
+        raise ValueError(f"Unexpected '{tokens[position]}' in Boolean query")
+
+    return ('term', tokens[position]), position + 1
+
+# Replaces every word of the tree with its index term, and stop words with ('all',): they match every
+# document, so they drop out of an AND, make an OR match everything and make their NOT match nothing
+def analyze_tree(node, user_stemming):
+    if node[0] == 'term':
+        terms = get_analyzer(user_stemming == 'Yes').tokens(node[1])
+        return ('term', terms[0]) if terms else ('all',)
+
+    if node[0] == 'not':
+        return ('not', analyze_tree(node[1], user_stemming))
+
+    nodes = [analyze_tree(child, user_stemming) for child in node[1]]
+    if node[0] == 'or' and ('all',) in nodes:
+        return ('all',)
+
+    nodes = [child for child in nodes if child != ('all',)]
+    if len(nodes) == 0:
+        return ('all',)
+    return nodes[0] if len(nodes) == 1 else (node[0], nodes)
+
+# Estimated number of documents the node matches, from the dfs in the lexicon
+def estimate(node, index):
+    if node[0] == 'term':
+        term_id = index.term_id(node[1])
+        return 0 if term_id is None else index.df(term_id)
+    if node[0] == 'and':
+        return min(estimate(child, index) for child in node[1])
+    if node[0] == 'or':
+        return sum(estimate(child, index) for child in node[1])
+    return float('inf')
+
+# Returns the sorted doc ids of the segment that match an analyzed tree
+#   all_doc_ids: every doc id in the segment, for NOT without anything to subtract from
+#   candidates:  if given, only these doc ids are tested and returned
+def evaluate(node, index, all_doc_ids, candidates=None):
+
+    if node[0] == 'all':
+        return all_doc_ids if candidates is None else candidates
+
+    if node[0] == 'term':
+        term_id = index.term_id(node[1])
+        if term_id is None:
+            return np.zeros(0, dtype=np.int64)
+        if candidates is None:
+            return index.doc_ids(term_id)
+        return index.filter_doc_ids(term_id, candidates)
+
+    if node[0] == 'not':
+        base = all_doc_ids if candidates is None else candidates
+        return np.setdiff1d(base, evaluate(node[1], index, all_doc_ids, base), assume_unique=True)
+
+    if node[0] == 'or':
+        doc_ids = [evaluate(child, index, all_doc_ids, candidates) for child in node[1]]
+        return np.unique(np.concatenate(doc_ids))
+
+    # AND: the smallest operands first, and the NOTs once there is the least left to subtract from
+    for child in sorted(node[1], key=lambda child: (child[0] == 'not', estimate(child, index))):
+        candidates = evaluate(child, index, all_doc_ids, candidates)
+        if len(candidates) == 0:
+            break
+
+    return candidates
+
+# Returns the sorted doc ids of the segment's documents that contain every one of the terms
+def intersect_terms(index, term_ids):
+    return evaluate(('and', [('term', index.term(term_id)) for term_id in term_ids]), index, None)
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+# Bounded least-recently-used caches, shared by the threads of a long-lived SearchEngine
+#
+# ResultCache holds the top-k results of recent queries. SearchEngine keys them both by the raw query
+# string and by the analyzed query, together with the stemming mode and every ranking parameter, so a
+# repeated query is answered with one dict lookup and the same query typed differently is still found.
+# The cache is tied to a version of the index (the checksum invert.py stores in the manifest and the
+# manifest generation) and empties itself when the index changes.
+#
+# PostingsIndex keeps its most recently decoded postings lists in an LRUCache bounded by their size in
+# bytes, so the phrase, NEAR and Boolean operators do not decode the lists of hot terms again and again
+
+DEFAULT_RESULT_CACHE_SIZE = 100000
+DEFAULT_POSTINGS_CACHE_BYTES = 32 * 1024 * 1024
+
+# Maps keys to values, evicting the least recently used entries once the total size is over max_size
+# size_of gives the size of a value (1 by default, so max_size is then a number of entries)
+class LRUCache:
+
+    def __init__(self, max_size, size_of=None):
+        self.max_size = max_size
+        self.size_of = size_of or (lambda value: 1)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Returns the cached value, or default if there is none
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                evicted_value, evicted_size = self.entries.popitem(last=False)[1]
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+# LRU cache of query results for one version of the index; the size of a result is its number of documents
+class ResultCache(LRUCache):
+
+    def __init__(self, max_size=DEFAULT_RESULT_CACHE_SIZE):
+        super().__init__(max_size, size_of=lambda result: len(result) + 1)
+        self.version = None
+
+    # Empties the cache if the index is not the version the cached results were computed on
+    def validate(self, version):
+        if version != self.version:
+            self.clear()
+            self.version = version
@@ -0,0 +1,44 @@
+import io
+import os
+import shutil
+import sys
+import tarfile
+import pytest
+import invert
+from corpus import iter_raw_docs
+from eval import parse_queries
+
+# Shared pytest fixtures: small indexes built with invert.py in a scratch directory
+
+STOPWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords.txt')
+COLLECTION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cacm.tar')
+
+# Writes {doc_id: text} as a collection tar holding one cacm.all file, in the CACM format
+def write_collection(documents, collection_tar):
+    data = ''.join(f".I {doc_id}\n{text.rstrip()}\n" for doc_id, text in documents.items()).encode('utf-8')
+    with tarfile.open(collection_tar, 'w') as tar:
+        member = tarfile.TarInfo('cacm.all')
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+
+# Changes to a scratch directory with the stop words and returns build(documents, *invert options), which
+# indexes the documents there with invert.py, e.g. build(docs, 'stemOn', 'impactOrdered')
+@pytest.fixture
+def build_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(STOPWORDS_FILE, tmp_path)
+
+    def build(documents, *options):
+        write_collection(documents, 'collection.tar')
+        monkeypatch.setattr(sys, 'argv', ['invert.py', 'collection.tar', *(options or ('stemOn',))])
+        invert.main()
+
+    return build
+
+# The first 1000 CACM documents, as {doc_id: text}, and the text of every CACM query
+@pytest.fixture(scope='session')
+def collection():
+    documents = dict(iter_raw_docs(COLLECTION))
+    with tarfile.open(COLLECTION, 'r') as tar:
+        queries = list(parse_queries(tar).values())
+    return {doc_id: documents[doc_id] for doc_id in list(documents)[:1000]}, queries
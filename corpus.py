@@ -0,0 +1,69 @@
+import io
+import tarfile
+
+# Streaming parser for the SMART-style files in the collection tar (cacm.all, query.text), where each
+# record starts with a '.I <id>' line and is split into sections by two-char labels such as .T, .W, .B,
+# .A, .N and .X. Records are yielded one at a time, so nothing holds the whole collection in memory
+
+BUFFER_SIZE = 1 << 20
+
+# Yields (record_id, fields) for every record in a binary file object, where fields maps each section
+# label to its stripped lines joined by newlines, in the order the sections appear
+def parse_records(file, buffer_size=BUFFER_SIZE):
+    reader = io.TextIOWrapper(io.BufferedReader(file, buffer_size), encoding='utf-8')
+
+    current_id = None
+    fields = {}
+    section = None
+
+    for line in reader:
+        line = line.strip()
+        # Get the first two chars of the line to check the section labels
+        section_label = line[:2]
+
+        if section_label == ".I":
+            if current_id is not None:
+                yield current_id, {label: '\n'.join(lines) for label, lines in fields.items()}
+            current_id = line.split()[-1]
+            fields = {}
+            section = None
+        elif len(line) >= 2 and line[0] == '.' and line[1].isalpha() and (len(line) == 2 or line[2].isspace()):
+            section = section_label
+            fields.setdefault(section, [])
+            # Some files put the first line of a section on the label line itself
+            if line[2:].strip():
+                fields[section].append(line[2:].strip())
+        elif section is not None:
+            fields[section].append(line)
+
+    # Yield the very last record that was not part of the loop
+    if current_id is not None:
+        yield current_id, {label: '\n'.join(lines) for label, lines in fields.items()}
+
+    reader.detach()
+
+# Yields (doc_id, fields) for every document in the files ending with target_extension in the tar
+def iter_documents(input_collection, target_extension='.all', buffer_size=BUFFER_SIZE):
+    with tarfile.open(input_collection, 'r') as tar:
+        for member in tar.getmembers():
+            if member.isfile() and member.name.endswith(target_extension):
+                with tar.extractfile(member) as file:
+                    yield from parse_records(file, buffer_size)
+
+# Returns a document's text the way it is indexed and stored: every section except the skipped ones,
+# each introduced by its label line
+def document_text(fields, skip_sections=('.N', '.X')):
+    content = []
+
+    for label, text in fields.items():
+        if label not in skip_sections:
+            content.append(label)
+            if text:
+                content.append(text)
+
+    return '\n'.join(content)
+
+# Yields (doc_id, text) for every document in the collection, ready for indexing
+def iter_raw_docs(input_collection, target_extension='.all'):
+    for doc_id, fields in iter_documents(input_collection, target_extension):
+        yield doc_id, document_text(fields)
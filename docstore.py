@@ -0,0 +1,194 @@
+import bisect
+import mmap
+import struct
+from array import array
+from postings import to_bytes
+
+# Binary document store written by invert.py next to the index, so search.py and ui.py can show the
+# title and authors of the top-k documents without reopening and reparsing the collection tar file
+#
+#   docstore.bin
+#       header: magic, version, number of documents, byte offset of the arrays after the records, and the
+#               total number of index tokens in all docs, in their titles and in their abstracts
+#       records:       per doc, the utf-8 title, the authors (one per line) and the body text
+#       doc_ids:       int32[N]          sorted document ids
+#       norms:         float64[N]        length of each doc's full tf-idf vector, computed by invert.py
+#       lengths:       uint32[N]         number of index tokens in each doc
+#       field_offsets: uint64[3 * N]     byte offsets of each doc's title, authors and body in the records
+#       body_ends:     uint64[N]         end of each doc's body in the records
+#       field_ranges:  uint32[4 * N]     [start, end) token positions of each doc's title and abstract
+#
+# The totals give the average document and field lengths, and N the collection size, for BM25 and BM25F
+#
+# The records come first so documents can be streamed into the store while they are being indexed;
+# the arrays, which need the norms, are written once indexing is done
+
+DOCSTORE_MAGIC = b'IRDS'
+DOCSTORE_VERSION = 4
+
+DOCSTORE_HEADER = struct.Struct('<4sIIQQQQ')
+
+# Splits a document's text into its title and list of authors, from the .T and .A sections
+def parse_doc_fields(doc_content):
+    title_lines = []
+    authors = []
+    section = None
+
+    for line in doc_content.split('\n'):
+        # Get the first two chars of the line to check the section labels
+        section_label = line[:2]
+
+        if section_label in {'.T', '.W', '.B', '.A', '.K', '.C'}:
+            section = section_label
+        elif section == '.T' and line.strip():
+            title_lines.append(line.strip())
+        elif section == '.A' and line.strip():
+            authors.append(line.strip())
+
+    return ' '.join(title_lines), authors
+
+# Streams documents into the doc store file as they are read, then writes the per-doc arrays on close
+class DocStoreWriter:
+
+    def __init__(self, docstore_file='docstore.bin'):
+        self.doc_ids = array('i')
+        self.field_offsets = array('Q')
+        self.body_ends = array('Q')
+
+        self.docstore_output = open(docstore_file, 'wb')
+        self.docstore_output.write(DOCSTORE_HEADER.pack(DOCSTORE_MAGIC, DOCSTORE_VERSION, 0, 0, 0, 0, 0))
+        self.offset = 0
+
+    def add(self, doc_id, doc_content):
+        title, authors = parse_doc_fields(doc_content)
+
+        self.doc_ids.append(int(doc_id))
+
+        for field in (title, '\n'.join(authors), doc_content):
+            encoded_field = field.encode('utf-8')
+            self.field_offsets.append(self.offset)
+            self.docstore_output.write(encoded_field)
+            self.offset += len(encoded_field)
+
+        self.body_ends.append(self.offset)
+
+    # Writes each document's stats (see invert.preprocess_and_inverted_index) and the lookup arrays
+    def close(self, doc_stats):
+        order = sorted(range(len(self.doc_ids)), key=lambda i: self.doc_ids[i])
+
+        doc_ids = array('i', (self.doc_ids[i] for i in order))
+        norms = array('d', (doc_stats[str(doc_id)]['norm'] for doc_id in doc_ids))
+        lengths = array('I', (doc_stats[str(doc_id)]['length'] for doc_id in doc_ids))
+        field_offsets = array('Q')
+        body_ends = array('Q', (self.body_ends[i] for i in order))
+        field_ranges = array('I')
+        for i in order:
+            field_offsets.extend(self.field_offsets[3 * i:3 * i + 3])
+        for doc_id in doc_ids:
+            field_ranges.extend(doc_stats[str(doc_id)]['fields'])
+
+        # Pad so the arrays start 8-byte aligned
+        padding = -(DOCSTORE_HEADER.size + self.offset) % 8
+        self.docstore_output.write(b'\0' * padding)
+        arrays_offset = DOCSTORE_HEADER.size + self.offset + padding
+
+        for values in (doc_ids, norms, lengths, field_offsets, body_ends, field_ranges):
+            self.docstore_output.write(to_bytes(values))
+
+        total_title_length = sum(field_ranges[1::4]) - sum(field_ranges[0::4])
+        total_abstract_length = sum(field_ranges[3::4]) - sum(field_ranges[2::4])
+
+        self.docstore_output.seek(0)
+        self.docstore_output.write(DOCSTORE_HEADER.pack(DOCSTORE_MAGIC, DOCSTORE_VERSION, len(doc_ids), arrays_offset, sum(lengths), total_title_length, total_abstract_length))
+        self.docstore_output.close()
+
+# Writes every document's stats, title, authors and body to the doc store file
+def write_doc_store(documents, doc_stats, docstore_file='docstore.bin'):
+    writer = DocStoreWriter(docstore_file)
+
+    for doc_id, doc_content in documents.items():
+        writer.add(doc_id, doc_content)
+
+    writer.close(doc_stats)
+
+# Read-only, memory-mapped random access to the documents written by write_doc_store
+class DocStore:
+
+    def __init__(self, docstore_file='docstore.bin'):
+
+        with open(docstore_file, 'rb') as docstore_input:
+            self.docstore_map = mmap.mmap(docstore_input.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_docs, arrays_offset, total_length, total_title_length, total_abstract_length = DOCSTORE_HEADER.unpack_from(self.docstore_map, 0)
+        if magic != DOCSTORE_MAGIC or version != DOCSTORE_VERSION:
+            raise ValueError(f"{docstore_file} is not a version {DOCSTORE_VERSION} doc store file")
+
+        self.num_docs = num_docs
+        self.total_length = total_length
+        self.total_title_length = total_title_length
+        self.total_abstract_length = total_abstract_length
+
+        self.docstore_view = memoryview(self.docstore_map)
+        self.records = self.docstore_view[DOCSTORE_HEADER.size:arrays_offset]
+        start = arrays_offset
+        self.doc_ids = self.docstore_view[start:start + 4 * num_docs].cast('i')
+        start += 4 * num_docs
+        self.norms = self.docstore_view[start:start + 8 * num_docs].cast('d')
+        start += 8 * num_docs
+        self.lengths = self.docstore_view[start:start + 4 * num_docs].cast('I')
+        start += 4 * num_docs
+        self.field_offsets = self.docstore_view[start:start + 8 * 3 * num_docs].cast('Q')
+        start += 8 * 3 * num_docs
+        self.body_ends = self.docstore_view[start:start + 8 * num_docs].cast('Q')
+        start += 8 * num_docs
+        self.field_ranges = self.docstore_view[start:start + 4 * 4 * num_docs].cast('I')
+
+    def __len__(self):
+        return self.num_docs
+
+    def __contains__(self, doc_id):
+        return self.doc_index(doc_id) is not None
+
+    # Returns the position of the document in the store, or None if there is no such document
+    def doc_index(self, doc_id):
+        try:
+            doc_id = int(doc_id)
+        except ValueError:
+            return None
+
+        i = bisect.bisect_left(self.doc_ids, doc_id)
+        if i < self.num_docs and self.doc_ids[i] == doc_id:
+            return i
+        return None
+
+    def field(self, i, field_number):
+        start = self.field_offsets[3 * i + field_number]
+        end = self.field_offsets[3 * i + field_number + 1] if field_number < 2 else self.body_ends[i]
+        return bytes(self.records[start:end]).decode('utf-8')
+
+    # Returns the title and authors of a document for display
+    def get(self, doc_id):
+        i = self.doc_index(doc_id)
+        if i is None:
+            raise KeyError(doc_id)
+
+        authors = self.field(i, 1)
+
+        return {
+            'Document ID': str(doc_id),
+            'Title': self.field(i, 0),
+            'Author': '; '.join(authors.split('\n')) if authors else None,
+        }
+
+    # Returns the full stored text of a document
+    def body(self, doc_id):
+        i = self.doc_index(doc_id)
+        if i is None:
+            raise KeyError(doc_id)
+
+        return self.field(i, 2)
+
+    def close(self):
+        for view in (self.doc_ids, self.norms, self.lengths, self.field_offsets, self.body_ends, self.field_ranges, self.records, self.docstore_view):
+            view.release()
+        self.docstore_map.close()
@@ -1,37 +1,21 @@
-import subprocess
 import tarfile
-import re
-import multiprocessing
 import sys
-from functools import partial
+from search import SearchEngine, RANKINGS
+from shards import ShardedSearchEngine
+from instrument import QueryStats, StatsHistograms, profiled
+from corpus import parse_records
 
 # Reads and parses query.text file and returns a dictionary of queries
 def parse_queries(tar_file):
     file_name = 'query.text'
 
+    content_dict = {}
+
     if file_name in tar_file.getnames():
-        file_contents = tar_file.extractfile(file_name).read().decode('utf-8')
-        lines = file_contents.splitlines()
-
-        content_dict = {}
-        current_key = None 
-        is_reading_content = False  
-
-        for i, line in enumerate(lines):
-            if line.startswith('.I'):
-                current_key = int(line.split()[1])
-                content_dict[current_key] = '' 
-                is_reading_content = False
-            elif line.startswith('.W'):
-                if current_key is not None:
-                    is_reading_content = True
-                    content_dict[current_key] += line.lstrip('.W').strip()
-            elif is_reading_content:
-                if line.startswith('.A') or line.startswith('.N'):
-                    is_reading_content = False
-                else:
-                    content_dict[current_key] += ' ' + line.strip()
-        
+        with tar_file.extractfile(file_name) as file:
+            for query_id, fields in parse_records(file):
+                content_dict[int(query_id)] = ' '.join(fields.get('.W', '').split('\n'))
+
     return content_dict
 
 # Reads and parses query.text file and returns a dictionary of queries
@@ -58,10 +42,19 @@ def parse_qrel(tar_file):
 def get_query(idx, queries_dict):
     return queries_dict[idx]
 
-# Run search.py and return top-k results for that query
-def query_search(query, user_stemming):
-    result = subprocess.run(['C:/Users/maycr/anaconda3/python.exe', 'search.py', query, user_stemming], stdout=subprocess.PIPE, text=True)
-    return result
+# Run every query against the already loaded search engine as one batch and return their top-k results, in order
+# The CACM queries are prose that quotes titles, so quotes are not read as phrase operators
+def batch_search(engine, queries, user_stemming, ranking='cosine'):
+    return engine.search_batch(list(queries.values()), user_stemming, query_operators=False, ranking=ranking)
+
+# Runs the queries one by one, each with its own QueryStats, and collects them all in histograms
+def instrumented_search(engine, queries, user_stemming, histograms, ranking='cosine'):
+    results = []
+    for query in queries.values():
+        stats = QueryStats()
+        results.append(engine.search(query, user_stemming, query_operators=False, ranking=ranking, stats=stats))
+        histograms.add(stats)
+    return results
 
 # return the precision@k
 def calculate_precision_at_k(retrieved, relevant_docs):
@@ -112,21 +105,13 @@ def calculate_r_precision(relevant_docs, retrieved_docs):
 
     return r_precision_values
 
-# Function to extract and process document IDs and scores
-def extract_doc_scores(output):
-    matches = re.findall(r'(\d+): ([\d.]+)', output)
-    doc_scores = {doc_id: float(score) for doc_id, score in matches}
-
-    return doc_scores
-
 # Return dict of scores run on the IR system for each query
 def get_ir_results(queries, results):
     ir_results = {}
 
-    # Extract and process the document IDs and scores from each result
+    # Each result is already a dict of doc_id-scores returned by the search engine
     for result, (_, query_id) in zip(results, queries.items()):
-        doc_scores = extract_doc_scores(result.stdout)
-        ir_results[query_id] = doc_scores
+        ir_results[query_id] = result
 
     return ir_results
 
@@ -152,34 +137,83 @@ def get_relevant_doc_ids(extracted_qrels):
 
     return relevant_docs
 
+# Returns the MAP and the per-query R-Precision values of one ranking mode
+# With histograms, the queries are run one at a time and their stats collected instead of as one batch
+def evaluate_ranking(engine, queries, relevant_doc_ids, user_stemming, ranking='cosine', histograms=None):
+    if histograms is None:
+        results = batch_search(engine, queries, user_stemming, ranking)
+    else:
+        results = instrumented_search(engine, queries, user_stemming, histograms, ranking)
+
+    # Retrieved Docs
+    ir_results = get_ir_results(queries, results)
+    retrieved_docs = get_retrieved_docs(ir_results)
+
+    return mean_average_precision(relevant_doc_ids, retrieved_docs), calculate_r_precision(relevant_doc_ids, retrieved_docs)
+
+# Prints MAP, mean R-Precision and each query's R-Precision for several ranking modes side by side
+def print_comparison(rankings, evaluations, relevant_doc_ids):
+    print(f"{'':<22}" + ''.join(f"{ranking:>10}" for ranking in rankings))
+    print(f"{'MAP':<22}" + ''.join(f"{map_score:>10.4f}" for map_score, _ in evaluations))
+    print(f"{'Mean R-Precision':<22}" + ''.join(f"{sum(values) / len(values):>10.4f}" for _, values in evaluations))
+
+    print("R-Precision values:")
+    for i, qid in enumerate(relevant_doc_ids):
+        print(f"{f'Query {qid}':<22}" + ''.join(f"{values[i]:>10.4f}" for _, values in evaluations))
+
 def main():
 
+    usage = "Usage: eval.py <Yes/No> [ranking modes to compare: cosine bm25 bm25f] [stats] [profile | profile=<file>] [shards]"
+    if len(sys.argv) < 2:
+        print(usage)
+        return
+
     user_stemming = sys.argv[1]
+    options = [option for option in sys.argv[2:] if option in ('stats', 'shards') or option.split('=')[0] == 'profile']
+    rankings = [option for option in sys.argv[2:] if option not in options] or ['cosine']
+    if any(ranking not in RANKINGS for ranking in rankings):
+        print(usage)
+        return
     with tarfile.open('cacm.tar', 'r') as tar:
         queries = parse_queries(tar)
         extracted_qrel = parse_qrel(tar)
 
     print("Running evaluations...")
 
-    # Using multiprocessing pool to decrease processing time
-    # Uses 4 less than total CPU available to prevent using too many 
-    pool = multiprocessing.Pool(processes=(multiprocessing.cpu_count() - 4))
-    partial_query_search = partial(query_search, user_stemming=user_stemming)
-    results = pool.map(partial_query_search, queries.values())
-    pool.close()
-
-    ###### Evaluations ####### 
-
-    # Retrieved Docs
-    ir_results = get_ir_results(queries, results)
-    retrieved_docs = get_retrieved_docs(ir_results)
-    
     # Relevant Docs
     relevant_doc_ids = get_relevant_doc_ids(extracted_qrel)
 
-    # Calculate MAP, R-Precision, and R-Precision values
-    map_score = mean_average_precision(relevant_doc_ids, retrieved_docs)
-    r_precision_values = calculate_r_precision(relevant_doc_ids, retrieved_docs)
+    # stats times every query's stages, so the queries are run one by one and not answered from the result cache
+    histograms = StatsHistograms() if 'stats' in options else None
+    # shards evaluates the sharded index written by invert.py shards=<K> through its coordinator instead
+    if 'shards' in options:
+        engine = ShardedSearchEngine()
+    else:
+        engine = SearchEngine(result_cache_size=0) if histograms else SearchEngine()
+
+    # Load the index once and, for each ranking mode, score all queries together in one batched sparse matrix product
+    # profile runs the evaluation under cProfile, printing the top functions or writing them to a file
+    profile_options = [option for option in options if option.startswith('profile')]
+    try:
+        if profile_options:
+            with profiled(profile_options[0].split('=')[1] if '=' in profile_options[0] else None):
+                evaluations = [evaluate_ranking(engine, queries, relevant_doc_ids, user_stemming, ranking, histograms) for ranking in rankings]
+        else:
+            evaluations = [evaluate_ranking(engine, queries, relevant_doc_ids, user_stemming, ranking, histograms) for ranking in rankings]
+    finally:
+        # Shut down the shard worker processes, even if the evaluation failed
+        if 'shards' in options:
+            engine.close()
+
+    if histograms:
+        histograms.print_summary()
+        histograms.print_histogram('total_ms')
+
+    if len(rankings) > 1:
+        print_comparison(rankings, evaluations, relevant_doc_ids)
+        return
+
+    map_score, r_precision_values = evaluations[0]
 
     # Print the results
     print("Mean Average Precision (MAP):", map_score)
@@ -0,0 +1,111 @@
+import bisect
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+from postings import PostingsIndex, max_impacts
+from docstore import DocStore
+from scoring import CosineScorer, IMPACT_LEVELS
+
+# Optional impact-ordered copy of a segment's postings, for score-at-a-time ranked retrieval
+#
+#   impacts.bin (next to postings.bin, written by invert.py impactOrdered)
+#       header: magic, version, number of terms, total number of postings, crc32 of the postings file it was built from
+#       indptr:   int64[V + 1]    the postings of term t are at [indptr[t], indptr[t + 1])
+#       scales:   float64[V]      each term's largest normalised tf (tf / doc norm) divided by 255
+#       columns:  uint32[P]       position of each posting's doc in the segment's sorted doc ids
+#       impacts:  uint8[P]        the posting's normalised tf quantized to the term's scale, rounded down
+#
+# Within a term the postings are sorted by descending impact, then by doc. A posting's exact normalised tf is
+# in [impact * scale, (impact + 1) * scale], and the term's idf and query weight are the same for all of its
+# postings, so the order is the same as by tf-idf. CosineScorer.score_impact_ordered reads the highest
+# impacts of all query terms first and stops as soon as what is left cannot change the top k, so the many
+# low-impact postings of common terms are never read at all
+#
+# The postings file's checksum ties the layout to the index it was built from; a stale impacts.bin is ignored
+
+IMPACTS_MAGIC = b'IRIM'
+IMPACTS_VERSION = 1
+
+IMPACTS_HEADER = struct.Struct('<4sIQQI4x')
+
+# Returns the impact-ordered postings file that goes with a postings file
+def impacts_file_for(postings_file):
+    directory, name = os.path.split(postings_file)
+    return os.path.join(directory, name.replace('postings', 'impacts'))
+
+# Writes the impact-ordered layout of an index already written to the lexicon, postings and doc store files
+def write_impact_index(lexicon_file='lexicon.bin', postings_file='postings.bin', docstore_file='docstore.bin', impacts_file=None):
+
+    if impacts_file is None:
+        impacts_file = impacts_file_for(postings_file)
+
+    index = PostingsIndex(lexicon_file, postings_file)
+    docstore = DocStore(docstore_file)
+    scorer = CosineScorer(index, docstore.doc_ids, docstore.norms)
+
+    indptr = scorer.indptr.astype(np.int64)
+    columns = scorer.columns.astype(np.uint32)
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+    scales = max_impacts(scorer.normalized_tfs, indptr) / IMPACT_LEVELS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        impacts = np.nan_to_num(np.floor(scorer.normalized_tfs / scales[rows]))
+    impacts = np.clip(impacts, 0, IMPACT_LEVELS).astype(np.uint8)
+
+    order = np.lexsort((columns, -impacts.astype(np.int64), rows))
+    checksum = zlib.crc32(index.postings_map)
+
+    # The scorer's arrays are views of the mappings, so drop them before closing
+    scorer = None
+    index.close()
+    docstore.close()
+
+    with open(impacts_file, 'wb') as impacts_output:
+        impacts_output.write(IMPACTS_HEADER.pack(IMPACTS_MAGIC, IMPACTS_VERSION, len(indptr) - 1, len(columns), checksum))
+        for values in (indptr, scales, columns[order], impacts[order]):
+            impacts_output.write(values.tobytes())
+
+# Returns the impact-ordered postings of the index, or None if there are none or they are out of date
+def load_impact_index(index, impacts_file):
+    if not os.path.exists(impacts_file):
+        return None
+
+    impact_index = ImpactIndex(impacts_file)
+    if impact_index.checksum != zlib.crc32(index.postings_map) or impact_index.num_terms != index.num_terms:
+        impact_index.close()
+        return None
+
+    return impact_index
+
+# Read-only, memory-mapped impact-ordered postings written by write_impact_index
+class ImpactIndex:
+
+    def __init__(self, impacts_file):
+
+        with open(impacts_file, 'rb') as impacts_input:
+            self.impacts_map = mmap.mmap(impacts_input.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_terms, num_postings, self.checksum = IMPACTS_HEADER.unpack_from(self.impacts_map, 0)
+        if magic != IMPACTS_MAGIC or version != IMPACTS_VERSION:
+            raise ValueError(f"{impacts_file} is not a version {IMPACTS_VERSION} impacts file")
+
+        self.num_terms = num_terms
+
+        start = IMPACTS_HEADER.size
+        self.indptr = np.frombuffer(self.impacts_map, dtype=np.int64, count=num_terms + 1, offset=start)
+        start += 8 * (num_terms + 1)
+        self.scales = np.frombuffer(self.impacts_map, dtype=np.float64, count=num_terms, offset=start)
+        start += 8 * num_terms
+        self.columns = np.frombuffer(self.impacts_map, dtype=np.uint32, count=num_postings, offset=start)
+        start += 4 * num_postings
+        self.impacts = np.frombuffer(self.impacts_map, dtype=np.uint8, count=num_postings, offset=start)
+
+    # Returns where the term's postings with an impact of at least min_impact end, searching from start
+    def impact_end(self, term_id, start, min_impact):
+        return bisect.bisect_right(self.impacts, -min_impact, start, self.indptr[term_id + 1], key=lambda impact: -int(impact))
+
+    def close(self):
+        self.indptr = self.scales = self.columns = self.impacts = None
+        self.impacts_map.close()
@@ -0,0 +1,143 @@
+import cProfile
+import pstats
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# Instrumentation of the query path
+#
+# A QueryStats passed to SearchEngine.search (or search_batch, boolean_search) collects how long each stage
+# of the query took and what it did:
+#
+#   timings (seconds): refresh (manifest check and opening new segments), cache (result cache lookups),
+#       parse (query operators), analyze (stemming and lexicon lookups), weights (idfs and query vector),
+#       clauses (phrase and NEAR matching), intersect (conjunctive pre-filter), score (ranking in every
+#       segment), merge (top k of all segments), boolean (Boolean evaluation), operators (the queries of a
+#       batch with phrase or NEAR clauses, which are answered one by one), total
+#   counters: cache_hits, segments, query_terms, postings_scanned (postings read one after another),
+#       postings_probed (documents binary searched in a postings list), candidates_scored (documents whose
+#       score was computed), docs_pruned (documents with postings that were dropped before being scored),
+#       tier_fallbacks (segments where the champion lists had fewer than k documents)
+#
+# StatsHistograms aggregates many QueryStats, e.g. over an eval.py run, into percentiles and histograms,
+# and profiled() runs a block of code under cProfile
+
+COUNTERS = ('cache_hits', 'segments', 'query_terms', 'postings_scanned', 'postings_probed', 'candidates_scored', 'docs_pruned', 'tier_fallbacks')
+
+# Per-query stage timers and counters
+class QueryStats:
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    # Times the block as the stage; a stage timed more than once adds up
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    # Returns empty stats for a query run as part of this one, whose timings overlap this one's stages
+    def child(self):
+        return QueryStats()
+
+    # Adds the counters of a child's query; its timings are already covered by the stage it ran in
+    def add_counters(self, child):
+        for name, value in child.counters.items():
+            self.count(name, value)
+
+    def as_dict(self):
+        return {'timings_ms': {name: seconds * 1000 for name, seconds in self.timings.items()}, 'counters': dict(self.counters)}
+
+# Stands in for a QueryStats when nothing is collected, at the cost of a method call per stage
+class NoStats:
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, value=1):
+        pass
+
+    def child(self):
+        return self
+
+    def add_counters(self, child):
+        pass
+
+NO_STATS = NoStats()
+
+# Collects the timings (in ms) and counters of many queries
+class StatsHistograms:
+
+    def __init__(self):
+        self.values = {}
+
+    # A counter a query never touched counts as 0 for it, so every counter has a value for every query
+    def add(self, stats):
+        for name, seconds in stats.timings.items():
+            self.values.setdefault(f'{name}_ms', []).append(seconds * 1000)
+        for name in set(COUNTERS) | set(stats.counters):
+            self.values.setdefault(name, []).append(stats.counters.get(name, 0))
+
+    # Returns {metric: {'count', 'mean', 'p50', 'p95', 'p99', 'max'}}
+    def summary(self):
+        summary = {}
+        for name, values in self.values.items():
+            values = np.asarray(values, dtype=np.float64)
+            summary[name] = {
+                'count': len(values),
+                'mean': float(values.mean()),
+                'p50': float(np.percentile(values, 50)),
+                'p95': float(np.percentile(values, 95)),
+                'p99': float(np.percentile(values, 99)),
+                'max': float(values.max()),
+            }
+        return summary
+
+    # Returns the bucket edges and counts of a metric's histogram, with buckets doubling in width
+    def histogram(self, name, buckets=12):
+        values = np.asarray(self.values.get(name, []), dtype=np.float64)
+        if len(values) == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        low = max(values[values > 0].min(), 1e-6) if np.any(values > 0) else 1e-6
+        high = max(values.max(), low * 2)
+        edges = np.concatenate(([0.0], np.geomspace(low, high, buckets)))
+        counts, edges = np.histogram(values, bins=edges)
+        return edges, counts
+
+    def print_summary(self):
+        print(f"{'metric':<22}{'count':>7}{'mean':>11}{'p50':>11}{'p95':>11}{'p99':>11}{'max':>11}")
+        for name, row in sorted(self.summary().items()):
+            print(f"{name:<22}{row['count']:>7}" + ''.join(f"{row[column]:>11.3f}" for column in ('mean', 'p50', 'p95', 'p99', 'max')))
+
+    def print_histogram(self, name, width=40):
+        edges, counts = self.histogram(name)
+        if len(counts) == 0:
+            return
+
+        print(f"{name}:")
+        for low, high, count in zip(edges[:-1], edges[1:], counts):
+            bar = '#' * int(round(width * count / counts.max()))
+            print(f"  {low:>9.3f} - {high:<9.3f} {count:>6} {bar}")
+
+# Runs the block under cProfile, then writes the profile to profile_file (for pstats or snakeviz) or,
+# without one, prints the most expensive functions
+@contextmanager
+def profiled(profile_file=None, sort='cumulative', limit=30):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if profile_file:
+            profiler.dump_stats(profile_file)
+        else:
+            pstats.Stats(profiler).sort_stats(sort).print_stats(limit)
@@ -1,105 +1,258 @@
-import tarfile
-from nltk.stem import PorterStemmer
-from collections import defaultdict
 import json
 import os
 import sys
-import re
 import math
-
-def load_raw_docs_file(input_collection):    
-    # Open the .tar file
-    tar = tarfile.open(input_collection, 'r')
-
-    # Specifying file extension .all in tar file, which has all the documents
-    target_extension = '.all'
-
-    # Initialize documents dictionary and loop counter variables for the current doc ID and its content
-    documents = {}
-    current_doc_id = None
-    current_doc_content = []
-
-    # Loop through the .tar file to look for the CACM.all file and put each document in it into a dict data structure
-    for member in tar.getmembers():
-        if member.isfile() and member.name.endswith(target_extension):
-            with tar.extractfile(member) as file:
-                    
-                    # Using skip flags to indicate extraction only from sections .I, .T, .W, .B and .A
-                    # flags: False means don't skip; True means skip that section
-                    skip_content = False
-
-                    for line in file:
-                        line = line.decode('utf-8').strip()
-                        if line.startswith(".I"):
-                            if current_doc_id is not None:
-                                documents[current_doc_id] = '\n'.join(current_doc_content)
-                                current_doc_content = []
-                            # Store the content of the previous document
-                            current_doc_id = line.split()[-1]
-                            skip_content = False 
-                        elif line.startswith(".N"):
-                            # Don't want text in .N section
-                            skip_content = True  
-                        elif line.startswith(".X"):
-                            # Don't want text in .X section
-                            skip_content = True
-                        elif not skip_content:
-
-                            # Add the line to the current document content if not skipping
-                            current_doc_content.append(line)
-
-    # Store the very last document that was not part of the loop
-    if current_doc_id is not None:
-        documents[current_doc_id] = '\n'.join(current_doc_content)
-
-    tar.close()
-
+import heapq
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from collections import deque
+from itertools import islice
+from postings import write_index, IndexWriter, PostingsIndex, InvertedIndex
+from docstore import DocStoreWriter
+from corpus import iter_raw_docs
+from analyzer import get_analyzer, write_stem_table
+from segments import reset_manifest
+from impacts import impacts_file_for, write_impact_index
+from tiers import tiers_file_for, write_tier_index, DEFAULT_CHAMPIONS
+from shards import SHARD_DIR, write_shards, remove_shards
+
+# Returns every document in the collection as a {doc_id: text} dict; use corpus.iter_raw_docs to stream them instead
+def load_raw_docs_file(input_collection):
+    return dict(iter_raw_docs(input_collection))
+
+# Yields the documents unchanged after adding each one to the doc store, so the collection is only read once
+def stored_docs(documents, docstore_writer):
+    for doc_id, content in documents:
+        docstore_writer.add(doc_id, content)
+        yield doc_id, content
+
+# Accepts either a {doc_id: text} dict or a stream of (doc_id, text) pairs
+def doc_items(documents):
+    if isinstance(documents, dict):
+        return documents.items()
     return documents
 
 # If document_stemming == True, open stopwords file and use PorterStemmer
 # Else, don't do stemming, just convert to lowercase and split by space and return all terms
+# Returns the sorted inverted index and each document's stats (length in tokens and tf-idf vector norm)
 def preprocess_and_inverted_index(documents, document_stemming):
 
-    # Initialize an empty in-memory inverted index with the term, the doc ids, positions and term frequency
-    inverted_index = defaultdict(dict)
+    sorted_inverted_index, doc_stats = build_inverted_index(documents, document_stemming)
+
+    # Now that every term's df is known, add up the squared tf-idf weights of each document's terms
+    N = len(doc_stats)
+    norms = np.zeros(len(doc_stats))
+    for term in sorted_inverted_index:
+        term_idf = math.log((N/sorted_inverted_index.df(term)),10)
+        sorted_inverted_index.add_squared_weights(norms, term, term_idf)
+
+    # The index numbers the documents in the order they were added, which is also the order of doc_stats,
+    # as build_inverted_index rejects repeated doc ids
+    for stats, norm in zip(doc_stats.values(), norms.tolist()):
+        stats['norm'] = math.sqrt(norm)
+
+    return sorted_inverted_index, doc_stats
+
+# Tokenizes a document line by line, which gives the same terms as tokenizing it whole, and returns its terms
+# and the [start, end) range of term positions of its title and its abstract (.T and .W sections), for BM25F
+def document_terms(content, analyzer):
+    alphanum_terms = []
+    field_ranges = [0, 0, 0, 0]
+    field = None
+
+    for line in content.split('\n'):
+        # A section label line ends the previous field
+        if len(line) == 2 and line[0] == '.':
+            if field is not None:
+                field_ranges[field + 1] = len(alphanum_terms)
+            field = {'.T': 0, '.W': 2}.get(line)
+
+        alphanum_terms.extend(analyzer.tokens(line))
+
+        if len(line) == 2 and line[0] == '.' and field is not None:
+            field_ranges[field] = len(alphanum_terms)
+
+    if field is not None:
+        field_ranges[field + 1] = len(alphanum_terms)
+
+    return alphanum_terms, field_ranges
 
-    # Iterate through each document in the input dict of documents and process each term
-    for doc_id, content in documents.items():
+# Tokenizes the documents into a sorted inverted index; doc_stats only has the doc lengths and field ranges
+# filled in, since the norms need the df of every term in the whole collection
+def build_inverted_index(documents, document_stemming):
 
-        # Tokenize the document by turning each term to lowercase and split by whitespace
-        pattern = "[^0-9a-zA-Z\s]+"
-        terms = content.lower().split()
+    # Initialize an empty in-memory inverted index of each term's doc ids, positions and term frequencies
+    inverted_index = InvertedIndex()
 
-        alphanum_terms = [re.sub(pattern, "", c).strip() for c in terms]
+    # Per-document length in tokens and full tf-idf vector length, used to normalise cosine scores
+    doc_stats = {}
 
-        # Only execute if user wants stemming
-        if document_stemming:
-            stemmer = PorterStemmer()
+    # Stop words and the stemmer are loaded once and shared by every document
+    analyzer = get_analyzer(document_stemming)
+    if document_stemming:
+        analyzer.collect_stems()
 
-            # Load stop words from the provided text file into a set
-            with open('stopwords.txt', 'r') as stopword_file:
-                stop_words = set(stopword_file.read().splitlines())
+    # Iterate through each document in the input documents and process each term
+    for doc_id, content in doc_items(documents):
 
-            alphanum_terms = [stemmer.stem(word) for word in alphanum_terms if word not in stop_words and word != ""]
+        # The index numbers documents in the order they are added, which must stay the order of doc_stats
+        if doc_id in doc_stats:
+            raise ValueError(f"Document {doc_id} appears more than once in the collection")
+
+        # Tokenize the document by turning each term to lowercase, split by whitespace and, if stemming, stem it
+        alphanum_terms, field_ranges = document_terms(content, analyzer)
 
         total_term_count = len(alphanum_terms)
-        
-        # Get info about the term's position
-        term_positions = {}
-        for position, term in enumerate(alphanum_terms):
-            if term in term_positions:
-                term_positions[term].append(position)
-            else:
-                term_positions[term] = [position]
+        doc_stats[doc_id] = {'length': total_term_count, 'fields': field_ranges, 'norm': 0.0}
 
-        # Add the term positions and its term frequency in that doc_id to the inverted index
-        for term, positions in term_positions.items():
-            inverted_index[term][doc_id] = {'positions': positions, 'term frequency': ((math.log(len(positions),10) + 1))}
+        # Add the positions of each of the doc's terms to the inverted index
+        inverted_index.add_document(doc_id, alphanum_terms)
 
     # sort alphabetically
-    sorted_inverted_index = {term: inverted_index[term] for term in sorted(inverted_index)}
+    inverted_index.sort_terms()
+
+    return inverted_index, doc_stats
+
+# Pool worker: indexes one shard of documents and writes it as a partial binary index in shard_dir
+# Returns the partial index's file names, the stats of the shard's docs, without norms, and the words the
+# worker stemmed for the first time, for the stem table
+def index_shard(shard_number, shard_docs, document_stemming, shard_dir):
+    shard_index, shard_stats = build_inverted_index(shard_docs, document_stemming)
+
+    lexicon_file = os.path.join(shard_dir, f'lexicon_{shard_number}.bin')
+    postings_file = os.path.join(shard_dir, f'postings_{shard_number}.bin')
+    write_index(shard_index, None, lexicon_file, postings_file)
+
+    return lexicon_file, postings_file, shard_stats, get_analyzer(document_stemming).take_new_stems()
+
+# Yields (term, shard number, term id) for every term of a partial index, in lexicon order
+def shard_terms(shard_number, shard_index):
+    for term_id in range(len(shard_index)):
+        yield shard_index.term(term_id), shard_number, term_id
+
+# k-way merges the sorted lexicons of the partial indexes into the final lexicon and postings files
+# Only one term's postings are held in memory at a time; each doc's norm is accumulated as its terms go by
+# shard_deleted optionally gives each shard's deleted doc ids, which are left out (see update.merge_segments)
+def merge_shard_indexes(shard_files, doc_stats, lexicon_file='lexicon.bin', postings_file='postings.bin', shard_deleted=None):
+
+    shard_indexes = [PostingsIndex(shard_lexicon, shard_postings) for shard_lexicon, shard_postings in shard_files]
+    writer = IndexWriter(lexicon_file, postings_file)
+    N = len(doc_stats)
+
+    merged_terms = heapq.merge(*[shard_terms(i, shard_index) for i, shard_index in enumerate(shard_indexes)])
+    current_term = None
+    term_shards = []
+
+    for term, shard_number, term_id in list_with_end(merged_terms):
+        if term != current_term and current_term is not None:
+            doc_ids, pos_ends, positions = merge_term_postings([shard_indexes[i].postings(j) for i, j in term_shards], None if shard_deleted is None else [shard_deleted[i] for i, j in term_shards])
+
+            # A term whose documents were all deleted is dropped from the lexicon
+            if len(doc_ids) > 0:
+                term_idf = math.log((N/len(doc_ids)),10)
+                for doc_id, f in zip(doc_ids.tolist(), np.diff(pos_ends, prepend=0).tolist()):
+                    doc_stats[str(doc_id)]['norm'] += ((math.log(f,10) + 1)*term_idf) ** 2
+
+                writer.add_term(current_term, doc_ids, pos_ends, positions)
+            term_shards = []
+
+        current_term = term
+        term_shards.append((shard_number, term_id))
+
+    for stats in doc_stats.values():
+        stats['norm'] = math.sqrt(stats['norm'])
+
+    writer.close(doc_stats)
+
+    for shard_index in shard_indexes:
+        shard_index.close()
+
+    return doc_stats
+
+# Yields every item of the merged terms followed by a sentinel, so the last term group also gets flushed
+def list_with_end(merged_terms):
+    yield from merged_terms
+    yield None, None, None
+
+# Concatenates one term's postings from several shards (in shard order) into doc-id-sorted arrays,
+# leaving out the docs in each shard's deleted doc ids if given
+def merge_term_postings(shard_postings, shard_deleted=None):
+    doc_ids = np.concatenate([postings.doc_ids for postings in shard_postings])
+    freqs = np.concatenate([postings.freqs for postings in shard_postings])
+    positions = np.concatenate([postings.all_positions for postings in shard_postings])
 
-    return sorted_inverted_index
+    if shard_deleted is not None:
+        live = np.concatenate([~np.isin(postings.doc_ids, deleted) for postings, deleted in zip(shard_postings, shard_deleted)])
+        if not live.all():
+            positions = positions[np.repeat(live, freqs)]
+            doc_ids, freqs = doc_ids[live], freqs[live]
+
+    # Shards normally hold increasing doc id ranges; if not, put the postings back in doc id order
+    if np.any(np.diff(doc_ids) < 0):
+        order = np.argsort(doc_ids, kind='stable')
+        doc_starts = np.cumsum(freqs) - freqs
+        positions = np.concatenate([positions[doc_starts[i]:doc_starts[i] + freqs[i]] for i in order])
+        doc_ids, freqs = doc_ids[order], freqs[order]
+
+    return doc_ids, np.cumsum(freqs), positions
+
+# Builds the binary index with a process pool: the documents are split into shards of shard_size docs,
+# each shard is tokenized, stemmed and written as a partial index by a worker, and the partial indexes
+# are then k-way merged. At most two shards per worker are in flight at once, so memory is bounded by
+# the shard size rather than the collection size
+def parallel_inverted_index(documents, document_stemming, shard_size=500, processes=None, lexicon_file='lexicon.bin', postings_file='postings.bin'):
+
+    processes = processes or multiprocessing.cpu_count()
+    shard_dir = tempfile.mkdtemp(prefix='shards_', dir='.')
+
+    shard_files = []
+    doc_stats = {}
+
+    try:
+        with multiprocessing.Pool(processes=processes) as pool:
+            pending = deque()
+            documents = iter(doc_items(documents))
+            shard_number = 0
+
+            while True:
+                shard_docs = dict(islice(documents, shard_size))
+                if shard_docs:
+                    pending.append(pool.apply_async(index_shard, (shard_number, shard_docs, document_stemming, shard_dir)))
+                    shard_number += 1
+
+                # Collect finished shards in order once enough are queued, or when there are no docs left
+                while pending and (len(pending) >= 2 * processes or not shard_docs):
+                    shard_lexicon, shard_postings, shard_stats, shard_stems = pending.popleft().get()
+                    shard_files.append((shard_lexicon, shard_postings))
+                    repeated = next((doc_id for doc_id in shard_stats if doc_id in doc_stats), None)
+                    if repeated is not None:
+                        raise ValueError(f"Document {repeated} appears more than once in the collection")
+                    doc_stats.update(shard_stats)
+                    get_analyzer(document_stemming).remember_stems(shard_stems)
+
+                if not shard_docs:
+                    break
+
+        merge_shard_indexes(shard_files, doc_stats, lexicon_file, postings_file)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return doc_stats
+
+# Reads the binary index back into the original {term: {doc_id: {'positions', 'term frequency'}}} format of the JSON export
+def read_inverted_index(lexicon_file='lexicon.bin', postings_file='postings.bin'):
+    index = PostingsIndex(lexicon_file, postings_file)
+    inverted_index = {}
+
+    for term_id in range(len(index)):
+        postings = index.postings(term_id)
+        inverted_index[index.term(term_id)] = {str(doc_id): {'positions': postings.positions(i), 'term frequency': tf} for i, (doc_id, tf) in enumerate(zip(postings.doc_ids.tolist(), postings.tfs.tolist()))}
+
+    index.close()
+
+    return inverted_index
 
 def create_output_files(inverted_index):
 
@@ -120,37 +273,96 @@ def create_output_files(inverted_index):
 
 def main():
 
-    if len(sys.argv) < 2:
-        print(f"No collection file found as input!\nUsage: invert.py <collection tar file> < 'stemOn' or 'stemOff' >")
+    if len(sys.argv) < 3:
+        print(f"No collection file found as input!\nUsage: invert.py <collection tar file> < 'stemOn' or 'stemOff' > [exportJson] [parallel] [shardSize=<docs per shard>] [impactOrdered] [champions | champions=<docs per term>] [shards=<number of shards>]")
     else:
         while True:
 
             print(f"Hello! This program will create an inverted index from a given set of documents.")
 
             input_collection = sys.argv[1]
-
-            raw_docs = load_raw_docs_file(input_collection)
-            
             user_stemming = sys.argv[2]
-            
-            if user_stemming == "stemOn":
-                print(f"Documents pre-processing with stemming...")
-                inverted_index = preprocess_and_inverted_index(raw_docs, True)
-            elif user_stemming == "stemOff":
-                print(f"Documents pre-processing without stemming...")
-                inverted_index = preprocess_and_inverted_index(raw_docs, False)
-            else:
+            options = sys.argv[3:]
+
+            if user_stemming not in ("stemOn", "stemOff"):
                 print(f"Invalid Input! Please only enter stemOff or stemOn to disable/enable stemming")
                 break
 
-            # Export the inverted index to files
-            create_output_files(inverted_index)
+            document_stemming = user_stemming == "stemOn"
+            shard_size = 500
+            champions = None
+            num_shards = None
+            for option in options:
+                if option.startswith("shardSize="):
+                    shard_size = int(option.split("=")[1])
+                elif option == "champions":
+                    champions = DEFAULT_CHAMPIONS
+                elif option.startswith("champions="):
+                    champions = int(option.split("=")[1])
+                elif option.startswith("shards="):
+                    num_shards = int(option.split("=")[1])
+
+            # Stream the documents out of the tar file, writing each to the doc store as it goes by
+            docstore_writer = DocStoreWriter()
+            raw_docs = stored_docs(iter_raw_docs(input_collection), docstore_writer)
+
+            if document_stemming:
+                print(f"Documents pre-processing with stemming...")
+            else:
+                print(f"Documents pre-processing without stemming...")
 
-            if os.path.exists('terms_dict.json') and os.path.exists('postings_dict.json'):
-                print(f"Both files were successfully created!")
+            # Write the binary lexicon and postings files and the doc store used by search.py
+            if "parallel" in options:
+                print(f"Building the index in shards of {shard_size} documents with {multiprocessing.cpu_count()} processes...")
+                doc_stats = parallel_inverted_index(raw_docs, document_stemming, shard_size)
+            else:
+                inverted_index, doc_stats = preprocess_and_inverted_index(raw_docs, document_stemming)
+                write_index(inverted_index, doc_stats)
+
+            docstore_writer.close(doc_stats)
+
+            # Save the stem of every word in the collection, so queries rarely need to load NLTK (see analyzer.py)
+            if document_stemming:
+                write_stem_table(get_analyzer(True).collected_stems)
+
+            # Optionally also write the postings in impact order for score-at-a-time ranking (see impacts.py)
+            if "impactOrdered" in options:
+                print(f"Writing the impact-ordered postings...")
+                write_impact_index()
+            elif os.path.exists(impacts_file_for('postings.bin')):
+                os.remove(impacts_file_for('postings.bin'))
+
+            # Optionally also write each term's champion list, the high tier of a tiered index (see tiers.py)
+            if champions is not None:
+                print(f"Writing the champion lists of the top {champions} documents per term...")
+                write_tier_index(champions)
+            elif os.path.exists(tiers_file_for('postings.bin')):
+                os.remove(tiers_file_for('postings.bin'))
+
+            # Optionally also split the index into document-partitioned shards for ShardedSearchEngine (see shards.py)
+            if num_shards is not None:
+                print(f"Splitting the index into {num_shards} shards...")
+                write_shards(num_shards, document_stemming, "impactOrdered" in options, champions)
+            elif os.path.exists(SHARD_DIR):
+                remove_shards()
+
+            # The new index replaces any segments added or merged into the previous one by update.py
+            reset_manifest(document_stemming)
+
+            if os.path.exists('lexicon.bin') and os.path.exists('postings.bin') and os.path.exists('docstore.bin'):
+                print(f"All index files were successfully created!")
             else:
-                print(f"Uh oh! There was an error creating both files!")
+                print(f"Uh oh! There was an error creating the index files!")
+
+            # Optionally also export the inverted index as the original JSON files, read back from the binary index
+            if "exportJson" in options:
+                create_output_files(read_inverted_index())
+
+                if os.path.exists('terms_dict.json') and os.path.exists('postings_dict.json'):
+                    print(f"Both JSON files were successfully exported!")
+                else:
+                    print(f"Uh oh! There was an error exporting both JSON files!")
             break
-    
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,623 @@
+import math
+import mmap
+import struct
+import sys
+import zlib
+import numpy as np
+from array import array
+from cache import LRUCache, DEFAULT_POSTINGS_CACHE_BYTES
+
+# Binary on-disk inverted index made of two files:
+#
+#   lexicon.bin  - the sorted term lexicon
+#       header: magic, version, number of terms, length of the term string blob, hash table size
+#       block_offsets: uint64[V + 1]  byte offset of each term's postings block in postings.bin
+#       int_offsets:   uint64[V + 1]  number of encoded integers in postings.bin before each term's block
+#       max_scores:    float64[V]     largest normalised tf (tf / doc norm) of each term in any doc; times the
+#                                     term's idf, an upper bound on its contribution to a cosine score
+#       dfs:           uint32[V]      document frequency of each term
+#       term_offsets:  uint32[V + 1]  offset of each term's utf-8 string in the term blob
+#       term_table:    uint32[T]      open-addressing hash table of term id + 1 (0 = empty slot)
+#       term blob:     all terms concatenated in sorted order
+#
+#   postings.bin - one contiguous block per term, in lexicon order, of variable-byte encoded integers
+#       header: magic, version, total number of postings
+#       per term block:
+#           skip doc ids:  S integers     every 64th doc id from the 65th on, as gaps to the previous skip doc id
+#           skip offsets:  S integers     byte offset of the same postings' doc id gaps from the start of the
+#                                         doc id gaps, as gaps to the previous skip offset
+#           doc id gaps:   df integers    difference to the previous doc id (the first is the doc id itself)
+#           freqs:         df integers    f, the count of the term in each doc; tf = log10(f) + 1
+#           position gaps: sum f integers difference to the previous position in the same doc
+#
+# Each integer is stored 7 bits per byte, low bits first, with the high bit set on its last byte. Since
+# the whole postings file is one stream of such integers, it can also be decoded in a single vectorized
+# pass (all_postings), which is how the scorer loads the collection. The number of skips S is
+# (df - 1) // 64, so it is known from the df. The skips let a conjunctive query test a few doc ids against
+# a long postings list (filter_doc_ids) by decoding only the 64-posting chunks those doc ids can be in
+#
+# Both files are opened with mmap, so opening the index does not read the postings, and a term's
+# postings are sliced straight out of the mapping without parsing any other term.
+# Exact term lookups go through the stored hash table, so they cost O(1) whatever the vocabulary size;
+# prefix and range lookups binary search the sorted lexicon
+
+LEXICON_MAGIC = b'IRLX'
+POSTINGS_MAGIC = b'IRPS'
+INDEX_VERSION = 6
+
+LEXICON_HEADER = struct.Struct('<4sIIII')
+POSTINGS_HEADER = struct.Struct('<4sIQ')
+
+SKIP_INTERVAL = 64
+
+# Returns the typed array as little-endian bytes
+def to_bytes(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+# Returns tf = log10(f) + 1 for every count f in freqs, as float64. math.log is applied to each distinct
+# count, rather than np.log10 to every posting, so the tfs are exactly those the document norms were
+# computed from and the binary index reads back the same values the JSON export always held
+def log_tfs(freqs):
+    values, inverse = np.unique(np.asarray(freqs, dtype=np.int64), return_inverse=True)
+    return np.array([math.log(f, 10) + 1 for f in values.tolist()], dtype=np.float64)[inverse.ravel()]
+
+# Returns each term's largest impact, given the impacts of all postings and the CSR row pointers
+def max_impacts(impacts, indptr):
+    max_scores = np.zeros(len(indptr) - 1, dtype=np.float64)
+    nonempty = np.flatnonzero(np.diff(indptr) > 0)
+    if len(nonempty) > 0:
+        max_scores[nonempty] = np.maximum.reduceat(impacts, indptr[:-1][nonempty])
+    return max_scores
+
+# Decodes the doc ids and freqs of every term at once from the integers of a whole postings file, given each
+# term's df and where its block starts among them; returns the CSR row pointers, doc ids and freqs
+def decode_doc_postings(values, dfs, int_offsets):
+    indptr = np.zeros(len(dfs) + 1, dtype=np.int64)
+    np.cumsum(dfs, out=indptr[1:])
+
+    # Index of every posting's doc id gap in the decoded values, after the term's skips; its freq comes df values later
+    gap_indexes = np.repeat(int_offsets[:-1] + 2 * num_skips(dfs) - indptr[:-1], dfs) + np.arange(indptr[-1])
+    gaps = values[gap_indexes]
+    freqs = values[gap_indexes + np.repeat(dfs, dfs)]
+
+    # Undo the doc id gaps with one running sum, then restart it at each term's first posting
+    running = np.cumsum(gaps)
+    firsts = indptr[:-1][dfs > 0]
+    doc_ids = running - np.repeat(running[firsts] - gaps[firsts], dfs[dfs > 0])
+
+    return indptr, doc_ids, freqs
+
+# Returns the number of skip pointers stored in a postings list of df postings (works on arrays of dfs too)
+def num_skips(df):
+    return np.maximum(df - 1, 0) // SKIP_INTERVAL
+
+# Returns the number of bytes each non-negative integer takes when variable-byte encoded
+def vbyte_lengths(values):
+    values = np.asarray(values, dtype=np.uint64)
+
+    # Number of 7-bit groups needed by each value
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        num_bytes += values >= (np.uint64(1) << np.uint64(shift))
+
+    return num_bytes
+
+# Variable-byte encodes non-negative integers into bytes, vectorized with NumPy
+def vbyte_encode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = vbyte_lengths(values)
+
+    starts = np.cumsum(num_bytes) - num_bytes
+    encoded = np.zeros(int(num_bytes.sum()), dtype=np.uint8)
+
+    for group in range(int(num_bytes.max(initial=0))):
+        has_group = num_bytes > group
+        encoded[starts[has_group] + group] = (values[has_group] >> np.uint64(7 * group)) & np.uint64(0x7f)
+
+    # Mark the last byte of every value
+    encoded[starts + num_bytes - 1] |= 0x80
+
+    return encoded.tobytes()
+
+# Decodes a buffer of variable-byte encoded integers into an int64 array, vectorized with NumPy
+def vbyte_decode(data):
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    if len(encoded) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    last_bytes = encoded >= 0x80
+    starts = np.concatenate(([0], np.flatnonzero(last_bytes)[:-1] + 1))
+
+    # Position of every byte within its value, to shift its 7 bits into place
+    value_numbers = np.cumsum(last_bytes) - last_bytes
+    groups = np.arange(len(encoded)) - starts[value_numbers]
+    shifted = (encoded & 0x7f).astype(np.int64) << (7 * groups)
+
+    return np.add.reduceat(shifted, starts)
+
+# Decodes only the first count integers at the start of the buffer
+def vbyte_decode_prefix(data, count):
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    return vbyte_decode(encoded[:np.flatnonzero(encoded >= 0x80)[count - 1] + 1])
+
+def term_hash(key):
+    return zlib.crc32(key)
+
+# Builds a linear probing hash table (kept at most half full) mapping each term to its id in the sorted lexicon
+def build_term_table(encoded_terms):
+    table_size = 1
+    while table_size < 2 * len(encoded_terms):
+        table_size *= 2
+
+    term_table = array('I', [0]) * table_size
+    mask = table_size - 1
+
+    for term_id, key in enumerate(encoded_terms):
+        slot = term_hash(key) & mask
+        while term_table[slot] != 0:
+            slot = (slot + 1) & mask
+        term_table[slot] = term_id + 1
+
+    return term_table
+
+# Streams terms, in sorted order, into the binary lexicon and postings files
+# Postings blocks are written as terms are added, so only the lexicon arrays are kept in memory
+class IndexWriter:
+
+    def __init__(self, lexicon_file='lexicon.bin', postings_file='postings.bin'):
+        self.lexicon_file = lexicon_file
+        self.postings_file = postings_file
+
+        self.encoded_terms = []
+        self.block_offsets = array('Q')
+        self.int_offsets = array('Q', [0])
+        self.dfs = array('I')
+        self.total_postings = 0
+
+        self.postings_output = open(postings_file, 'wb')
+        self.postings_output.write(POSTINGS_HEADER.pack(POSTINGS_MAGIC, INDEX_VERSION, 0))
+        self.offset = POSTINGS_HEADER.size
+
+    # Appends one term's postings; doc_ids must be sorted and pos_ends index into positions
+    def add_term(self, term, doc_ids, pos_ends, positions):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        pos_ends = np.asarray(pos_ends, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+
+        freqs = np.diff(pos_ends, prepend=0)
+
+        # Positions restart at each doc, so each doc's first gap is from 0
+        position_gaps = np.diff(positions, prepend=0)
+        position_gaps[pos_ends[:-1]] = positions[pos_ends[:-1]]
+
+        # Skip to every SKIP_INTERVAL-th posting: its doc id and where its gap starts in the doc id gaps
+        doc_gaps = np.diff(doc_ids, prepend=0)
+        skip_rows = np.arange(1, num_skips(len(doc_ids)) + 1) * SKIP_INTERVAL
+        gap_offsets = np.cumsum(vbyte_lengths(doc_gaps)) - vbyte_lengths(doc_gaps)
+        skips = np.concatenate((np.diff(doc_ids[skip_rows], prepend=0), np.diff(gap_offsets[skip_rows], prepend=0)))
+
+        block = vbyte_encode(np.concatenate((skips, doc_gaps, freqs, position_gaps)))
+        self.postings_output.write(block)
+
+        self.block_offsets.append(self.offset)
+        self.offset += len(block)
+        self.int_offsets.append(self.int_offsets[-1] + len(skips) + 2 * len(doc_ids) + len(positions))
+
+        self.encoded_terms.append(term.encode('utf-8'))
+        self.dfs.append(len(doc_ids))
+        self.total_postings += len(doc_ids)
+
+    # Finishes the postings file and writes the lexicon
+    # doc_stats holds each doc's tf-idf vector norm, used for the per-term max score bounds; partial
+    # indexes that do not know the final norms yet pass None and get max scores of 0
+    def close(self, doc_stats=None):
+        self.block_offsets.append(self.offset)
+
+        # Go back and fill in the total postings count now that it is known
+        self.postings_output.seek(0)
+        self.postings_output.write(POSTINGS_HEADER.pack(POSTINGS_MAGIC, INDEX_VERSION, self.total_postings))
+        self.postings_output.close()
+
+        max_scores = array('d', [0.0]) * len(self.dfs)
+        if doc_stats is not None and len(self.dfs) > 0:
+            # Norms sorted by doc id, so every posting's norm is gathered with one searchsorted
+            doc_ids = np.fromiter((int(doc_id) for doc_id in doc_stats), dtype=np.int64, count=len(doc_stats))
+            norms = np.fromiter((stats['norm'] for stats in doc_stats.values()), dtype=np.float64, count=len(doc_stats))
+            order = np.argsort(doc_ids)
+            doc_ids, norms = doc_ids[order], norms[order]
+
+            # Reread every term's doc ids and tfs from the finished postings file in one vectorized pass
+            with open(self.postings_file, 'rb') as postings_input:
+                postings_input.seek(POSTINGS_HEADER.size)
+                values = vbyte_decode(postings_input.read())
+            dfs = np.frombuffer(self.dfs, dtype=np.uint32).astype(np.int64)
+            int_offsets = np.frombuffer(self.int_offsets, dtype=np.uint64).astype(np.int64)
+            indptr, postings_doc_ids, freqs = decode_doc_postings(values, dfs, int_offsets)
+
+            # Documents with a norm of 0 have no weight in any term and add nothing to the bounds
+            posting_norms = norms[np.searchsorted(doc_ids, postings_doc_ids)]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                normalized_tfs = np.where(posting_norms > 0, log_tfs(freqs) / posting_norms, 0.0)
+            max_scores = array('d', max_impacts(normalized_tfs, indptr).tobytes())
+
+        term_offsets = array('I', [0])
+        for key in self.encoded_terms:
+            term_offsets.append(term_offsets[-1] + len(key))
+        term_blob = b''.join(self.encoded_terms)
+        term_table = build_term_table(self.encoded_terms)
+
+        with open(self.lexicon_file, 'wb') as lexicon_output:
+            lexicon_output.write(LEXICON_HEADER.pack(LEXICON_MAGIC, INDEX_VERSION, len(self.encoded_terms), len(term_blob), len(term_table)))
+            lexicon_output.write(to_bytes(self.block_offsets))
+            lexicon_output.write(to_bytes(self.int_offsets))
+            lexicon_output.write(to_bytes(max_scores))
+            lexicon_output.write(to_bytes(self.dfs))
+            lexicon_output.write(to_bytes(term_offsets))
+            lexicon_output.write(to_bytes(term_table))
+            lexicon_output.write(term_blob)
+
+# Writes the in-memory inverted index (an InvertedIndex) to the binary files
+# doc_stats holds each doc's tf-idf vector norm, used for the per-term max score bounds
+def write_index(inverted_index, doc_stats, lexicon_file='lexicon.bin', postings_file='postings.bin'):
+
+    writer = IndexWriter(lexicon_file, postings_file)
+
+    for term in sorted(inverted_index):
+        writer.add_term(term, *inverted_index.term_postings(term))
+
+    writer.close(doc_stats)
+
+# One term's postings in an InvertedIndex, in the order their documents were added
+class PostingsList:
+
+    __slots__ = ('doc_numbers', 'freqs', 'position_starts')
+
+    def __init__(self):
+        self.doc_numbers = array('i')
+        self.freqs = array('I')
+        self.position_starts = array('Q')
+
+    def __len__(self):
+        return len(self.doc_numbers)
+
+# In-memory inverted index that invert.py and update.py build before writing it with write_index
+#
+# Each term's postings are a PostingsList of typed arrays: the number of each posting's document (the
+# order the documents were added in, mapped to doc ids by doc_ids), the count of the term in it, and where
+# its positions start in the positions array shared by every term. That is 16 bytes per posting and 4 per
+# position, instead of a dict of positions and tf per posting. Whole postings lists come out as NumPy arrays
+class InvertedIndex:
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_ids = array('i')
+        self.positions = array('i')
+
+    def __len__(self):
+        return len(self.postings)
+
+    def __iter__(self):
+        return iter(self.postings)
+
+    def __contains__(self, term):
+        return term in self.postings
+
+    def __getitem__(self, term):
+        return self.postings[term]
+
+    def df(self, term):
+        return len(self.postings[term])
+
+    # Adds the postings of a document, given its terms in order
+    def add_document(self, doc_id, terms):
+        doc_number = len(self.doc_ids)
+        self.doc_ids.append(int(doc_id))
+
+        # Get info about the term's position
+        term_positions = {}
+        for position, term in enumerate(terms):
+            if term in term_positions:
+                term_positions[term].append(position)
+            else:
+                term_positions[term] = [position]
+
+        for term, positions in term_positions.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = PostingsList()
+            postings.doc_numbers.append(doc_number)
+            postings.freqs.append(len(positions))
+            postings.position_starts.append(len(self.positions))
+            self.positions.extend(positions)
+
+    # Puts the terms in sorted order, which is the order they are iterated and written in
+    def sort_terms(self):
+        self.postings = {term: self.postings[term] for term in sorted(self.postings)}
+
+    # Returns the term's tf, log10(f) + 1, in each posting
+    def tfs(self, term):
+        return log_tfs(np.frombuffer(self.postings[term].freqs, dtype=np.uint32))
+
+    # Adds the square of the term's tf-idf weight in each of its documents to norms, indexed by doc number
+    def add_squared_weights(self, norms, term, idf):
+        norms[np.frombuffer(self.postings[term].doc_numbers, dtype=np.int32)] += (self.tfs(term) * idf) ** 2
+
+    # Returns the term's doc ids, sorted, their position ends and the positions, as IndexWriter.add_term takes them
+    def term_postings(self, term):
+        postings = self.postings[term]
+
+        doc_ids = np.frombuffer(self.doc_ids, dtype=np.int32)[np.frombuffer(postings.doc_numbers, dtype=np.int32)]
+        order = np.argsort(doc_ids, kind='stable')
+        freqs = np.frombuffer(postings.freqs, dtype=np.uint32).astype(np.int64)[order]
+        starts = np.frombuffer(postings.position_starts, dtype=np.uint64).astype(np.int64)[order]
+
+        # Gather each document's positions, in doc id order, out of the shared positions array
+        pos_ends = np.cumsum(freqs)
+        positions = np.frombuffer(self.positions, dtype=np.int32)[np.repeat(starts - (pos_ends - freqs), freqs) + np.arange(pos_ends[-1])]
+
+        return doc_ids[order], pos_ends, positions
+
+# A single term's postings, decoded from its block of the postings file
+# Doc ids and tfs are decoded up front; positions only when they are first asked for
+class TermPostings:
+
+    __slots__ = ('df', 'doc_ids', 'freqs', 'tfs', 'pos_ends', 'position_gaps', 'decoded_positions')
+
+    def __init__(self, block, df):
+        self.df = df
+
+        values = vbyte_decode(block)[2 * num_skips(df):] if df > 0 else np.zeros(0, dtype=np.int64)
+        self.doc_ids = np.cumsum(values[:df])
+        self.freqs = values[df:2 * df]
+        self.tfs = log_tfs(self.freqs)
+        self.pos_ends = np.cumsum(self.freqs)
+        self.position_gaps = values[2 * df:]
+        self.decoded_positions = None
+
+    def __len__(self):
+        return self.df
+
+    # Bytes held by the decoded postings, counting the positions whether or not they are decoded yet
+    def nbytes(self):
+        return self.doc_ids.nbytes + self.freqs.nbytes + self.tfs.nbytes + self.pos_ends.nbytes + 2 * self.position_gaps.nbytes
+
+    # All of the term's positions, doc after doc; pos_ends marks where each doc's positions end
+    @property
+    def all_positions(self):
+        if self.decoded_positions is None:
+            # Undo the gaps with one running sum, then restart the sum at each doc's first position
+            running = np.cumsum(self.position_gaps)
+            doc_starts = self.pos_ends - self.freqs
+            self.decoded_positions = running - np.repeat(running[doc_starts] - self.position_gaps[doc_starts], self.freqs)
+        return self.decoded_positions
+
+    # Returns the positions of the term in the i-th document of the postings list
+    def positions(self, i):
+        return self.all_positions[self.pos_ends[i] - self.freqs[i]:self.pos_ends[i]].tolist()
+
+# Read-only, memory-mapped view of the lexicon and postings files written by write_index
+class PostingsIndex:
+
+    def __init__(self, lexicon_file='lexicon.bin', postings_file='postings.bin', cache_bytes=DEFAULT_POSTINGS_CACHE_BYTES):
+
+        if sys.byteorder != 'little':
+            raise ValueError("The binary index can only be read on little-endian machines")
+
+        with open(lexicon_file, 'rb') as lexicon_input:
+            self.lexicon_map = mmap.mmap(lexicon_input.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(postings_file, 'rb') as postings_input:
+            self.postings_map = mmap.mmap(postings_input.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_terms, blob_length, table_size = LEXICON_HEADER.unpack_from(self.lexicon_map, 0)
+        if magic != LEXICON_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{lexicon_file} is not a version {INDEX_VERSION} lexicon file")
+
+        magic, version, self.total_postings = POSTINGS_HEADER.unpack_from(self.postings_map, 0)
+        if magic != POSTINGS_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{postings_file} is not a version {INDEX_VERSION} postings file")
+
+        self.num_terms = num_terms
+
+        # Slice the lexicon arrays out of the mapping without copying them
+        self.lexicon_view = memoryview(self.lexicon_map)
+        lexicon = self.lexicon_view
+        start = LEXICON_HEADER.size
+        self.block_offsets = lexicon[start:start + 8 * (num_terms + 1)].cast('Q')
+        start += 8 * (num_terms + 1)
+        self.int_offsets = lexicon[start:start + 8 * (num_terms + 1)].cast('Q')
+        start += 8 * (num_terms + 1)
+        self.max_scores = lexicon[start:start + 8 * num_terms].cast('d')
+        start += 8 * num_terms
+        self.dfs = lexicon[start:start + 4 * num_terms].cast('I')
+        start += 4 * num_terms
+        self.term_offsets = lexicon[start:start + 4 * (num_terms + 1)].cast('I')
+        start += 4 * (num_terms + 1)
+        self.term_table = lexicon[start:start + 4 * table_size].cast('I')
+        self.table_mask = table_size - 1
+        start += 4 * table_size
+        self.term_blob = lexicon[start:start + blob_length]
+
+        self.postings_view = memoryview(self.postings_map)
+
+        # Recently decoded postings lists and doc id lists, keyed by ('postings' or 'doc_ids', term id)
+        self.postings_cache = LRUCache(cache_bytes, size_of=lambda postings: postings.nbytes if isinstance(postings, np.ndarray) else postings.nbytes())
+
+    def __len__(self):
+        return self.num_terms
+
+    def __contains__(self, term):
+        return self.term_id(term) is not None
+
+    # Returns the term string stored at position term_id of the sorted lexicon
+    def term(self, term_id):
+        return bytes(self.term_key(term_id)).decode('utf-8')
+
+    def term_key(self, term_id):
+        return self.term_blob[self.term_offsets[term_id]:self.term_offsets[term_id + 1]]
+
+    # Looks the term up in the stored hash table; returns the term's id or None if it is not in the index
+    def term_id(self, term):
+        key = term.encode('utf-8')
+        slot = term_hash(key) & self.table_mask
+
+        while True:
+            entry = self.term_table[slot]
+            if entry == 0:
+                return None
+            if self.term_key(entry - 1) == key:
+                return entry - 1
+            slot = (slot + 1) & self.table_mask
+
+    # Binary search of the sorted lexicon; returns the id of the first term that is >= key
+    def lower_bound(self, key):
+        low, high = 0, self.num_terms
+
+        while low < high:
+            mid = (low + high) // 2
+            if bytes(self.term_key(mid)) < key:
+                low = mid + 1
+            else:
+                high = mid
+
+        return low
+
+    # Returns the ids of all terms that start with prefix, which are contiguous in the sorted lexicon
+    def prefix_range(self, prefix):
+        key = prefix.encode('utf-8')
+        # 0xff never appears in utf-8, so every term starting with the prefix sorts before prefix + 0xff
+        return range(self.lower_bound(key), self.lower_bound(key + b'\xff'))
+
+    # Returns the ids of all terms t with low <= t < high (high=None means up to the end of the lexicon)
+    def term_range(self, low, high=None):
+        start = self.lower_bound(low.encode('utf-8'))
+        end = self.num_terms if high is None else self.lower_bound(high.encode('utf-8'))
+        return range(start, max(start, end))
+
+    # Returns the terms that start with prefix, in sorted order
+    def prefix_terms(self, prefix):
+        return [self.term(term_id) for term_id in self.prefix_range(prefix)]
+
+    def df(self, term_id):
+        return self.dfs[term_id]
+
+    # Returns the postings of a term by its id, decoding only that term's block of the mapped file
+    # Lists decoded recently are returned from the cache and must not be modified
+    def postings(self, term_id):
+        postings = self.postings_cache.get(('postings', term_id))
+        if postings is None:
+            block = self.postings_view[self.block_offsets[term_id]:self.block_offsets[term_id + 1]]
+            postings = TermPostings(block, self.dfs[term_id])
+            self.postings_cache.put(('postings', term_id), postings)
+        return postings
+
+    # Returns a term's doc ids, decoding only its skips and doc id gaps (read-only, as they may be cached)
+    def doc_ids(self, term_id):
+        df = self.dfs[term_id]
+        if df == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        doc_ids = self.postings_cache.get(('doc_ids', term_id))
+        if doc_ids is None:
+            block = self.postings_view[self.block_offsets[term_id]:self.block_offsets[term_id + 1]]
+            skips = int(num_skips(df))
+            doc_ids = np.cumsum(vbyte_decode_prefix(block, 2 * skips + df)[2 * skips:])
+            doc_ids.flags.writeable = False
+            self.postings_cache.put(('doc_ids', term_id), doc_ids)
+        return doc_ids
+
+    # Returns the doc ids, from a sorted array of them, that are in the term's postings list
+    # When there are few of them, the skips are binary searched and only the chunks of doc id gaps the
+    # doc ids can fall in are decoded, so a long list is never decoded in full
+    def filter_doc_ids(self, term_id, doc_ids):
+        df = self.dfs[term_id]
+        skips = int(num_skips(df))
+
+        if skips == 0 or len(doc_ids) * SKIP_INTERVAL >= df:
+            term_doc_ids = self.doc_ids(term_id)
+            found = np.minimum(np.searchsorted(term_doc_ids, doc_ids), df - 1)
+            return doc_ids[term_doc_ids[found] == doc_ids] if df > 0 else doc_ids[:0]
+
+        block = self.postings_view[self.block_offsets[term_id]:self.block_offsets[term_id + 1]]
+
+        # The 2 * skips skip values are read from at most 20 * skips bytes: each is an integer below 2^64, which
+        # takes at most 10 bytes as vbyte (in practice doc ids and offsets below 2^35 take at most 5)
+        skip_values = vbyte_decode_prefix(block[:20 * skips], 2 * skips)
+        gaps_start = int(vbyte_lengths(skip_values).sum())
+        skip_doc_ids = np.cumsum(skip_values[:skips])
+        chunk_starts = gaps_start + np.concatenate(([0], np.cumsum(skip_values[skips:])))
+
+        # Chunk c holds postings [c * SKIP_INTERVAL, (c + 1) * SKIP_INTERVAL); chunk c > 0 starts at skip c - 1
+        chunks = np.searchsorted(skip_doc_ids, doc_ids, side='right')
+        found = np.zeros(len(doc_ids), dtype=bool)
+
+        # Doc ids are 32-bit, so each doc id gap of a chunk takes at most 5 bytes
+        for chunk in np.unique(chunks).tolist():
+            count = min(SKIP_INTERVAL, df - chunk * SKIP_INTERVAL)
+            gaps = vbyte_decode_prefix(block[chunk_starts[chunk]:chunk_starts[chunk] + 5 * count], count)
+            chunk_doc_ids = np.cumsum(gaps)
+            if chunk > 0:
+                chunk_doc_ids += skip_doc_ids[chunk - 1] - gaps[0]
+
+            in_chunk = np.flatnonzero(chunks == chunk)
+            rows = np.minimum(np.searchsorted(chunk_doc_ids, doc_ids[in_chunk]), count - 1)
+            found[in_chunk] = chunk_doc_ids[rows] == doc_ids[in_chunk]
+
+        return doc_ids[found]
+
+    # Decodes the doc ids and freqs of every term at once; returns (indptr, doc_ids, freqs) where the
+    # postings of term t are at [indptr[t], indptr[t + 1]). With with_positions, also returns every
+    # posting's positions, posting after posting, so those of posting i end at cumsum(freqs)[i]
+    # With term_ids, only those terms' postings are decoded (through the postings cache) and every other
+    # term's list is left empty, so a query can be scored without decoding the rest of the index
+    def all_postings(self, with_positions=False, term_ids=None):
+        if term_ids is not None:
+            return self.term_subset_postings(sorted(set(term_ids)), with_positions)
+
+        values = vbyte_decode(self.postings_view[POSTINGS_HEADER.size:])
+
+        dfs = np.frombuffer(self.dfs, dtype=np.uint32).astype(np.int64)
+        int_offsets = np.frombuffer(self.int_offsets, dtype=np.uint64).astype(np.int64)
+        indptr, doc_ids, freqs = decode_doc_postings(values, dfs, int_offsets)
+
+        if not with_positions:
+            return indptr, doc_ids, freqs
+
+        # Each term's position gaps follow its freqs and run to the start of the next term's block
+        position_starts = int_offsets[:-1] + 2 * num_skips(dfs) + 2 * dfs
+        position_counts = int_offsets[1:] - position_starts
+        position_gaps = values[np.repeat(position_starts - (np.cumsum(position_counts) - position_counts), position_counts) + np.arange(position_counts.sum())]
+
+        # Same running sum trick for positions, restarting at each posting's first position
+        running = np.cumsum(position_gaps)
+        posting_starts = np.cumsum(freqs) - freqs
+        positions = running - np.repeat(running[posting_starts] - position_gaps[posting_starts], freqs)
+
+        return indptr, doc_ids, freqs, positions
+
+    # all_postings for only the given sorted term ids
+    def term_subset_postings(self, term_ids, with_positions):
+        postings = [self.postings(term_id) for term_id in term_ids]
+
+        indptr = np.zeros(self.num_terms + 1, dtype=np.int64)
+        indptr[np.asarray(term_ids, dtype=np.int64) + 1] = [len(term_postings) for term_postings in postings]
+        np.cumsum(indptr, out=indptr)
+
+        doc_ids = np.concatenate([term_postings.doc_ids for term_postings in postings] + [np.zeros(0, dtype=np.int64)])
+        freqs = np.concatenate([term_postings.freqs for term_postings in postings] + [np.zeros(0, dtype=np.int64)])
+        if not with_positions:
+            return indptr, doc_ids, freqs
+
+        positions = np.concatenate([term_postings.all_positions for term_postings in postings] + [np.zeros(0, dtype=np.int64)])
+        return indptr, doc_ids, freqs, positions
+
+    def close(self):
+        self.postings_cache.clear()
+
+        # Derived views have to be released before the mappings they point into can be closed
+        for view in (self.block_offsets, self.int_offsets, self.max_scores, self.dfs, self.term_offsets, self.term_table, self.term_blob, self.lexicon_view, self.postings_view):
+            view.release()
+        self.lexicon_map.close()
+        self.postings_map.close()
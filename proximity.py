@@ -0,0 +1,146 @@
+import re
+import numpy as np
+from analyzer import get_analyzer
+
+# Phrase and proximity operators, matched against the term positions stored in the postings
+#
+#   "information retrieval"        the terms appear next to each other, in that order
+#   parallel NEAR/3 sorting        the two terms appear within 3 positions of each other, in either order
+#   a NEAR/2 b NEAR/5 c            every neighbouring pair in the chain is within its distance
+#
+# A clause is matched by first intersecting the doc ids of its terms' postings, rarest term first, with
+# binary searches that skip across the longer lists, and then only for the docs in all of them merging the
+# sorted position lists: each position is turned into a (doc, position) key, so a phrase is one sorted
+# intersection of the shifted keys and a NEAR window is one pair of binary searches per position
+#
+# Positions count index terms, so with stemming the stop words removed from the documents do not count
+
+QUERY_TOKEN = re.compile(r'"[^"]*"|\S+')
+NEAR_OPERATOR = re.compile(r'^NEAR/(\d+)$')
+
+# Splits a query into all of its words, for the cosine score, and its phrase and NEAR clauses
+# Returns (words, clauses), where a clause is ('phrase', [words]) or ('near', [words], [distances])
+def parse_query(user_string):
+    words = []
+    clauses = []
+    tokens = QUERY_TOKEN.findall(user_string)
+    chain_end = None
+
+    for i, token in enumerate(tokens):
+        near = NEAR_OPERATOR.match(token)
+
+        if token.startswith('"'):
+            phrase = token.strip('"').split()
+            words.extend(phrase)
+            if phrase:
+                clauses.append(('phrase', phrase))
+
+        elif near and 0 < i < len(tokens) - 1 and not tokens[i - 1].startswith('"') and not tokens[i + 1].startswith('"'):
+            # Extend the chain the previous word already ends, or start a new one
+            if chain_end == i - 1:
+                clauses[-1][1].append(tokens[i + 1])
+                clauses[-1][2].append(int(near.group(1)))
+            else:
+                clauses.append(('near', [tokens[i - 1], tokens[i + 1]], [int(near.group(1))]))
+            chain_end = i + 1
+
+        else:
+            words.append(token)
+
+    return words, clauses
+
+# Returns the doc ids of the segment's documents that match the clause
+def clause_matches(index, clause, user_stemming):
+    analyzer = get_analyzer(user_stemming == 'Yes')
+
+    if clause[0] == 'phrase':
+        terms = analyzer.tokens(' '.join(clause[1]))
+        if len(terms) == 0:
+            return None
+        return phrase_matches(index, terms)
+
+    # Operands that are stop words have no positions, so their pairs are left out of the chain
+    operands = [analyzer.tokens(word) for word in clause[1]]
+    pairs = [(operands[i][0], operands[i + 1][0], distance) for i, distance in enumerate(clause[2]) if operands[i] and operands[i + 1]]
+    if len(pairs) == 0:
+        return None
+
+    doc_ids = None
+    for term, other_term, distance in pairs:
+        pair_doc_ids = near_matches(index, term, other_term, distance)
+        doc_ids = pair_doc_ids if doc_ids is None else np.intersect1d(doc_ids, pair_doc_ids, assume_unique=True)
+
+    return doc_ids
+
+# Returns the doc ids found in every postings list and, for each list, the rows of those docs in it
+# The candidates start as the shortest list and are binary searched in each longer one
+def intersect_postings(postings_lists):
+    doc_ids = min(postings_lists, key=len).doc_ids
+
+    for postings in sorted(postings_lists, key=len):
+        if len(doc_ids) == 0:
+            break
+        found = np.searchsorted(postings.doc_ids, doc_ids)
+        found[found == len(postings.doc_ids)] = 0
+        doc_ids = doc_ids[postings.doc_ids[found] == doc_ids]
+
+    return doc_ids, [np.searchsorted(postings.doc_ids, doc_ids) for postings in postings_lists]
+
+# Returns, for the given rows of a postings list, the number of the row each position belongs to and the positions
+def gather_positions(postings, rows):
+    freqs = postings.freqs[rows]
+    starts = postings.pos_ends[rows] - freqs
+
+    row_numbers = np.repeat(np.arange(len(rows)), freqs)
+    within_doc = np.arange(freqs.sum()) - np.repeat(np.cumsum(freqs) - freqs, freqs)
+
+    return row_numbers, postings.all_positions[np.repeat(starts, freqs) + within_doc]
+
+# Returns the postings of each term, or None if one of them is not in the segment
+def terms_postings(index, terms):
+    term_ids = [index.term_id(term) for term in terms]
+    if any(term_id is None for term_id in term_ids):
+        return None
+    return [index.postings(term_id) for term_id in term_ids]
+
+# Returns the doc ids of the documents containing the terms as a phrase
+def phrase_matches(index, terms):
+    postings_lists = terms_postings(index, terms)
+    if postings_lists is None:
+        return np.zeros(0, dtype=np.int64)
+
+    doc_ids, rows = intersect_postings(postings_lists)
+    if len(doc_ids) == 0 or len(terms) == 1:
+        return doc_ids
+
+    gathered = [gather_positions(postings, term_rows) for postings, term_rows in zip(postings_lists, rows)]
+    span = max(int(positions.max()) for row_numbers, positions in gathered) + len(terms) + 1
+
+    # The i-th term of an occurrence starting at position p is at p + i, so the phrase starts are the
+    # (doc, position - i) keys shared by all terms
+    starts = None
+    for i, (row_numbers, positions) in enumerate(gathered):
+        keys = row_numbers * span + positions - i + len(terms)
+        starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=True)
+
+    return doc_ids[np.unique(starts // span)]
+
+# Returns the doc ids of the documents where the two terms occur within distance positions of each other
+def near_matches(index, term, other_term, distance):
+    postings_lists = terms_postings(index, [term, other_term])
+    if postings_lists is None:
+        return np.zeros(0, dtype=np.int64)
+
+    doc_ids, rows = intersect_postings(postings_lists)
+    if len(doc_ids) == 0:
+        return doc_ids
+
+    (row_numbers, positions), (other_row_numbers, other_positions) = [gather_positions(postings, term_rows) for postings, term_rows in zip(postings_lists, rows)]
+    span = max(int(positions.max()), int(other_positions.max())) + distance + 1
+
+    # Keys are sorted doc by doc, and the span keeps every window inside its own doc
+    keys = row_numbers * span + positions
+    other_keys = other_row_numbers * span + other_positions
+    hits = np.searchsorted(other_keys, keys + distance, side='right') > np.searchsorted(other_keys, keys - distance, side='left')
+
+    return doc_ids[np.unique(row_numbers[hits])]
@@ -0,0 +1,460 @@
+import numpy as np
+from instrument import NO_STATS
+from postings import log_tfs, max_impacts
+
+# Largest quantized impact of a posting in impacts.py
+IMPACT_LEVELS = 255
+
+# Vectorized tf-idf cosine scoring over one segment of the index
+#
+# The segment is held as a sparse term-document matrix in CSR form: row t holds the tf of term t in every
+# document that contains it, i.e. exactly the term's postings list. idfs are passed in at query time from
+# the statistics of the whole index, so every segment scores on the same scale. Scoring a query only slices
+# the rows of its terms and does one sparse mat-vec, so the work depends on the postings touched, not on
+# the collection or vocabulary size.
+#
+# Top-k queries are answered term-at-a-time with MaxScore pruning (score_maxscore): terms are processed
+# from the highest upper bound down, and once the k-th best partial score beats what the remaining terms
+# could still add, no new document can enter the top k, so the remaining postings lists are only probed
+# for the surviving candidates instead of being scanned. If the segment also has impact-ordered postings
+# (see impacts.py), top-k queries are answered score-at-a-time by score_impact_ordered instead, and with
+# champion lists (see tiers.py) only the champions of the query terms are scored by score_tiered
+#
+# With term_ids, only the rows of those terms are filled in, which ranks their queries the same at a
+# fraction of the cost of loading the whole segment. The pruned top-k scorers work on the CSR arrays
+# directly; SciPy takes a while to import, so the SciPy matrix is only built, and SciPy imported, the first
+# time the exhaustive or batch scorer needs it
+class CosineScorer:
+
+    def __init__(self, index, doc_ids, doc_norms, impact_index=None, term_ids=None, tier_index=None):
+
+        # Decode every term's doc ids and freqs from the compressed postings in one vectorized pass
+        indptr, postings_doc_ids, freqs = index.all_postings(term_ids=term_ids)
+        tfs = log_tfs(freqs)
+
+        # Columns are positions in the sorted list of doc ids
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        columns = np.searchsorted(self.doc_ids, postings_doc_ids)
+
+        self.set_postings(indptr, columns, tfs)
+
+        # Full tf-idf vector lengths precomputed by invert.py
+        self.doc_norms = np.frombuffer(doc_norms, dtype=np.float64)
+
+        # Postings tfs already divided by their document's norm, and each term's largest such value
+        # (stored by invert.py), for the term-at-a-time scorer
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.normalized_tfs = np.nan_to_num(tfs / self.doc_norms[columns])
+        self.max_scores = np.frombuffer(index.max_scores, dtype=np.float64)
+
+        # 1 for every live document and 0 for the deleted ones, which never make it into the results
+        self.live = np.ones(len(self.doc_ids), dtype=np.float64)
+
+        self.impact_index = impact_index
+        self.tier_index = tier_index
+
+    # Sets the CSR arrays of the term-document matrix: the postings of term t are columns[indptr[t]:indptr[t + 1]]
+    # and their values data[indptr[t]:indptr[t + 1]]
+    def set_postings(self, indptr, columns, data):
+        self.indptr = indptr
+        # Columns are doc positions within one segment, which fit in 32 bits
+        self.columns = columns.astype(np.int32, copy=False)
+        self.data = data
+        self.csr_matrix = None
+
+    # The term-document matrix as a SciPy sparse matrix
+    @property
+    def matrix(self):
+        if self.csr_matrix is None:
+            from scipy.sparse import csr_matrix
+            self.csr_matrix = csr_matrix((self.data, self.columns, self.indptr), shape=(len(self.indptr) - 1, len(self.doc_ids)))
+        return self.csr_matrix
+
+    # Returns an array with 1 for the segment's documents among the doc ids and 0 for all others
+    def doc_mask(self, doc_ids):
+        mask = np.zeros(len(self.doc_ids), dtype=np.float64)
+
+        doc_ids = np.asarray(sorted(doc_ids), dtype=np.int32)
+        columns = np.searchsorted(self.doc_ids, doc_ids)
+        found = columns < len(self.doc_ids)
+        columns, doc_ids = columns[found], doc_ids[found]
+        mask[columns[self.doc_ids[columns] == doc_ids]] = 1.0
+
+        return mask
+
+    # Marks exactly the given doc ids of this segment as deleted
+    def set_deleted(self, doc_ids):
+        self.live = 1.0 - self.doc_mask(doc_ids)
+
+    # Returns the top-k (doc_id, score) pairs for the query, best first
+    #   term_ids:      ids of the unique query terms in this segment's lexicon
+    #   query_weights: the query's weight for each of those terms, divided by the length of the query vector
+    #   idfs:          the idf of each of those terms over the whole index
+    #   doc_filter:    optional array with 1 for the documents that may be ranked and 0 for the rest
+    #   doc_boosts:    optional array of extra score for each document, e.g. for proximity matches
+    #   candidates:    optional sorted doc ids that are the only documents to score, e.g. from a Boolean pre-filter
+    # Each document is normalised by the length of its full tf-idf vector. Without a weight_threshold or
+    # boosts the exact top-k is found with MaxScore pruning; otherwise every document containing a query term
+    # is scored, and with a weight_threshold only documents with a query-term weight above it are ranked
+    # The postings read and documents scored and pruned are counted in stats (see instrument.py)
+    def score(self, term_ids, query_weights, idfs, k=20, weight_threshold=None, doc_filter=None, doc_boosts=None, candidates=None, stats=NO_STATS):
+
+        if len(term_ids) == 0:
+            return []
+
+        query_weights = np.asarray(query_weights, dtype=np.float64)
+        idfs = np.asarray(idfs, dtype=np.float64)
+        live = self.live if doc_filter is None else self.live * doc_filter
+
+        if candidates is not None:
+            return self.score_candidates(term_ids, query_weights * idfs, idfs, k, live, np.searchsorted(self.doc_ids, candidates), weight_threshold, doc_boosts, stats)
+
+        if weight_threshold is None and doc_boosts is None:
+            if self.tier_index is not None:
+                return self.score_tiered(term_ids, query_weights * idfs, idfs, k, live, stats)
+            if self.impact_index is not None:
+                return self.score_impact_ordered(term_ids, query_weights * idfs, idfs, k, live, stats)
+            return self.score_maxscore(term_ids, query_weights * idfs, k, live, stats)
+
+        rows = self.matrix[term_ids]
+        dot_products = rows.T @ (query_weights * idfs)
+        stats.count('postings_scanned', rows.nnz)
+
+        if weight_threshold is None:
+            candidates = np.flatnonzero((np.diff(rows.tocsc().indptr) > 0) & (live > 0))
+        else:
+            max_weights = rows.multiply(idfs[:, None]).max(axis=0).toarray().ravel()
+            candidates = np.flatnonzero((max_weights > weight_threshold) & (live > 0))
+            stats.count('docs_pruned', np.count_nonzero((max_weights > 0) & (live > 0)) - len(candidates))
+        stats.count('candidates_scored', len(candidates))
+        if len(candidates) == 0:
+            return []
+
+        scores = dot_products[candidates] / self.doc_norms[candidates]
+        if doc_boosts is not None:
+            scores = scores + doc_boosts[candidates]
+
+        return self.top_k(candidates, scores, k)
+
+    # Returns the results of score() for a list of (term_ids, query_weights, idfs) queries
+    # The queries are stacked into a sparse query-term matrix and scored against every document in one
+    # sparse matrix product, which ranks exactly like score_maxscore. With champion lists, which only rank
+    # some of the documents, or a weight_threshold, the queries are scored one by one instead
+    def score_batch(self, queries, k=20, weight_threshold=None, stats=NO_STATS):
+        from scipy.sparse import csr_matrix
+
+        if weight_threshold is not None or self.tier_index is not None:
+            return [self.score(term_ids, query_weights, idfs, k, weight_threshold, stats=stats) for term_ids, query_weights, idfs in queries]
+
+        indptr = np.cumsum([0] + [len(term_ids) for term_ids, query_weights, idfs in queries])
+        term_ids = np.concatenate([np.asarray(term_ids, dtype=np.int64) for term_ids, query_weights, idfs in queries] + [np.zeros(0, dtype=np.int64)])
+        weights = np.concatenate([np.asarray(query_weights, dtype=np.float64) * np.asarray(idfs, dtype=np.float64) for term_ids, query_weights, idfs in queries] + [np.zeros(0)])
+        query_matrix = csr_matrix((weights, term_ids, indptr), shape=(len(queries), self.matrix.shape[0]))
+        stats.count('postings_scanned', np.sum(self.indptr[term_ids + 1] - self.indptr[term_ids]))
+
+        # Row q holds the dot products of query q with every document that shares a term with it
+        dot_products = (query_matrix @ self.matrix).tocsr()
+
+        results = []
+        for q in range(len(queries)):
+            start, end = dot_products.indptr[q], dot_products.indptr[q + 1]
+            candidates = dot_products.indices[start:end]
+            live = self.live[candidates] > 0
+            candidates = candidates[live]
+            stats.count('candidates_scored', len(candidates))
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = np.nan_to_num(dot_products.data[start:end][live] / self.doc_norms[candidates])
+
+            results.append(self.top_k(candidates, scores, k))
+
+        return results
+
+    # Scores only the candidate columns, by binary searching them in each query term's postings
+    def score_candidates(self, term_ids, term_weights, idfs, k, live, candidates, weight_threshold=None, doc_boosts=None, stats=NO_STATS):
+
+        candidates = candidates[live[candidates] > 0]
+        stats.count('candidates_scored', len(candidates))
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        max_weights = np.zeros(len(candidates), dtype=np.float64)
+
+        for term_id, term_weight, idf in zip(term_ids, term_weights, idfs):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            columns = self.columns[start:end]
+            if len(columns) == 0:
+                continue
+
+            stats.count('postings_probed', len(candidates))
+            found = np.minimum(np.searchsorted(columns, candidates), len(columns) - 1)
+            hits = columns[found] == candidates
+            scores[hits] += term_weight * self.normalized_tfs[start:end][found[hits]]
+            max_weights[hits] = np.maximum(max_weights[hits], self.data[start:end][found[hits]] * idf)
+
+        if weight_threshold is not None:
+            keep = max_weights > weight_threshold
+            stats.count('docs_pruned', len(candidates) - np.count_nonzero(keep))
+            candidates, scores = candidates[keep], scores[keep]
+        if doc_boosts is not None:
+            scores = scores + doc_boosts[candidates]
+
+        return self.top_k(candidates, scores, k)
+
+    # Term-at-a-time top-k with MaxScore pruning; returns the same ranking as exhaustive cosine scoring
+    # term_weights are the query weights already multiplied by the idfs of the terms, and only documents
+    # with a non-zero live value are ranked
+    def score_maxscore(self, term_ids, term_weights, k=20, live=None, stats=NO_STATS):
+
+        if live is None:
+            live = self.live
+
+        # Upper bound of each term's contribution to any doc's score, with a little slack for rounding
+        bounds = term_weights * self.max_scores[term_ids] * (1 + 1e-9)
+        order = np.argsort(-bounds, kind='stable')
+
+        # remaining[i] is the most that the terms after the i-th processed one can add to a score
+        remaining = np.concatenate((np.cumsum(bounds[order][::-1])[::-1][1:], [0.0]))
+
+        accumulators = np.zeros(len(self.doc_ids), dtype=np.float64)
+        touched = np.zeros(len(self.doc_ids), dtype=bool)
+        candidates = None
+        threshold = 0.0
+
+        for i, position in enumerate(order):
+            term_id = term_ids[position]
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            columns = self.columns[start:end]
+            # Deleted and filtered out docs get nothing, so they can never push the threshold up
+            weights = self.normalized_tfs[start:end] * live[columns]
+
+            if candidates is None:
+                # OR mode: every doc in the postings list gets an accumulator
+                accumulators[columns] += term_weights[position] * weights
+                touched[columns] = True
+                stats.count('postings_scanned', len(columns))
+
+                # Partial scores only grow, so the k-th best of them is a lower bound on the final k-th score
+                if np.count_nonzero(touched) >= k:
+                    threshold = np.partition(accumulators, -k)[-k]
+
+                # Docs not seen yet can score at most remaining[i], so only existing accumulators can still make the top k
+                if threshold > remaining[i]:
+                    candidates = np.flatnonzero(touched & (accumulators + remaining[i] >= threshold))
+            else:
+                # AND mode: binary search the candidates in the postings list instead of scanning all of it
+                found = np.searchsorted(columns, candidates)
+                found[found == len(columns)] = 0
+                stats.count('postings_probed', len(candidates))
+                hits = columns[found] == candidates
+                accumulators[candidates[hits]] += term_weights[position] * weights[found[hits]]
+
+                candidates = candidates[accumulators[candidates] + remaining[i] >= threshold]
+                if len(candidates) >= k:
+                    threshold = max(threshold, np.partition(accumulators[candidates], -k)[-k])
+
+        if candidates is None:
+            candidates = np.flatnonzero(touched)
+        candidates = candidates[live[candidates] > 0]
+        stats.count('candidates_scored', len(candidates))
+        stats.count('docs_pruned', np.count_nonzero(touched & (live > 0)) - len(candidates))
+
+        return self.top_k(candidates, accumulators[candidates], k)
+
+    # Score-at-a-time top-k over the impact-ordered postings; returns the same ranking as score_maxscore
+    # The postings of all query terms are read in rounds, from the highest contribution (term weight times
+    # quantized impact) down, halving the contribution a posting needs each round. A document's quantized
+    # partial score is a lower bound on its score, and adding the quantization error of the postings read so
+    # far and the most the unread postings could add gives an upper bound. Once the k-th best lower bound
+    # beats what an unseen document could score and only a few documents could still make the top k, the
+    # rest of the postings are skipped and just those documents are scored exactly
+    def score_impact_ordered(self, term_ids, term_weights, idfs, k=20, live=None, stats=NO_STATS):
+
+        if live is None:
+            live = self.live
+
+        impact_index = self.impact_index
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        starts = impact_index.indptr[term_ids].tolist()
+        ends = impact_index.indptr[term_ids + 1].tolist()
+
+        # Contribution of one quantum of impact of each term
+        steps = term_weights * impact_index.scales[term_ids]
+        min_step = steps[steps > 0].min() if np.any(steps > 0) else 0.0
+
+        # Bounds are widened by a little slack for rounding
+        lower_bounds = np.zeros(len(self.doc_ids), dtype=np.float64)
+        errors = np.zeros(len(self.doc_ids), dtype=np.float64)
+        touched = np.zeros(len(self.doc_ids), dtype=bool)
+        positions = list(starts)
+
+        level = steps.max() * (IMPACT_LEVELS + 1)
+        candidates = None
+
+        while candidates is None:
+            level = level / 2 if min_step > 0 and level / 2 >= min_step else 0.0
+
+            # Read every term's postings down to the round's level, then add them all up at once
+            slices = []
+            for i, term_id in enumerate(term_ids.tolist()):
+                if positions[i] == ends[i] or (steps[i] == 0 and level > 0):
+                    continue
+
+                end = ends[i] if level == 0 else impact_index.impact_end(term_id, positions[i], int(np.ceil(level / steps[i])))
+                if end > positions[i]:
+                    slices.append((i, positions[i], end))
+                    positions[i] = end
+
+            if slices:
+                columns = np.concatenate([impact_index.columns[start:end] for i, start, end in slices])
+                impacts = np.concatenate([impact_index.impacts[start:end] * steps[i] for i, start, end in slices])
+                quanta = np.repeat([steps[i] for i, start, end in slices], [end - start for i, start, end in slices])
+                lower_bounds += np.bincount(columns, weights=impacts, minlength=len(lower_bounds)) * (1 - 1e-9)
+                errors += np.bincount(columns, weights=quanta, minlength=len(errors)) * (1 + 2e-9)
+                touched[columns] = True
+                stats.count('postings_scanned', len(columns))
+
+            # The most the unread postings of each term could still add to a document
+            remaining = sum(steps[i] * (int(impact_index.impacts[positions[i]]) + 1) for i in range(len(term_ids)) if positions[i] < ends[i]) * (1 + 1e-9)
+
+            seen = touched & (live > 0)
+            if level > 0 and (lower_bounds.max() <= remaining or np.count_nonzero(seen) < k):
+                continue
+
+            seen_lower_bounds = lower_bounds[seen]
+            threshold = np.partition(seen_lower_bounds, -k)[-k] if len(seen_lower_bounds) >= k else 0.0
+
+            if level == 0:
+                candidates = np.flatnonzero(seen & (lower_bounds + errors >= threshold))
+            elif threshold > remaining:
+                # No unseen document can make the top k; stop once scoring the seen ones that still can
+                # probes fewer postings than are left to read
+                possible = np.flatnonzero(seen & (lower_bounds + errors + remaining >= threshold))
+                if len(possible) * len(term_ids) <= sum(ends) - sum(positions):
+                    candidates = possible
+
+        stats.count('docs_pruned', np.count_nonzero(seen) - len(candidates))
+        return self.score_candidates(term_ids, term_weights, idfs, k, live, candidates, stats=stats)
+
+    # Champion list top-k: scores exactly only the documents in the query terms' champion lists, the high
+    # tier, and falls back to all of their postings when fewer than k of those documents are live
+    # A term whose whole postings list is its champion list, as for most terms, is simply scanned; only the
+    # longer terms are probed for the candidates, by binary search in their full postings
+    def score_tiered(self, term_ids, term_weights, idfs, k=20, live=None, stats=NO_STATS):
+
+        if live is None:
+            live = self.live
+
+        champions = [self.tier_index.champions(term_id) for term_id in term_ids]
+        candidates = np.unique(np.concatenate(champions)).astype(np.int64)
+        candidates = candidates[live[candidates] > 0]
+
+        if len(candidates) < k:
+            stats.count('tier_fallbacks')
+            if self.impact_index is not None:
+                return self.score_impact_ordered(term_ids, term_weights, idfs, k, live, stats)
+            return self.score_maxscore(term_ids, term_weights, k, live, stats)
+
+        stats.count('candidates_scored', len(candidates))
+        accumulators = np.zeros(len(self.doc_ids), dtype=np.float64)
+
+        for term_id, term_weight, term_champions in zip(term_ids, term_weights, champions):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            columns = self.columns[start:end]
+
+            if len(term_champions) == len(columns):
+                accumulators[columns] += term_weight * self.normalized_tfs[start:end]
+                stats.count('postings_scanned', len(columns))
+                continue
+
+            stats.count('postings_scanned', len(term_champions))
+            stats.count('postings_probed', len(candidates))
+            found = np.minimum(np.searchsorted(columns, candidates), len(columns) - 1)
+            hits = columns[found] == candidates
+            accumulators[candidates[hits]] += term_weight * self.normalized_tfs[start:end][found[hits]]
+
+        return self.top_k(candidates, accumulators[candidates], k)
+
+    # Partitions out the top-k (doc_id, score) pairs in linear time, then sorts only those by score (ties by doc id)
+    def top_k(self, candidates, scores, k):
+
+        if k <= 0:
+            return []
+
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            # Keep every candidate tied with the k-th score so ties are broken by doc id, not by partition order
+            top = np.flatnonzero(scores >= scores[top].min())
+        else:
+            top = np.arange(len(candidates))
+
+        order = np.lexsort((self.doc_ids[candidates[top]], -scores[top]))[:k]
+        top = top[order]
+
+        return list(zip(self.doc_ids[candidates[top]].tolist(), scores[top].tolist()))
+
+# Okapi BM25 over one segment of the index, precomputed as impact scores
+#
+# Each posting of the term-document matrix holds the term's saturated, length-normalised tf in that doc,
+#   f * (k1 + 1) / (f + k1 * (1 - b + b * doc length / average doc length))
+# so a query only adds up query tf * idf * impact over its terms' postings, with the same MaxScore, batch
+# and candidate scoring as CosineScorer (documents are not normalised again, so their norms are all 1).
+# The average length is that of the whole index, from the totals invert.py stores in the doc stores
+class BM25Scorer(CosineScorer):
+
+    def __init__(self, index, doc_ids, doc_lengths, avg_length, k1=1.2, b=0.75, term_ids=None):
+
+        indptr, postings_doc_ids, freqs = index.all_postings(term_ids=term_ids)
+
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        columns = np.searchsorted(self.doc_ids, postings_doc_ids)
+        lengths = np.frombuffer(doc_lengths, dtype=np.uint32)[columns]
+
+        impacts = freqs * (k1 + 1) / (freqs + k1 * (1 - b + b * lengths / avg_length))
+        self.set_impacts(indptr, columns, impacts)
+
+    def set_impacts(self, indptr, columns, impacts):
+        self.set_postings(indptr, columns, impacts)
+        self.doc_norms = np.ones(len(self.doc_ids), dtype=np.float64)
+        self.normalized_tfs = impacts
+        self.max_scores = max_impacts(impacts, indptr)
+        self.live = np.ones(len(self.doc_ids), dtype=np.float64)
+        self.impact_index = None
+        self.tier_index = None
+
+# BM25F over the title, the abstract and the rest of each document, precomputed as impact scores
+#
+# A term's occurrences are split between the fields by the token ranges of the title and abstract that
+# invert.py stores for every doc. Each field's count is weighted and normalised by the field's length
+# against its average, and the sum saturated once, as in BM25:
+#   pseudo f = sum over fields of weight * f_field / (1 - b + b * field length / average field length)
+#   impact   = pseudo f * (k1 + 1) / (pseudo f + k1)
+class BM25FScorer(BM25Scorer):
+
+    FIELD_WEIGHTS = (2.0, 1.0, 1.0)
+
+    def __init__(self, index, doc_ids, doc_lengths, field_ranges, avg_lengths, field_weights=FIELD_WEIGHTS, k1=1.2, b=0.75, term_ids=None):
+
+        indptr, postings_doc_ids, freqs, positions = index.all_postings(with_positions=True, term_ids=term_ids)
+
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        columns = np.searchsorted(self.doc_ids, postings_doc_ids)
+
+        # Title and abstract [start, end) token ranges, and the length of the title, abstract and the rest of each doc
+        ranges = np.frombuffer(field_ranges, dtype=np.uint32).reshape(-1, 4).astype(np.int64)
+        doc_field_lengths = np.stack((ranges[:, 1] - ranges[:, 0], ranges[:, 3] - ranges[:, 2]), axis=1)
+        doc_field_lengths = np.column_stack((doc_field_lengths, np.frombuffer(doc_lengths, dtype=np.uint32) - doc_field_lengths.sum(axis=1)))
+
+        # Count each posting's positions that fall in the title and in the abstract
+        posting_numbers = np.repeat(np.arange(len(freqs)), freqs)
+        position_ranges = ranges[columns[posting_numbers]]
+        in_title = (positions >= position_ranges[:, 0]) & (positions < position_ranges[:, 1])
+        in_abstract = (positions >= position_ranges[:, 2]) & (positions < position_ranges[:, 3])
+        field_freqs = np.stack((np.bincount(posting_numbers[in_title], minlength=len(freqs)), np.bincount(posting_numbers[in_abstract], minlength=len(freqs))), axis=1)
+        field_freqs = np.column_stack((field_freqs, freqs - field_freqs.sum(axis=1)))
+
+        pseudo_freqs = np.zeros(len(freqs), dtype=np.float64)
+        for field, (weight, avg_length) in enumerate(zip(field_weights, avg_lengths)):
+            length_ratio = doc_field_lengths[columns, field] / avg_length if avg_length > 0 else 1.0
+            pseudo_freqs += weight * field_freqs[:, field] / (1 - b + b * length_ratio)
+
+        impacts = pseudo_freqs * (k1 + 1) / (pseudo_freqs + k1)
+        self.set_impacts(indptr, columns, impacts)
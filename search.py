@@ -1,307 +1,444 @@
-from nltk.stem import PorterStemmer
-import sys
 import math
+import os
+import sys
+import threading
+from contextlib import contextmanager
 import numpy as np
-import re
-import json
-import tarfile
-
-def load_raw_docs_file(tar_input):
-    target_extension = '.all'
-    documents = {}
-    current_doc_id = None
-    current_doc_content = []
-    skip_content = False
-
-    for member in tar_input.getmembers():
-        if member.isfile() and member.name.endswith(target_extension):
-            with tar_input.extractfile(member) as file:
-                # Read and decode the file in larger chunks to lower # of calls made
-                chunk_size = 1024
-                decoded_chunk = ""
-
-                for chunk in iter(lambda: file.read(chunk_size), b''):
-                    decoded_chunk += chunk.decode('utf-8')
-                    lines = decoded_chunk.split('\n')
-                    decoded_chunk = lines.pop()
-
-                    for line in lines:
-                        # Get the first two chars of the line to check the section labels
-                        section_label = line[:2]
-
-                        if section_label == ".I":
-                            if current_doc_id is not None:
-                                documents[current_doc_id] = '\n'.join(current_doc_content)
-                            current_doc_id = line.split()[-1]
-                            current_doc_content = []
-                            skip_content = False
-                        elif section_label in {".N", ".X"}:
-                            skip_content = True
-                        elif not skip_content:
-                            current_doc_content.append(line)
-
-                if decoded_chunk:
-                    lines = decoded_chunk.split('\n')
-                    for line in lines:
-                        section_label = line[:2]
-                        if section_label == ".I":
-                            if current_doc_id is not None:
-                                documents[current_doc_id] = '\n'.join(current_doc_content)
-                            current_doc_id = line.split()[-1]
-                            current_doc_content = []
-                            skip_content = False
-                        elif section_label in {".N", ".X"}:
-                            skip_content = True
-                        elif not skip_content:
-                            current_doc_content.append(line)
-
-    if current_doc_id is not None:
-        documents[current_doc_id] = '\n'.join(current_doc_content)
-
-    return documents
-
-
-# Confirms if user-provided term exists in the input terms_dict.json file
-def term_found(user_input, terms_data):    
-    if user_input in terms_data:
-        return True
-    else:
-        return False
-    
-# Retrieves the index in postings using the user_term as the key
-def get_doc_ids(term_exists, user_input, terms_data):
-    if term_exists:
-        return list(terms_data.keys()).index(user_input)
-    
-# Called when a search term is found in the documents; returns the postings of that term
-def search_postings(term_index, postings_data):    
-    return postings_data[term_index]
-
-# Returns list of retrieved docs that have that them
-def retrieve_docs(term, postings, raw_docs):
-    results = []
-
-    for doc_id, content in postings.items():
-        positions = content['positions']
-        term_frequency = content['term frequency']
-        doc_content = raw_docs[doc_id]
-
-        # Initialize variables that store the document title, author, and its terms
-        title = None
-        author = None
-
-        # Split doc_content into lines
-        lines = doc_content.split('\n')
-
-        # Set initial flag for the 'A' (i.e. Authors) section in text
-        in_a_section = False
-
-        # Get the first position that the term occurs in from the list of positions in the term positions dictionary
-        term_position = positions
-
-        # Iterate through the lines to extract only the title and the author's name 
-        for i, line in enumerate(lines):
-            # Check the first two characters of the line for section labels
-            section_label = line[:2]
-
-            if section_label == '.T':
-                # The title is on the next line
-                title = lines[i + 1]
-                for char in reversed(title):
-                    if not char.isspace():
-                        title = title[:title.index(char) + 1]
-                        break
-                in_a_section = False
-            elif section_label == '.A':
-                in_a_section = True
-                # The Author's name is on the next line
-                author = lines[i + 1]
-                for char in reversed(author):
-                    if not char.isspace():
-                        author = author[:author.index(char) + 1]
-                        break
-
-        result = {
-            'Term': term,
-            'Document ID': doc_id,
-            'Title': title,
-            'Author': author,
-            'Positions': positions,
-            'Term Frequency': term_frequency
-        }
-
-        results.append(result)
-
-    return results
+from segments import MANIFEST_FILE, IndexSegment, load_manifest, manifest_lock, segment_files
+from cache import ResultCache, DEFAULT_RESULT_CACHE_SIZE
+from instrument import NO_STATS
+from analyzer import get_analyzer
+from proximity import parse_query, clause_matches
+from boolean import parse_boolean_query, analyze_tree, evaluate, intersect_terms
 
+# Ranking modes of SearchEngine.search (see segments.IndexSegment.ranking_scorer)
+RANKINGS = ('cosine', 'bm25', 'bm25f')
 
+# Retrieves the id of the term in the lexicon, which is used to find its postings (None if the term is not indexed)
+def get_doc_ids(user_input, index):
+    return index.term_id(user_input)
 
+# Returns the index term for a single query word, using the same analyzer as invert.py
 def term_stemming(query_term, isStemming):
 
-    with open('stopwords.txt', 'r') as stopword_file:
-                stop_words = set(stopword_file.read().splitlines())
-
-    pattern = "[^0-9a-zA-Z\s]+"
-    tokened_query = query_term.lower().split()
+    alphanum_terms = get_analyzer(isStemming == 'Yes').tokens(query_term)
 
-    alphanum_terms = [re.sub(pattern, "", c).strip() for c in tokened_query]
-    
-    if isStemming == 'Yes':
-        stemmer = PorterStemmer()
-        alphanum_terms = [stemmer.stem(word) for word in alphanum_terms if word not in stop_words and word != ""]
-    
     if len(alphanum_terms) == 0:
         return ""
     else:
         return alphanum_terms[0]
 
-def get_df(term_exists, user_input, terms_data):
-    if term_exists:
-        return terms_data.get(user_input)
+# Each segment returns its own top k (doc_id, score) pairs; a document is live in only one segment,
+# so the best k of all of them are the top k of the index
+def merge_topk_docs(topk_docs, k):
+    topk_docs = sorted(topk_docs, key=lambda doc: (-doc[1], doc[0]))[:k]
+    return {str(doc_id): score for doc_id, score in topk_docs}
+
+# Rejects a negative number of results; k=0 is allowed and returns no documents
+def check_k(k):
+    if k < 0:
+        raise ValueError(f"k must not be negative, got {k}")
+
+# Returns the query weights and idfs of the unique query terms, given their dfs and the number of docs N
+# of the whole index. For cosine ranking, query weights are the count of each unique term times its idf,
+# divided by the length of the query vector; for BM25 they are just the counts, with the BM25 idf
+# Both are empty if the query vector has length 0
+def query_weights(query_terms, unique_terms, dfs, N, ranking='cosine'):
+    if ranking == 'cosine':
+        idfs = [math.log((N/df),10) for df in dfs]
+
+        # Create a query vector from the count of each unique term times that term's idf, divided by its length
+        query_vector = [query_terms.count(term)*idf for term, idf in zip(unique_terms, idfs)]
+        query_q = math.sqrt(sum(weight ** 2 for weight in query_vector))
+    else:
+        idfs = [math.log(1 + (N - df + 0.5)/(df + 0.5)) for df in dfs]
+        query_vector = [query_terms.count(term) for term in unique_terms]
+        query_q = 1.0 if query_vector else 0.0
 
-def main():
+    if query_q == 0:
+        return [], []
 
-        if len(sys.argv) != 3:
-            print(f"No input query received!\nUsage: search.py <query> (in double quotes) <Yes/No> ")
-            
-        else:
-            terms_file = 'terms_dict.json'
-            postings_file = 'postings_dict.json'
-
-            with open(terms_file, 'r') as terms_file:
-                terms_data = json.load(terms_file)
+    return [weight/query_q for weight in query_vector], idfs
 
-            with open(postings_file, 'r') as postings_file:
-                postings_data = json.load(postings_file)
+# Normalizes a parsed query to its index terms, so queries that only differ in case, punctuation, stop
+# words, word endings (with stemming) or the order of their free-text words share their cached results
+def query_key(words, clauses, user_stemming):
+    analyzer = get_analyzer(user_stemming == 'Yes')
 
-            with tarfile.open('cacm.tar', 'r') as tar:
-                docs_tar_file = load_raw_docs_file(tar)
-                
-            user_string = sys.argv[1]
-            user_stemming = sys.argv[2]
-            user_query = user_string.split()
-            
-            doc_data = []
-            
-            query_terms = []
-            
-            N = 3204
-            term_df = None
-            term_idf = None
-            
+    terms = tuple(sorted(term_stemming(word, user_stemming) for word in words))
+    analyzed_clauses = []
+    for clause in clauses:
+        if clause[0] == 'phrase':
+            analyzed_clauses.append(('phrase', tuple(analyzer.tokens(' '.join(clause[1])))))
+        else:
+            analyzed_clauses.append(('near', tuple(tuple(analyzer.tokens(word)) for word in clause[1]), tuple(clause[2])))
+
+    return terms, tuple(analyzed_clauses)
+
+# The segments of the index at one point in time, with the N and average lengths of the whole index over them
+# and the version of the manifest they were loaded from
+class IndexSnapshot:
+
+    def __init__(self, segments, version=None):
+        self.segments = segments
+        self.version = version
+
+        # Total number of docs in the index; like the dfs, it counts deleted docs until their segment is merged
+        self.N = sum(len(segment) for segment in segments)
+
+        # Average length of the docs, their titles, their abstracts and the rest of them, for BM25 and BM25F
+        total_length = sum(segment.docstore.total_length for segment in segments)
+        total_title_length = sum(segment.docstore.total_title_length for segment in segments)
+        total_abstract_length = sum(segment.docstore.total_abstract_length for segment in segments)
+        self.avg_lengths = tuple(length / max(self.N, 1) for length in (total_length, total_title_length, total_abstract_length, total_length - total_title_length - total_abstract_length))
+
+# Long-lived search engine that opens the memory-mapped index segments once and then answers any number
+# of queries against them. Before each query it checks the manifest written by invert.py and update.py,
+# and picks up added segments, deletions and merges without restarting. Results of recent queries are kept
+# in a ResultCache (see cache.py) until the index changes; result_cache_size=0 turns it off
+# With lazy=True, the segments only decode the postings of the terms that queries use (see IndexSegment),
+# which makes the first query much faster, e.g. for a one-shot query from the command line
+#
+# The engine can be shared by threads, e.g. by server.py. Every query runs against the snapshot of the
+# segments that was current when it started, and a refresh only swaps in a new snapshot; a segment that a
+# merge retired is closed by the last query still using it, never under a running query
+class SearchEngine:
+
+    def __init__(self, lexicon_file='lexicon.bin', postings_file='postings.bin', docstore_file='docstore.bin', manifest_file=MANIFEST_FILE, result_cache_size=DEFAULT_RESULT_CACHE_SIZE, lazy=False):
+
+        self.base_files = (lexicon_file, postings_file, docstore_file)
+        self.lazy = lazy
+        self.manifest_file = manifest_file
+        self.manifest_version = None
+        self.merges = None
+        self.result_cache = ResultCache(result_cache_size)
+
+        # The current snapshot, and the number of running queries using each open segment
+        self.current = IndexSnapshot([])
+        self.snapshot_lock = threading.Lock()
+
+        self.refresh()
+
+    @property
+    def segments(self):
+        return self.current.segments
+
+    @property
+    def N(self):
+        return self.current.N
+
+    @property
+    def avg_lengths(self):
+        return self.current.avg_lengths
+
+    # Holds the current snapshot for the duration of a query, so its segments stay open until it is done
+    @contextmanager
+    def snapshot(self):
+        with self.snapshot_lock:
+            snapshot = self.current
+            for segment in snapshot.segments:
+                segment.users += 1
+
+        try:
+            yield snapshot
+        finally:
+            with self.snapshot_lock:
+                for segment in snapshot.segments:
+                    segment.users -= 1
+                    if segment.retired and segment.users == 0:
+                        segment.close()
+
+    # Reloads the list of segments and their tombstones if the manifest changed since the last call
+    # Segments that are still listed stay open; only new ones, and the base after a merge, are loaded
+    def refresh(self):
+
+        # The manifest is replaced, never rewritten in place, so a new inode or mtime means a new manifest
+        try:
+            manifest_stat = os.stat(self.manifest_file)
+            manifest_version = (manifest_stat.st_ino, manifest_stat.st_mtime_ns)
+        except FileNotFoundError:
+            manifest_version = None
+
+        if self.current.segments and manifest_version == self.manifest_version:
+            return
+
+        with manifest_lock:
+            # Another thread may have loaded this manifest while this one waited for the lock
+            if self.current.segments and manifest_version == self.manifest_version:
+                return
+
+            manifest = load_manifest(self.manifest_file) or {'merges': 0, 'segments': ['base'], 'deleted': {}}
+
+            # Every change to the index bumps the generation, and a rebuild by invert.py also changes the checksum
+            version = (manifest.get('checksum'), manifest.get('generation'))
+
+            open_segments = {segment.name: segment for segment in self.current.segments}
+            retired = []
+            if manifest['merges'] != self.merges and 'base' in open_segments:
+                retired.append(open_segments.pop('base'))
+
+            segments = []
+            for name in manifest['segments']:
+                segment = open_segments.pop(name, None)
+                if segment is None:
+                    segment = IndexSegment(name, *segment_files(name, self.base_files), lazy=self.lazy)
+                segment.set_deleted(manifest['deleted'].get(name, []))
+                segments.append(segment)
+            retired.extend(open_segments.values())
+
+            # Swap in the new snapshot; the retired segments are closed now or by the last query using them
+            snapshot = IndexSnapshot(segments, version)
+            with self.snapshot_lock:
+                self.current = snapshot
+                for segment in retired:
+                    segment.retired = True
+                    if segment.users == 0:
+                        segment.close()
+
+            self.merges = manifest['merges']
+            self.manifest_version = manifest_version
+            self.result_cache.validate(version)
+
+    # Caches a result computed on the snapshot, unless the index changed in the meantime
+    def cache_result(self, snapshot, key, result):
+        if snapshot.version == self.result_cache.version:
+            self.result_cache.put(key, result)
+
+    # Returns the segment's scorer for the ranking: 'cosine' (tf-idf cosine), 'bm25' or 'bm25f', holding at
+    # least the postings of the term ids, for the average lengths of the snapshot (the current one by default)
+    def scorer(self, segment, ranking, term_ids=(), snapshot=None):
+        return segment.ranking_scorer(ranking, (snapshot or self.current).avg_lengths, term_ids)
+
+    # Turns a free-text query into its unique index terms and one (term_ids, query_weights, idfs) query per
+    # segment of the snapshot (the current one by default) for its scorer (see query_weights)
+    def segment_queries(self, user_string, user_stemming, ranking='cosine', stats=NO_STATS, snapshot=None):
+
+        snapshot = snapshot or self.current
+        user_query = user_string.split()
+
+        query_terms = []
+        query_term_ids = {}
+
+        with stats.stage('analyze'):
             for char in user_query:
                 processed_term = term_stemming(char, user_stemming)
-                term_exists = term_found(processed_term, terms_data)
-                    
+                ids = [get_doc_ids(processed_term, segment.index) for segment in snapshot.segments]
+                term_exists = any(idx is not None for idx in ids)
+
                 if term_exists:
-                    
                     query_terms.append(processed_term)
-                    idx = get_doc_ids(term_exists, processed_term, terms_data)
-                    postings_results = search_postings(str(idx), postings_data)
-                    docs = retrieve_docs(processed_term, postings_results, docs_tar_file)
-                    
-                    term_df = get_df(term_exists, processed_term, terms_data)
-                    term_idf = math.log((N/term_df),10)
-
-                    for doc in docs:  
-                        doc_data.append({doc['Document ID']: [doc['Term'], doc['Term Frequency']*term_idf]})
-            
-            combined_data = {}
-
-            for item in doc_data:
-
-                # Get the single key-value pair
-                key, values = item.popitem()  
-
-                if key in combined_data:
-                    # Append the values to the existing key
-                    combined_data[key].append(values)
-                else:
-                    # Create a new entry in the combined_data dictionary
-                    combined_data[key] = [values]
+                    query_term_ids[processed_term] = ids
 
-            # Convert the combined_data dictionary back to a list of dictionaries
-            combined_data_list = [{k: v} for k, v in combined_data.items()]
-            
-            # Only get unique terms from user entered query
+            # Only get unique terms from user entered query, sorted like the lexicon
             unique_terms = sorted(set(query_terms))
-                
-            # Initialize a vector of zeros for each document
-            vector_length = len(unique_terms)
-            zero_vector = [0.0] * vector_length
-
-            # Create a dictionary to store the document vectors
-            document_vectors = {}
-            
-            for item in combined_data_list:
-                for key, value in item.items():
-                    document_vector = zero_vector.copy()
-                    for subitem in value:
-                        term, weight = subitem
-                        index = unique_terms.index(term)
-                        document_vector[index] = weight
-                    document_vectors[key] = document_vector
-                    
-            # Create a query vector
-            sorted_query = sorted(query_terms)
-            
-            # Initialize a dictionary to store string counts
-            query_counts = {}
-
-            # Iterate through the list and count occurrences
-            for string in sorted_query:
-                if string in query_counts:
-                    # If the string is already in the dictionary, increment its count
-                    query_counts[string] += 1
+            stats.count('query_terms', len(unique_terms))
+
+        with stats.stage('weights'):
+            # The df of each term over all segments gives the same idfs in every segment
+            dfs = [sum(segment.index.df(idx) for segment, idx in zip(snapshot.segments, query_term_ids[term]) if idx is not None) for term in unique_terms]
+            weights, idfs = query_weights(query_terms, unique_terms, dfs, snapshot.N, ranking)
+
+            if not weights:
+                return unique_terms, [([], [], []) for segment in snapshot.segments]
+
+            queries = []
+            for i in range(len(snapshot.segments)):
+                terms = [j for j, term in enumerate(unique_terms) if query_term_ids[term][i] is not None]
+                queries.append(([query_term_ids[unique_terms[j]][i] for j in terms], [weights[j] for j in terms], [idfs[j] for j in terms]))
+
+        return unique_terms, queries
+
+    # Returns the top-k doc ids and their scores for a free-text query, best first, ranked by cosine similarity
+    # or with ranking='bm25' or 'bm25f' by BM25 over whole documents or over their title, abstract and the rest.
+    # Passing a weight_threshold (e.g. the original 2.75) only ranks documents with a query-term weight above it
+    # Quoted phrases and NEAR/k operators (see proximity.py) only keep the documents matching all of them; with
+    # a proximity_boost they rank every document instead, adding the boost times the fraction of them it matches.
+    # With query_operators=False, quotes and NEAR/k are treated as plain text. With conjunctive=True only
+    # documents containing every query term are ranked, and only those documents are scored
+    # Repeated queries are answered from the result cache, first by the query string and then by its index terms
+    # Passing a QueryStats (see instrument.py) collects the time of each stage and the work done
+    def search(self, user_string, user_stemming='No', k=20, weight_threshold=None, proximity_boost=None, query_operators=True, conjunctive=False, ranking='cosine', stats=NO_STATS):
+
+        check_k(k)
+
+        with stats.stage('total'):
+            with stats.stage('refresh'):
+                self.refresh()
+
+            options = (user_stemming, k, weight_threshold, proximity_boost, query_operators, conjunctive, ranking)
+            with self.snapshot() as snapshot:
+                with stats.stage('cache'):
+                    result = self.result_cache.get(('string', user_string, options))
+                if result is not None:
+                    stats.count('cache_hits')
+                    return dict(result)
+
+                with stats.stage('parse'):
+                    words, clauses = parse_query(user_string) if query_operators else (user_string.split(), [])
+                    key = ('terms', query_key(words, clauses, user_stemming), options)
+
+                with stats.stage('cache'):
+                    result = self.result_cache.get(key)
+                if result is None:
+                    result = self.rank(words, clauses, user_stemming, k, weight_threshold, proximity_boost, conjunctive, ranking, stats, snapshot)
+                    self.cache_result(snapshot, key, result)
                 else:
-                    # If the string is not in the dictionary, add it with a count of 1
-                    query_counts[string] = 1
-                    
-            query_vector_raw = query_counts.values()
-            query_vector = [x*term_idf for x in query_vector_raw]
-            query_q = math.sqrt(sum(i**2 for i in query_vector))
-            
-            # Cosine similarity for query and document
-            sim_qd = {}
-
-            # Term Weight threshold
-            weight_threshold = 2.75
-
-            # Initialize a dictionary to store matching documents
-            threshold_documents = {}
+                    stats.count('cache_hits')
+                self.cache_result(snapshot, ('string', user_string, options), result)
+
+                return dict(result)
+
+    # Scores a parsed query in every segment of the snapshot (the current one by default) and merges their top k
+    def rank(self, words, clauses, user_stemming, k, weight_threshold, proximity_boost, conjunctive, ranking, stats=NO_STATS, snapshot=None):
+
+        snapshot = snapshot or self.current
+        query_terms, queries = self.segment_queries(' '.join(words), user_stemming, ranking, stats, snapshot)
+
+        topk_docs = []
+        for segment, query in zip(snapshot.segments, queries):
+            scorer = self.scorer(segment, ranking, query[0], snapshot)
+            doc_filter, doc_boosts = None, None
+            stats.count('segments')
+
+            with stats.stage('clauses'):
+                matches = [clause_matches(segment.index, clause, user_stemming) for clause in clauses]
+                masks = [scorer.doc_mask(doc_ids) for doc_ids in matches if doc_ids is not None]
+                if masks and proximity_boost:
+                    doc_boosts = proximity_boost * sum(masks) / len(masks)
+                elif masks:
+                    doc_filter = np.prod(masks, axis=0)
+
+            candidates = None
+            if conjunctive:
+                # A query term missing from the segment leaves no document there with all the terms
+                if len(query[0]) < len(query_terms):
+                    continue
+                with stats.stage('intersect'):
+                    candidates = intersect_terms(segment.index, query[0])
+
+            with stats.stage('score'):
+                topk_docs.extend(scorer.score(*query, k, weight_threshold, doc_filter, doc_boosts, candidates, stats))
+
+        with stats.stage('merge'):
+            return merge_topk_docs(topk_docs, k)
+
+    # Returns the ids of all live documents matching a Boolean query (see boolean.py), in doc id order
+    def boolean_search(self, user_string, user_stemming='No', stats=NO_STATS):
+
+        with stats.stage('total'):
+            with stats.stage('refresh'):
+                self.refresh()
+
+            with stats.stage('cache'):
+                result = self.result_cache.get(('boolean', user_string, user_stemming))
+            if result is not None:
+                stats.count('cache_hits')
+                return list(result)
+
+            with stats.stage('parse'):
+                tree = analyze_tree(parse_boolean_query(user_string), user_stemming)
+
+            with stats.stage('boolean'), self.snapshot() as snapshot:
+                doc_ids = []
+                for segment in snapshot.segments:
+                    segment_doc_ids = evaluate(tree, segment.index, np.asarray(segment.docstore.doc_ids, dtype=np.int64))
+                    doc_ids.extend(doc_id for doc_id in segment_doc_ids.tolist() if doc_id not in segment.deleted)
+                    stats.count('segments')
+
+            result = tuple(str(doc_id) for doc_id in sorted(doc_ids))
+            self.cache_result(snapshot, ('boolean', user_string, user_stemming), result)
+
+            return list(result)
+
+    # Returns the results of search() for every query in the list, in the same order
+    # All queries are scored together, with one sparse matrix product per segment; queries with phrase
+    # or NEAR clauses are searched one by one. Queries in the result cache are not scored again
+    def search_batch(self, user_strings, user_stemming='No', k=20, weight_threshold=None, query_operators=True, ranking='cosine', stats=NO_STATS):
+
+        check_k(k)
+
+        with stats.stage('total'):
+            with stats.stage('refresh'):
+                self.refresh()
+
+            with self.snapshot() as snapshot:
+                options = (user_stemming, k, weight_threshold, None, query_operators, False, ranking)
+                with stats.stage('cache'):
+                    results = [self.result_cache.get(('string', user_string, options)) for user_string in user_strings]
+                stats.count('cache_hits', sum(result is not None for result in results))
+
+                # Queries that are not cached by their string are parsed and looked up by their terms
+                batch = []
+                for i, user_string in enumerate(user_strings):
+                    if results[i] is not None:
+                        continue
+
+                    with stats.stage('parse'):
+                        words, clauses = parse_query(user_string) if query_operators else (user_string.split(), [])
+                    # Such a query runs through search() with its own stats, so its refresh, cache and total
+                    # timings are not counted twice; only what it did is added to the batch's counters
+                    if clauses:
+                        query_stats = stats.child()
+                        with stats.stage('operators'):
+                            results[i] = self.search(user_string, user_stemming, k, weight_threshold, query_operators=query_operators, ranking=ranking, stats=query_stats)
+                        stats.add_counters(query_stats)
+                        continue
+
+                    key = ('terms', query_key(words, clauses, user_stemming), options)
+                    with stats.stage('cache'):
+                        results[i] = self.result_cache.get(key)
+                    if results[i] is None:
+                        batch.append((i, key, self.segment_queries(' '.join(words), user_stemming, ranking, stats, snapshot)[1]))
+                    else:
+                        stats.count('cache_hits')
+                        self.cache_result(snapshot, ('string', user_string, options), results[i])
+
+                topk_docs = [[] for i, key, queries in batch]
+                for j, segment in enumerate(snapshot.segments):
+                    stats.count('segments')
+                    with stats.stage('score'):
+                        scorer = self.scorer(segment, ranking, [term_id for i, key, queries in batch for term_id in queries[j][0]], snapshot)
+                        for query_topk_docs, segment_topk_docs in zip(topk_docs, scorer.score_batch([queries[j] for i, key, queries in batch], k, weight_threshold, stats)):
+                            query_topk_docs.extend(segment_topk_docs)
+
+                with stats.stage('merge'):
+                    for (i, key, queries), query_topk_docs in zip(batch, topk_docs):
+                        results[i] = merge_topk_docs(query_topk_docs, k)
+                        self.cache_result(snapshot, key, results[i])
+                        self.cache_result(snapshot, ('string', user_strings[i], options), results[i])
+
+                return [dict(result) for result in results]
+
+    # Returns True if the document is in the index and has not been deleted
+    def has_doc(self, doc_id):
+        with self.snapshot() as snapshot:
+            return any(segment.is_live(doc_id) for segment in snapshot.segments)
+
+    # Returns the title and author of a document for display, read from the doc store of its segment
+    def retrieve_doc(self, doc_id):
+        with self.snapshot() as snapshot:
+            for segment in reversed(snapshot.segments):
+                if segment.is_live(doc_id):
+                    return segment.docstore.get(doc_id)
+
+        raise KeyError(doc_id)
 
-            for doc_id, vector in (document_vectors.items()):
-                matching = False
-
-                for weight in vector:
-                    if weight > weight_threshold:
-                        matching = True
-                        break 
-
-                if matching:
-                    threshold_documents[doc_id] = vector
+def main():
 
-            threshold_documents = dict(sorted(threshold_documents.items(), key=lambda item: (item[1]), reverse=True))
+        if len(sys.argv) != 3:
+            print(f"No input query received!\nUsage: search.py <query> (in double quotes) <Yes/No> ")
 
-            # Calculate the dot product of the query vector with each document vector
-            for doc_id, doc_vector in threshold_documents.items():
+        else:
+            # Only the query's postings are decoded, so a single query does not load the whole index
+            engine = SearchEngine(lazy=True)
 
-                # Calculate the cosine similarity
-                cos_sim = sum(q * d for q, d in zip(query_vector, doc_vector))/(query_q*math.sqrt(sum(i**2 for i in doc_vector)))
+            user_string = sys.argv[1]
+            user_stemming = sys.argv[2]
 
-                # Store the result in the dot_products dictionary
-                sim_qd[doc_id] = cos_sim
-                
-            sorted_sim_qd = dict(sorted(sim_qd.items(), key=lambda item: item[1], reverse=True))
-            
-            topk_docs = {k: v for k, v in list(sorted_sim_qd.items())[:20]}
+            topk_docs = engine.search(user_string, user_stemming)
 
             for id, score in topk_docs.items():
                 print(f"{id}: {score}")
 
-            output_json = json.dumps(topk_docs)
-            
-            tar.close()
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import zlib
+from postings import PostingsIndex
+from docstore import DocStore
+from scoring import CosineScorer, BM25Scorer, BM25FScorer
+from impacts import impacts_file_for, load_impact_index
+from tiers import tiers_file_for, load_tier_index, read_champions
+
+# The index as a list of segments, described by the manifest file segments.json:
+#
+#   generation:   bumped on every change, so a long-lived SearchEngine knows when to reload
+#   merges:       bumped whenever the base segment's files are replaced
+#   checksum:     crc32 of the base segment's files, written by invert.py and after every merge
+#   stemming:     whether the index was built with stemming (invert.py stemOn)
+#   next_segment: number of the next segment update.py writes
+#   segments:     segment names, oldest first; 'base' is the index written by invert.py
+#   deleted:      {segment name: [doc ids]} tombstones of the deleted documents in each segment
+#
+# The base segment is lexicon.bin, postings.bin and docstore.bin. Every other segment holds documents
+# added later by update.py, in the same three formats under segments/. A document is live in at most one
+# segment; adding a document again tombstones its older copy. Without a manifest, the index is just the base
+#
+# A segment may also have impact-ordered postings (see impacts.py) next to its postings file; update.py
+# writes them for new and merged segments whenever the base index has them. The same goes for champion
+# lists (see tiers.py)
+
+MANIFEST_FILE = 'segments.json'
+SEGMENT_DIR = 'segments'
+BASE_FILES = ('lexicon.bin', 'postings.bin', 'docstore.bin')
+
+# Serializes changes to the manifest (and to the files it lists) between the threads of one process
+manifest_lock = threading.Lock()
+
+# Returns the lexicon, postings and doc store files of a segment
+def segment_files(name, base_files=BASE_FILES):
+    if name == 'base':
+        return base_files
+    return tuple(os.path.join(SEGMENT_DIR, f'{name}.{kind}.bin') for kind in ('lexicon', 'postings', 'docstore'))
+
+# Returns the manifest, or None if the index has no manifest yet
+def load_manifest(manifest_file=MANIFEST_FILE):
+    try:
+        with open(manifest_file, 'r') as manifest_input:
+            return json.load(manifest_input)
+    except FileNotFoundError:
+        return None
+
+# Atomically replaces the manifest, so readers always see either the old or the new one
+def save_manifest(manifest, manifest_file=MANIFEST_FILE):
+    with open(manifest_file + '.tmp', 'w') as manifest_output:
+        json.dump(manifest, manifest_output)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+# Returns the crc32 of the contents of the files, read in order
+def index_checksum(files=BASE_FILES):
+    checksum = 0
+    for file_name in files:
+        with open(file_name, 'rb') as index_input:
+            while True:
+                data = index_input.read(1 << 20)
+                if not data:
+                    break
+                checksum = zlib.crc32(data, checksum)
+    return checksum
+
+# Starts a new manifest holding only the base index just written by invert.py, and removes the old segments
+def reset_manifest(stemming, manifest_file=MANIFEST_FILE):
+    with manifest_lock:
+        manifest = load_manifest(manifest_file) or {'generation': 0, 'merges': 0, 'next_segment': 1}
+
+        for name in manifest.get('segments', []):
+            if name != 'base':
+                remove_segment_files(name)
+
+        save_manifest({
+            'generation': manifest['generation'] + 1,
+            'merges': manifest['merges'] + 1,
+            'checksum': index_checksum(),
+            'stemming': stemming,
+            'next_segment': manifest['next_segment'],
+            'segments': ['base'],
+            'deleted': {},
+        }, manifest_file)
+
+# Returns True if the base index was built with impact-ordered postings (invert.py impactOrdered)
+def has_impact_index(base_files=BASE_FILES):
+    return os.path.exists(impacts_file_for(base_files[1]))
+
+# Returns the number of champions per term of the base index's champion lists (invert.py champions=<r>), or None
+def tier_champions(base_files=BASE_FILES):
+    return read_champions(tiers_file_for(base_files[1]))
+
+def remove_segment_files(name):
+    lexicon_file, postings_file, docstore_file = segment_files(name)
+    for segment_file in (lexicon_file, postings_file, docstore_file, impacts_file_for(postings_file), tiers_file_for(postings_file)):
+        if os.path.exists(segment_file):
+            os.remove(segment_file)
+
+# One memory-mapped segment of the index, with its scorers and tombstones
+#
+# Opening a segment only maps its files. Its scorers are built the first time a query needs them, from
+# every postings list of the segment, or with lazy=True from only the postings of the terms queries have
+# asked for so far. A lazy segment rebuilds its scorer with the new terms when a query needs more of them,
+# and loads every list once its queries have touched half of the postings. Lazy segments skip the
+# impact-ordered postings and champion lists, whose checksums alone mean reading the whole postings file
+class IndexSegment:
+
+    def __init__(self, name, lexicon_file, postings_file, docstore_file, lazy=False):
+        self.name = name
+        self.index = PostingsIndex(lexicon_file, postings_file)
+        self.docstore = DocStore(docstore_file)
+        self.lazy = lazy
+        self.impact_index = None if lazy else load_impact_index(self.index, impacts_file_for(postings_file))
+        self.tier_index = None if lazy else load_tier_index(self.index, tiers_file_for(postings_file))
+        self.deleted = set()
+
+        # Number of running queries using the segment, and whether a refresh has dropped it from the index
+        # (see SearchEngine.snapshot); a retired segment is closed once no query uses it
+        self.users = 0
+        self.retired = False
+
+        # Scorers, built on first use: {ranking: (average lengths they were built with, term ids they hold or None for all, scorer)}
+        self.scorers = {}
+
+    def __len__(self):
+        return len(self.docstore)
+
+    def set_deleted(self, doc_ids):
+        self.deleted = set(doc_ids)
+        for avg_lengths, term_ids, scorer in self.scorers.values():
+            scorer.set_deleted(self.deleted)
+
+    # Returns the segment's scorer for the ranking, 'cosine', 'bm25' or 'bm25f'
+    # avg_lengths are the average length of the whole index's docs, titles, abstracts and the rest of the docs;
+    # a BM25 scorer is rebuilt when they change, e.g. after a segment was added. term_ids are the ids of the
+    # query terms the scorer has to hold, which only matters for a lazy segment
+    def ranking_scorer(self, ranking, avg_lengths, term_ids=()):
+        if ranking == 'cosine':
+            avg_lengths = None
+
+        built_lengths, built_term_ids, scorer = self.scorers.get(ranking, (None, None, None))
+        if scorer is not None and built_lengths == avg_lengths and (built_term_ids is None or built_term_ids.issuperset(term_ids)):
+            return scorer
+
+        if not self.lazy:
+            term_ids = None
+        else:
+            term_ids = frozenset(term_ids)
+            # Keep the terms already loaded, unless the scorer is rebuilt for new average lengths anyway
+            if built_term_ids is not None and built_lengths == avg_lengths:
+                term_ids |= built_term_ids
+            if 2 * sum(self.index.df(term_id) for term_id in term_ids) > self.index.total_postings:
+                term_ids = None
+
+        if ranking == 'cosine':
+            scorer = CosineScorer(self.index, self.docstore.doc_ids, self.docstore.norms, self.impact_index, term_ids, self.tier_index)
+        elif ranking == 'bm25':
+            scorer = BM25Scorer(self.index, self.docstore.doc_ids, self.docstore.lengths, avg_lengths[0], term_ids=term_ids)
+        elif ranking == 'bm25f':
+            scorer = BM25FScorer(self.index, self.docstore.doc_ids, self.docstore.lengths, self.docstore.field_ranges, avg_lengths[1:], term_ids=term_ids)
+        else:
+            raise ValueError(f"Unknown ranking {ranking}, expected cosine, bm25 or bm25f")
+
+        scorer.set_deleted(self.deleted)
+        self.scorers[ranking] = (avg_lengths, term_ids, scorer)
+
+        return scorer
+
+    # Returns True if the segment holds a live copy of the document
+    def is_live(self, doc_id):
+        return doc_id in self.docstore and int(doc_id) not in self.deleted
+
+    def close(self):
+        # The scorers' arrays are views of the mappings, so drop them before closing
+        self.scorers = {}
+        if self.impact_index is not None:
+            self.impact_index.close()
+        if self.tier_index is not None:
+            self.tier_index.close()
+        self.index.close()
+        self.docstore.close()
@@ -0,0 +1,89 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from search import SearchEngine, RANKINGS
+from instrument import QueryStats, NO_STATS
+import json
+import sys
+
+# Local HTTP/JSON front end for a long-lived SearchEngine, so clients other than ui.py and eval.py
+# can query the index without paying the startup cost of loading it on every request
+#   GET /search?q=<query>&stemming=<Yes/No>&k=<top-k>&ranking=<cosine/bm25/bm25f>&stats=<0/1>
+#       with stats=1 the response also has the query's per-stage timings and counters
+#   GET /doc?id=<doc id>
+class SearchRequestHandler(BaseHTTPRequestHandler):
+
+    engine = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == '/search':
+            query = params.get('q', [''])[0]
+            stemming = params.get('stemming', ['No'])[0]
+            ranking = params.get('ranking', ['cosine'])[0]
+
+            try:
+                k = int(params.get('k', ['20'])[0])
+            except ValueError:
+                self.send_json(400, {'error': 'k must be an integer'})
+                return
+            if k < 0:
+                self.send_json(400, {'error': 'k must not be negative'})
+                return
+
+            if query == "":
+                self.send_json(400, {'error': 'Query cannot be blank!'})
+                return
+
+            if ranking not in RANKINGS:
+                self.send_json(400, {'error': f"ranking must be one of {', '.join(RANKINGS)}"})
+                return
+
+            stats = QueryStats() if params.get('stats', ['0'])[0] == '1' else NO_STATS
+            topk_docs = self.engine.search(query, stemming, k, ranking=ranking, stats=stats)
+            results = [{'Document ID': doc_id, 'Score': score} for doc_id, score in topk_docs.items()]
+            response = {'query': query, 'stemming': stemming, 'ranking': ranking, 'results': results}
+            if stats is not NO_STATS:
+                response['stats'] = stats.as_dict()
+            self.send_json(200, response)
+
+        elif url.path == '/doc':
+            doc_id = params.get('id', [''])[0]
+
+            if not self.engine.has_doc(doc_id):
+                self.send_json(404, {'error': f"No document with ID {doc_id}"})
+                return
+
+            self.send_json(200, self.engine.retrieve_doc(doc_id))
+
+        else:
+            self.send_json(404, {'error': f"Unknown path {url.path}"})
+
+def main():
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+
+    print(f"Loading index...")
+    SearchRequestHandler.engine = SearchEngine()
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), SearchRequestHandler)
+    print(f"Serving searches on http://127.0.0.1:{port}/search?q=<query>&stemming=<Yes/No>")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Goodbye.")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
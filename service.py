@@ -0,0 +1,277 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from search import SearchEngine, RANKINGS
+from cache import DEFAULT_RESULT_CACHE_SIZE
+
+# Asyncio query service for many concurrent clients
+#
+#   python service.py [port] [workers=<cpus>] [queue=<256>] [timeout=<10>]
+#
+# One event loop accepts the connections and speaks the same HTTP/JSON API as server.py
+#   GET /search?q=<query>&stemming=<Yes/No>&k=<top-k>&ranking=<cosine/bm25/bm25f>
+#   GET /doc?id=<doc id>
+#   GET /status     requests served, coalesced, rejected and timed out, and the queue length
+# while the CPU-bound scoring runs in a pool of worker processes. Each worker opens its own SearchEngine
+# on the memory-mapped index files, so the workers share the index's pages read-only through the OS page
+# cache instead of each holding a copy, and each picks up index updates before its next query.
+#
+# Identical queries that arrive while one is already being scored wait for that one's result instead of
+# being scored again. Requests go through a bounded queue served by one dispatcher per worker; when the
+# queue is full, new requests are turned away with 503 right away (backpressure) instead of piling up, and
+# a request that is not answered within the timeout gets 504
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_TIMEOUT = 10.0
+
+# Largest request line and headers read from a client
+MAX_REQUEST_BYTES = 64 * 1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+# The SearchEngine of a worker process, opened once by init_worker
+worker_engine = None
+
+def init_worker(result_cache_size):
+    global worker_engine
+    worker_engine = SearchEngine(result_cache_size=result_cache_size)
+
+# Runs in a worker: returns the top-k (doc_id, score) pairs of the query
+def worker_search(query, stemming, k, ranking):
+    return list(worker_engine.search(query, stemming, k, ranking=ranking).items())
+
+# Runs in a worker: returns the title and author of the document, or None if it is not in the index
+def worker_retrieve_doc(doc_id):
+    if not worker_engine.has_doc(doc_id):
+        return None
+    return worker_engine.retrieve_doc(doc_id)
+
+def worker_ready():
+    return os.getpid()
+
+# Raised for requests that get an error response instead of a result
+class ServiceError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Schedules searches on the worker pool, coalescing identical in-flight requests
+# Must be started and used from within one running event loop
+class QueryService:
+
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT, result_cache_size=DEFAULT_RESULT_CACHE_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.result_cache_size = result_cache_size
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.in_flight = {}
+        self.waiting = {}
+        self.pool = None
+        self.dispatchers = []
+        self.counters = {'requests': 0, 'coalesced': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+
+    # Starts the worker processes and waits until every one of them has opened the index
+    async def start(self):
+        # Workers are spawned rather than forked, as forking a process with a running event loop is not safe
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker, initargs=(self.result_cache_size,))
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, worker_ready) for worker in range(self.workers)))
+
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for worker in range(self.workers)]
+
+    async def close(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+
+    # Takes requests off the queue and runs them on the pool, one at a time, so at most one request per
+    # worker is handed to the pool and the rest wait in the bounded queue
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            future, function, arguments = await self.queue.get()
+            try:
+                # Requests whose callers all timed out were cancelled and are skipped
+                if not future.done():
+                    result = await loop.run_in_executor(self.pool, function, *arguments)
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            finally:
+                self.queue.task_done()
+
+    # Runs function(*arguments) on the pool and returns its result; a request identical to one already
+    # queued or running shares that one's result
+    async def submit(self, function, *arguments):
+        self.counters['requests'] += 1
+        key = (function.__name__, arguments)
+
+        future = self.in_flight.get(key)
+        if future is not None and not future.done():
+            self.counters['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self.queue.put_nowait((future, function, arguments))
+            except asyncio.QueueFull:
+                self.counters['rejected'] += 1
+                raise ServiceError(503, 'Too many queued requests, try again later')
+
+            self.in_flight[key] = future
+            future.add_done_callback(lambda done: self.finish(key, done))
+
+        # A caller that times out stops waiting, but leaves the shared request to the others; once none
+        # of them is left waiting, the request is cancelled
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise ServiceError(504, f"The request took longer than {self.timeout} seconds")
+        except Exception as error:
+            self.counters['errors'] += 1
+            raise ServiceError(500, f"The request failed: {error}")
+        finally:
+            self.waiting[key] -= 1
+            if self.waiting[key] == 0:
+                del self.waiting[key]
+                if not future.done():
+                    future.cancel()
+
+    # Forgets a finished request, unless a newer identical one has taken its place
+    def finish(self, key, future):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+
+    async def search(self, query, stemming='No', k=20, ranking='cosine'):
+        return await self.submit(worker_search, query, stemming, k, ranking)
+
+    async def retrieve_doc(self, doc_id):
+        return await self.submit(worker_retrieve_doc, doc_id)
+
+    def status(self):
+        return dict(self.counters, queued=self.queue.qsize(), in_flight=len(self.in_flight), workers=self.workers)
+
+# Answers one parsed GET request; returns the status and the JSON payload
+async def handle_request(service, target):
+    url = urlparse(target)
+    params = parse_qs(url.query)
+
+    if url.path == '/search':
+        query = params.get('q', [''])[0]
+        stemming = params.get('stemming', ['No'])[0]
+        ranking = params.get('ranking', ['cosine'])[0]
+
+        try:
+            k = int(params.get('k', ['20'])[0])
+        except ValueError:
+            return 400, {'error': 'k must be an integer'}
+        if k < 0:
+            return 400, {'error': 'k must not be negative'}
+
+        if query.strip() == '':
+            return 400, {'error': 'Query cannot be blank!'}
+
+        if ranking not in RANKINGS:
+            return 400, {'error': f"ranking must be one of {', '.join(RANKINGS)}"}
+
+        topk_docs = await service.search(query, stemming, k, ranking)
+        results = [{'Document ID': doc_id, 'Score': score} for doc_id, score in topk_docs]
+        return 200, {'query': query, 'stemming': stemming, 'ranking': ranking, 'results': results}
+
+    elif url.path == '/doc':
+        doc_id = params.get('id', [''])[0]
+        document = await service.retrieve_doc(doc_id)
+        if document is None:
+            return 404, {'error': f"No document with ID {doc_id}"}
+        return 200, document
+
+    elif url.path == '/status':
+        return 200, service.status()
+
+    return 404, {'error': f"Unknown path {url.path}"}
+
+# Serves the HTTP requests of one connection, keeping it open between requests unless the client closes it
+async def handle_connection(service, reader, writer):
+    try:
+        while True:
+            try:
+                header = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+
+            lines = header.decode('latin-1').split('\r\n')
+            request_line = lines[0].split()
+            headers = dict(line.split(':', 1) for line in lines[1:] if ':' in line)
+            headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+
+            if len(request_line) != 3:
+                status, payload = 400, {'error': 'Malformed request'}
+            elif request_line[0] != 'GET':
+                status, payload = 405, {'error': 'Only GET is supported'}
+            else:
+                try:
+                    status, payload = await handle_request(service, request_line[1])
+                except ServiceError as error:
+                    status, payload = error.status, {'error': str(error)}
+
+            keep_alive = len(request_line) == 3 and request_line[2] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+            body = json.dumps(payload).encode('utf-8')
+            writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+async def serve(port, workers=None, queue_size=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT):
+
+    print(f"Starting {workers or os.cpu_count()} workers...")
+    service = QueryService(workers, queue_size, timeout)
+    await service.start()
+
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(service, reader, writer), '127.0.0.1', port, limit=MAX_REQUEST_BYTES)
+    print(f"Serving searches on http://127.0.0.1:{port}/search?q=<query>&stemming=<Yes/No>")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+def main():
+
+    port = 8000
+    workers = None
+    queue_size = DEFAULT_QUEUE_SIZE
+    timeout = DEFAULT_TIMEOUT
+
+    for option in sys.argv[1:]:
+        if option.startswith("workers="):
+            workers = int(option.split("=")[1])
+        elif option.startswith("queue="):
+            queue_size = int(option.split("=")[1])
+        elif option.startswith("timeout="):
+            timeout = float(option.split("=")[1])
+        else:
+            port = int(option)
+
+    try:
+        asyncio.run(serve(port, workers, queue_size, timeout))
+    except KeyboardInterrupt:
+        print("Goodbye.")
+
+if __name__ == "__main__":
+    main()
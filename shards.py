@@ -0,0 +1,336 @@
+import bisect
+import json
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from postings import PostingsIndex, IndexWriter, term_hash
+from docstore import DocStore, DocStoreWriter
+from segments import BASE_FILES, IndexSegment
+from impacts import write_impact_index
+from tiers import write_tier_index
+from instrument import NO_STATS
+from search import RANKINGS, check_k, term_stemming, query_weights, merge_topk_docs
+
+# Document-partitioned shards of the index, searched by a scatter-gather coordinator
+#
+#   python shards.py <query> (in double quotes) <Yes/No> [ranking=<cosine/bm25/bm25f>]
+#
+# invert.py shards=<K> splits the index it has just built into K shards, each holding a contiguous range
+# of the sorted doc ids in the same three files as a segment, and the statistics of the whole collection:
+#
+#   shards/shard_<i>.lexicon.bin, shard_<i>.postings.bin, shard_<i>.docstore.bin (and impacts or tiers)
+#   shards/stats.bin    global term statistics, shipped with every shard
+#       header: magic, version, N, number of terms, length of the term blob, hash table size, and the total
+#               number of index tokens in all docs, in their titles and in their abstracts
+#       dfs:          uint32[V]      document frequency of each term in the whole collection
+#       term_offsets: uint32[V + 1]  offset of each term's utf-8 string in the term blob
+#       term_table:   uint32[T]      open-addressing hash table of term id + 1 (0 = empty slot), as in the lexicon
+#       term blob:    all terms concatenated in sorted order
+#   shards/shards.json  the stemming mode and the first and last doc id of each shard
+#
+# The doc norms and max scores in a shard are those of the whole index, and each shard weights queries with
+# the global dfs, N and average lengths of stats.bin, so the shards score every document exactly as the single
+# index does. ShardedSearchEngine analyzes a query once, sends its terms to one worker process per shard,
+# standing in for one node per shard, and merges their top-k lists into the top k. A worker only maps and
+# decodes its own shard, so the memory and CPU of a query are spread over the workers, which score in parallel
+
+SHARD_DIR = 'shards'
+SHARD_MANIFEST = 'shards.json'
+STATS_FILE = 'stats.bin'
+
+STATS_MAGIC = b'IRGS'
+STATS_VERSION = 1
+
+STATS_HEADER = struct.Struct('<4sIIIIIQQQ')
+
+# Returns the lexicon, postings and doc store files of a shard
+def shard_files(shard_number, shard_dir=SHARD_DIR):
+    return tuple(os.path.join(shard_dir, f'shard_{shard_number}.{kind}.bin') for kind in ('lexicon', 'postings', 'docstore'))
+
+# Returns the shard manifest written by write_shards
+def load_shard_manifest(shard_dir=SHARD_DIR):
+    manifest_file = os.path.join(shard_dir, SHARD_MANIFEST)
+    if not os.path.exists(manifest_file):
+        raise FileNotFoundError(f"{manifest_file} not found, run invert.py with shards=<K> to build the shards first")
+
+    with open(manifest_file, 'r') as manifest_input:
+        return json.load(manifest_input)
+
+def remove_shards(shard_dir=SHARD_DIR):
+    shutil.rmtree(shard_dir, ignore_errors=True)
+
+# Splits the index just written by invert.py into num_shards document-partitioned shards, with the global
+# statistics every shard needs to score its documents as the whole index would
+# impact_ordered and champions also write each shard's impact-ordered postings or champion lists
+def write_shards(num_shards, stemming, impact_ordered=False, champions=None, shard_dir=SHARD_DIR, base_files=BASE_FILES):
+
+    remove_shards(shard_dir)
+    os.makedirs(shard_dir)
+
+    index = PostingsIndex(*base_files[:2])
+    docstore = DocStore(base_files[2])
+    doc_ids = np.asarray(docstore.doc_ids, dtype=np.int64)
+
+    num_shards = max(1, min(num_shards, len(doc_ids)))
+    bounds = [len(doc_ids) * i // num_shards for i in range(num_shards + 1)]
+
+    # Copy each shard's documents, with the norms, lengths and fields computed over the whole index
+    shard_stats = []
+    for i in range(num_shards):
+        docstore_writer = DocStoreWriter(shard_files(i, shard_dir)[2])
+        doc_stats = {}
+        for j in range(bounds[i], bounds[i + 1]):
+            doc_stats[str(doc_ids[j])] = {'length': docstore.lengths[j], 'fields': docstore.field_ranges[4 * j:4 * j + 4].tolist(), 'norm': docstore.norms[j]}
+            docstore_writer.add(str(doc_ids[j]), docstore.field(j, 2))
+        docstore_writer.close(doc_stats)
+        shard_stats.append(doc_stats)
+
+    # Split each term's postings at the shards' first doc ids; a shard's lexicon only has the terms it holds
+    writers = [IndexWriter(*shard_files(i, shard_dir)[:2]) for i in range(num_shards)]
+    first_doc_ids = doc_ids[bounds[:-1]]
+    for term_id in range(len(index)):
+        postings = index.postings(term_id)
+        splits = np.searchsorted(postings.doc_ids, first_doc_ids[1:]).tolist()
+
+        for writer, start, end in zip(writers, [0] + splits, splits + [len(postings)]):
+            if end > start:
+                positions_start = postings.pos_ends[start] - postings.freqs[start]
+                writer.add_term(index.term(term_id), postings.doc_ids[start:end], postings.pos_ends[start:end] - positions_start, postings.all_positions[positions_start:postings.pos_ends[end - 1]])
+
+    for writer, doc_stats in zip(writers, shard_stats):
+        writer.close(doc_stats)
+
+    write_global_stats(index, docstore, os.path.join(shard_dir, STATS_FILE))
+
+    manifest = {
+        'stemming': stemming,
+        'shards': [{'first_doc_id': int(doc_ids[bounds[i]]), 'last_doc_id': int(doc_ids[bounds[i + 1] - 1])} for i in range(num_shards)],
+    }
+    with open(os.path.join(shard_dir, SHARD_MANIFEST), 'w') as manifest_output:
+        json.dump(manifest, manifest_output)
+
+    index.close()
+    docstore.close()
+
+    for i in range(num_shards):
+        if impact_ordered:
+            write_impact_index(*shard_files(i, shard_dir))
+        if champions is not None:
+            write_tier_index(champions, *shard_files(i, shard_dir))
+
+    return num_shards
+
+# Writes the global dfs, N and total lengths of the index to the stats file, reusing the lexicon's term table
+def write_global_stats(index, docstore, stats_file):
+    with open(stats_file, 'wb') as stats_output:
+        stats_output.write(STATS_HEADER.pack(STATS_MAGIC, STATS_VERSION, len(docstore), index.num_terms, len(index.term_blob), len(index.term_table), docstore.total_length, docstore.total_title_length, docstore.total_abstract_length))
+        for values in (index.dfs, index.term_offsets, index.term_table, index.term_blob):
+            stats_output.write(values)
+
+# Read-only, memory-mapped global term statistics written by write_global_stats
+class GlobalStats:
+
+    def __init__(self, stats_file):
+
+        with open(stats_file, 'rb') as stats_input:
+            self.stats_map = mmap.mmap(stats_input.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.N, num_terms, blob_length, table_size, total_length, total_title_length, total_abstract_length = STATS_HEADER.unpack_from(self.stats_map, 0)
+        if magic != STATS_MAGIC or version != STATS_VERSION:
+            raise ValueError(f"{stats_file} is not a version {STATS_VERSION} global stats file")
+
+        # Average length of the docs, their titles, their abstracts and the rest of them, as in SearchEngine.refresh
+        self.avg_lengths = tuple(length / max(self.N, 1) for length in (total_length, total_title_length, total_abstract_length, total_length - total_title_length - total_abstract_length))
+
+        view = memoryview(self.stats_map)
+        start = STATS_HEADER.size
+        self.dfs = view[start:start + 4 * num_terms].cast('I')
+        start += 4 * num_terms
+        self.term_offsets = view[start:start + 4 * (num_terms + 1)].cast('I')
+        start += 4 * (num_terms + 1)
+        self.term_table = view[start:start + 4 * table_size].cast('I')
+        self.table_mask = table_size - 1
+        start += 4 * table_size
+        self.term_blob = view[start:start + blob_length]
+
+    # Returns the number of docs of the whole collection the term is in, 0 if it is not indexed
+    def df(self, term):
+        key = term.encode('utf-8')
+        slot = term_hash(key) & self.table_mask
+
+        while True:
+            entry = self.term_table[slot]
+            if entry == 0:
+                return 0
+            if self.term_blob[self.term_offsets[entry - 1]:self.term_offsets[entry]] == key:
+                return self.dfs[entry - 1]
+            slot = (slot + 1) & self.table_mask
+
+# One shard and the global statistics, as held by a shard worker
+class ShardSearcher:
+
+    def __init__(self, name, lexicon_file, postings_file, docstore_file, stats_file):
+        self.segment = IndexSegment(name, lexicon_file, postings_file, docstore_file)
+        self.stats = GlobalStats(stats_file)
+
+    # Turns the analyzed terms of a query into the (term_ids, query_weights, idfs) query of the shard's scorer
+    # The weights are those of the whole index, also for the terms this shard does not hold
+    def shard_query(self, query_terms, ranking):
+        query_terms = [term for term in query_terms if self.stats.df(term) > 0]
+        unique_terms = sorted(set(query_terms))
+        weights, idfs = query_weights(query_terms, unique_terms, [self.stats.df(term) for term in unique_terms], self.stats.N, ranking)
+
+        term_ids = [self.segment.index.term_id(term) for term in unique_terms[:len(weights)]]
+        terms = [j for j, term_id in enumerate(term_ids) if term_id is not None]
+        return [term_ids[j] for j in terms], [weights[j] for j in terms], [idfs[j] for j in terms]
+
+    # Returns the shard's top-k (doc_id, score) pairs for the analyzed query terms
+    def search(self, query_terms, k, weight_threshold, ranking):
+        query = self.shard_query(query_terms, ranking)
+        scorer = self.segment.ranking_scorer(ranking, self.stats.avg_lengths, query[0])
+        return scorer.score(*query, k, weight_threshold)
+
+    # Returns the shard's top-k (doc_id, score) pairs for each query, all scored together
+    def search_batch(self, queries, k, weight_threshold, ranking):
+        queries = [self.shard_query(query_terms, ranking) for query_terms in queries]
+        scorer = self.segment.ranking_scorer(ranking, self.stats.avg_lengths, [term_id for query in queries for term_id in query[0]])
+        return scorer.score_batch(queries, k, weight_threshold)
+
+# The shard of a worker process, opened once by init_shard_worker
+shard_searcher = None
+
+def init_shard_worker(name, lexicon_file, postings_file, docstore_file, stats_file):
+    global shard_searcher
+    shard_searcher = ShardSearcher(name, lexicon_file, postings_file, docstore_file, stats_file)
+
+def worker_search(query_terms, k, weight_threshold, ranking):
+    return shard_searcher.search(query_terms, k, weight_threshold, ranking)
+
+def worker_search_batch(queries, k, weight_threshold, ranking):
+    return shard_searcher.search_batch(queries, k, weight_threshold, ranking)
+
+# Returns the title and author of the document, or None if it is not in the shard
+def worker_retrieve_doc(doc_id):
+    if doc_id not in shard_searcher.segment.docstore:
+        return None
+    return shard_searcher.segment.docstore.get(doc_id)
+
+def worker_ready():
+    return os.getpid()
+
+# Coordinator of the sharded index: answers queries by scattering them to one worker process per shard and
+# merging the workers' top-k lists. Queries are free text; quotes and NEAR/k are read as plain words
+class ShardedSearchEngine:
+
+    def __init__(self, shard_dir=SHARD_DIR):
+
+        manifest = load_shard_manifest(shard_dir)
+        self.first_doc_ids = [shard['first_doc_id'] for shard in manifest['shards']]
+
+        # Each worker holds one shard, so each gets its own single-process pool to send that shard's work to
+        context = multiprocessing.get_context('spawn')
+        stats_file = os.path.join(shard_dir, STATS_FILE)
+        self.pools = [ProcessPoolExecutor(1, mp_context=context, initializer=init_shard_worker, initargs=(f'shard_{i}', *shard_files(i, shard_dir), stats_file)) for i in range(len(self.first_doc_ids))]
+
+        # Wait until every worker has opened its shard
+        for future in [pool.submit(worker_ready) for pool in self.pools]:
+            future.result()
+
+    # Sends function(*arguments) to every shard and returns their results, in shard order
+    def scatter_gather(self, function, *arguments):
+        futures = [pool.submit(function, *arguments) for pool in self.pools]
+        return [future.result() for future in futures]
+
+    # Returns the top-k doc ids and their scores for a free-text query, best first, as SearchEngine.search
+    # query_operators is only accepted for compatibility with SearchEngine; the query is always plain text
+    def search(self, user_string, user_stemming='No', k=20, weight_threshold=None, query_operators=False, ranking='cosine', stats=NO_STATS):
+
+        check_k(k)
+
+        with stats.stage('total'):
+            with stats.stage('analyze'):
+                query_terms = [term_stemming(word, user_stemming) for word in user_string.split()]
+
+            with stats.stage('shards'):
+                shard_topk_docs = self.scatter_gather(worker_search, query_terms, k, weight_threshold, ranking)
+            stats.count('segments', len(self.pools))
+
+            with stats.stage('merge'):
+                return merge_topk_docs([doc for topk_docs in shard_topk_docs for doc in topk_docs], k)
+
+    # Returns the results of search() for every query in the list, in the same order; each shard scores
+    # the whole batch at once
+    def search_batch(self, user_strings, user_stemming='No', k=20, weight_threshold=None, query_operators=False, ranking='cosine', stats=NO_STATS):
+
+        check_k(k)
+
+        with stats.stage('total'):
+            with stats.stage('analyze'):
+                queries = [[term_stemming(word, user_stemming) for word in user_string.split()] for user_string in user_strings]
+
+            with stats.stage('shards'):
+                shard_results = self.scatter_gather(worker_search_batch, queries, k, weight_threshold, ranking)
+            stats.count('segments', len(self.pools))
+
+            with stats.stage('merge'):
+                return [merge_topk_docs([doc for results in shard_results for doc in results[i]], k) for i in range(len(user_strings))]
+
+    # Returns the shard whose doc id range the document falls in, or None
+    def shard_for(self, doc_id):
+        try:
+            doc_id = int(doc_id)
+        except ValueError:
+            return None
+
+        i = bisect.bisect_right(self.first_doc_ids, doc_id) - 1
+        return self.pools[i] if i >= 0 else None
+
+    def has_doc(self, doc_id):
+        pool = self.shard_for(doc_id)
+        return pool is not None and pool.submit(worker_retrieve_doc, str(doc_id)).result() is not None
+
+    # Returns the title and author of a document for display, read from the doc store of its shard
+    def retrieve_doc(self, doc_id):
+        pool = self.shard_for(doc_id)
+        document = None if pool is None else pool.submit(worker_retrieve_doc, str(doc_id)).result()
+        if document is None:
+            raise KeyError(doc_id)
+        return document
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+def main():
+
+    if len(sys.argv) < 3:
+        print(f"No input query received!\nUsage: shards.py <query> (in double quotes) <Yes/No> [ranking=<cosine/bm25/bm25f>]")
+        return
+
+    user_string = sys.argv[1]
+    user_stemming = sys.argv[2]
+    ranking = 'cosine'
+    for option in sys.argv[3:]:
+        if option.startswith("ranking="):
+            ranking = option.split("=")[1]
+
+    if ranking not in RANKINGS:
+        print(f"Invalid ranking! Please use one of {', '.join(RANKINGS)}")
+        return
+
+    engine = ShardedSearchEngine()
+    try:
+        topk_docs = engine.search(user_string, user_stemming, ranking=ranking)
+    finally:
+        engine.close()
+
+    for id, score in topk_docs.items():
+        print(f"{id}: {score}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import pytest
+from boolean import parse_boolean_query, analyze_tree
+from search import SearchEngine
+
+# The Boolean query parser and its evaluation through SearchEngine.boolean_search (see boolean.py)
+#
+#   python -m pytest test_boolean.py
+
+DOCUMENTS = {
+    1: ".T\nParallel sorting algorithms",
+    2: ".T\nParallel matrix inversion",
+    3: ".T\nSorting networks",
+    4: ".T\nThe matrix of the web",
+}
+
+def term(word):
+    return ('term', word)
+
+def test_and_binds_tighter_than_or():
+    assert parse_boolean_query('a OR b c') == ('or', [term('a'), ('and', [term('b'), term('c')])])
+    assert parse_boolean_query('a AND b OR c') == ('or', [('and', [term('a'), term('b')]), term('c')])
+
+def test_not_and_parentheses():
+    assert parse_boolean_query('a AND (b OR c) NOT d') == ('and', [term('a'), ('or', [term('b'), term('c')]), ('not', term('d'))])
+    assert parse_boolean_query('NOT NOT a') == ('not', ('not', term('a')))
+    assert parse_boolean_query('((a))') == term('a')
+
+@pytest.mark.parametrize('query', ['', 'a AND', '(a OR b', 'a )', 'OR a', 'a AND OR b', 'NOT', '()'])
+def test_malformed_queries_are_rejected(query):
+    with pytest.raises(ValueError):
+        parse_boolean_query(query)
+
+def test_stop_words_match_everything():
+    assert analyze_tree(parse_boolean_query('the'), 'Yes') == ('all',)
+    assert analyze_tree(parse_boolean_query('web OR the'), 'Yes') == ('all',)
+    assert analyze_tree(parse_boolean_query('web AND the'), 'Yes') == term('web')
+    assert analyze_tree(parse_boolean_query('NOT the'), 'Yes') == ('not', ('all',))
+
+@pytest.mark.parametrize('query, expected', [
+    ('parallel AND sorting', ['1']),
+    ('parallel sorting', ['1']),
+    ('parallel OR sorting', ['1', '2', '3']),
+    ('sorting NOT parallel', ['3']),
+    ('matrix AND NOT (parallel OR web)', []),
+    ('matrix OR sorting NOT parallel', ['2', '3', '4']),
+    ('(matrix OR sorting) NOT parallel', ['3', '4']),
+    ('the', ['1', '2', '3', '4']),
+    ('web OR the', ['1', '2', '3', '4']),
+    ('web AND the', ['4']),
+    ('NOT the', []),
+    ('unknownword OR networks', ['3']),
+])
+def test_boolean_search(build_index, query, expected):
+    build_index(DOCUMENTS, 'stemOn')
+    assert SearchEngine().boolean_search(query, 'Yes') == expected
@@ -0,0 +1,52 @@
+from search import SearchEngine
+import update
+
+# The result cache and the postings cache (see cache.py) must never answer from an older version of the index:
+# after every update, a cached engine must return what a freshly opened engine returns
+#
+#   python -m pytest test_cache.py
+
+DOCUMENTS = {
+    1: ".T\nParallel sorting algorithms",
+    2: ".T\nSorting networks for parallel machines",
+    3: ".T\nMatrix inversion",
+    4: ".T\nParallel matrix sorting",
+    6: ".T\nCompiler design",
+    7: ".T\nOperating systems",
+}
+
+QUERIES = ['parallel sorting', '"parallel sorting"', 'sorting NEAR/2 parallel', 'matrix']
+
+def results(engine):
+    return [engine.search(query, 'Yes') for query in QUERIES] + [engine.boolean_search('sorting AND parallel', 'Yes')]
+
+def matched_doc_ids(engine):
+    return [sorted(int(doc_id) for doc_id in result) for result in results(engine)]
+
+def test_updates_invalidate_caches(build_index):
+    build_index(DOCUMENTS, 'stemOn')
+    engine = SearchEngine()
+
+    assert matched_doc_ids(engine) == [[1, 2, 4], [1], [1, 2, 4], [3, 4], [1, 2, 4]]
+    # The repeated queries, Boolean one included, are answered from the result cache, and the phrase, NEAR
+    # and Boolean operators decoded postings into the postings cache
+    hits = engine.result_cache.hits
+    assert matched_doc_ids(engine) == [[1, 2, 4], [1], [1, 2, 4], [3, 4], [1, 2, 4]]
+    assert engine.result_cache.hits == hits + len(QUERIES) + 1
+    assert len(engine.segments[0].index.postings_cache) > 0
+
+    # A new document, a replaced one that gains the phrase, and a deleted one that had it
+    update.add_documents({'5': ".T\nParallel sorting by merging"})
+    assert matched_doc_ids(engine) == [[1, 2, 4, 5], [1, 5], [1, 2, 4, 5], [3, 4], [1, 2, 4, 5]]
+
+    update.add_documents({'2': ".T\nParallel sorting networks"})
+    assert matched_doc_ids(engine) == [[1, 2, 4, 5], [1, 2, 5], [1, 2, 4, 5], [3, 4], [1, 2, 4, 5]]
+
+    update.delete_documents(['1', '3'])
+    assert matched_doc_ids(engine) == [[2, 4, 5], [2, 5], [2, 4, 5], [4], [2, 4, 5]]
+    assert results(engine) == results(SearchEngine(result_cache_size=0))
+
+    # A merge replaces the base segment, and with it its postings cache
+    update.merge_segments()
+    assert matched_doc_ids(engine) == [[2, 4, 5], [2, 5], [2, 4, 5], [4], [2, 4, 5]]
+    assert results(engine) == results(SearchEngine(result_cache_size=0))
@@ -0,0 +1,68 @@
+import os
+import threading
+from corpus import iter_raw_docs
+from invert import preprocess_and_inverted_index
+from postings import write_index
+from docstore import write_doc_store
+from segments import reset_manifest
+from search import SearchEngine
+import update
+
+# Searches from several threads sharing one SearchEngine while documents are added and segments merged,
+# as server.py does; no query may fail, and the results afterwards must match a freshly opened engine
+#
+#   python -m pytest test_concurrency.py
+
+COLLECTION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cacm.tar')
+QUERIES = ['parallel computing algorithms', 'matrix inversion', 'compiler optimization', 'operating system scheduling']
+
+def test_search_during_merge(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    documents = dict(iter_raw_docs(COLLECTION))
+    doc_ids = list(documents)[:2300]
+
+    base_docs = {doc_id: documents[doc_id] for doc_id in doc_ids[:1100]}
+    inverted_index, doc_stats = preprocess_and_inverted_index(base_docs, False)
+    write_index(inverted_index, doc_stats)
+    write_doc_store(base_docs, doc_stats)
+    reset_manifest(False)
+
+    engine = SearchEngine(result_cache_size=0)
+    stop = threading.Event()
+    errors = []
+    searched = [0]
+
+    def search_loop():
+        while not stop.is_set():
+            try:
+                for query in QUERIES:
+                    engine.search(query, 'No', ranking=('cosine', 'bm25')[searched[0] % 2])
+                    engine.has_doc(doc_ids[0])
+                    searched[0] += 1
+            except Exception as error:
+                errors.append(error)
+                return
+
+    threads = [threading.Thread(target=search_loop) for i in range(4)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for start in range(1100, len(doc_ids), 400):
+            update.add_documents({doc_id: documents[doc_id] for doc_id in doc_ids[start:start + 400]})
+            update.delete_documents(doc_ids[start - 10:start - 5])
+            if start % 800 == 700:
+                update.merge_segments()
+        update.merge_segments()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    assert searched[0] > 0
+
+    fresh_engine = SearchEngine(result_cache_size=0)
+    for query in QUERIES:
+        assert engine.search(query, 'No') == fresh_engine.search(query, 'No')
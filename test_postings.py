@@ -0,0 +1,79 @@
+import math
+import numpy as np
+from postings import SKIP_INTERVAL, IndexWriter, PostingsIndex, log_tfs, num_skips, vbyte_decode, vbyte_decode_prefix, vbyte_encode, vbyte_lengths
+
+# The variable-byte codec and the skip pointers of the binary postings format (see postings.py)
+#
+#   python -m pytest test_postings.py
+
+def test_vbyte_round_trip():
+    rng = np.random.default_rng(842)
+    values = np.concatenate(([0, 1, 127, 128, 16383, 16384, 2**31 - 1, 2**32, 2**35, 2**62 - 1], rng.integers(0, 2**40, 1000)))
+
+    encoded = vbyte_encode(values)
+
+    assert len(encoded) == vbyte_lengths(values).sum()
+    assert vbyte_decode(encoded).tolist() == values.tolist()
+    assert vbyte_decode_prefix(encoded, 5).tolist() == values[:5].tolist()
+    assert vbyte_decode(vbyte_encode([])).tolist() == []
+
+def test_log_tfs_match_math_log():
+    freqs = np.array([1, 2, 3, 1, 7, 100, 3])
+    assert log_tfs(freqs).tolist() == [math.log(f, 10) + 1 for f in freqs.tolist()]
+    assert log_tfs(np.zeros(0, dtype=np.int64)).tolist() == []
+
+# Writes one short term and one long enough to have skips, and returns the opened index and the long term's doc ids
+def write_test_index(tmp_path):
+    rng = np.random.default_rng(64)
+    long_doc_ids = np.sort(rng.choice(np.arange(1, 100000), 5 * SKIP_INTERVAL + 17, replace=False))
+    long_freqs = rng.integers(1, 5, len(long_doc_ids))
+
+    writer = IndexWriter(str(tmp_path / 'lexicon.bin'), str(tmp_path / 'postings.bin'))
+    writer.add_term('long', long_doc_ids, np.cumsum(long_freqs), np.concatenate([np.arange(f) * 3 + 1 for f in long_freqs.tolist()]))
+    writer.add_term('short', [5, 9], [1, 3], [0, 2, 4])
+    writer.close()
+
+    return PostingsIndex(str(tmp_path / 'lexicon.bin'), str(tmp_path / 'postings.bin')), long_doc_ids, long_freqs
+
+def test_postings_round_trip(tmp_path):
+    index, long_doc_ids, long_freqs = write_test_index(tmp_path)
+    long_id, short_id = index.term_id('long'), index.term_id('short')
+
+    assert num_skips(index.df(long_id)) == 5
+    postings = index.postings(long_id)
+    assert postings.doc_ids.tolist() == long_doc_ids.tolist()
+    assert postings.freqs.tolist() == long_freqs.tolist()
+    assert postings.positions(3) == (np.arange(long_freqs[3]) * 3 + 1).tolist()
+    assert index.doc_ids(long_id).tolist() == long_doc_ids.tolist()
+
+    short = index.postings(short_id)
+    assert short.doc_ids.tolist() == [5, 9]
+    assert [short.positions(0), short.positions(1)] == [[0], [2, 4]]
+
+    indptr, doc_ids, freqs = index.all_postings()
+    assert doc_ids[indptr[long_id]:indptr[long_id + 1]].tolist() == long_doc_ids.tolist()
+    assert freqs[indptr[short_id]:indptr[short_id + 1]].tolist() == [1, 2]
+
+    postings = None
+    index.close()
+
+def test_filter_doc_ids_seeks_with_skips(tmp_path):
+    index, long_doc_ids, long_freqs = write_test_index(tmp_path)
+    long_id = index.term_id('long')
+
+    # The first and last postings of chunks, the skip doc ids themselves, docs between two chunks, before the
+    # first posting and past the last one, so the lookups cross block boundaries in both directions
+    boundaries = np.arange(SKIP_INTERVAL, len(long_doc_ids), SKIP_INTERVAL)
+    present = np.concatenate((long_doc_ids[[0, -1]], long_doc_ids[boundaries], long_doc_ids[boundaries - 1]))
+    absent = np.concatenate(([0, long_doc_ids[-1] + 1], long_doc_ids[boundaries] - 1))
+    absent = absent[~np.isin(absent, long_doc_ids)]
+    queries = np.unique(np.concatenate((present, absent)))
+
+    # Four doc ids at a time are few enough that the skips are used rather than the whole list
+    assert 4 * SKIP_INTERVAL < len(long_doc_ids)
+    for start in range(0, len(queries), 4):
+        chunk = queries[start:start + 4]
+        assert index.filter_doc_ids(long_id, chunk).tolist() == np.intersect1d(chunk, long_doc_ids).tolist()
+
+    assert index.filter_doc_ids(long_id, queries).tolist() == np.intersect1d(queries, long_doc_ids).tolist()
+    index.close()
@@ -0,0 +1,78 @@
+import itertools
+import random
+import pytest
+from analyzer import get_analyzer
+from postings import PostingsIndex
+from proximity import parse_query, clause_matches
+from search import SearchEngine
+
+# Phrase and NEAR/k matching (see proximity.py), checked against a scan of every document's term positions
+#
+#   python -m pytest test_proximity.py
+
+WORDS = ['parallel', 'sorting', 'matrix', 'inversion', 'network', 'compiler', 'the', 'of']
+
+# Random documents over a few words, so that every phrase and window of them occurs in some documents and not others
+def random_documents():
+    rng = random.Random(842)
+    documents = {}
+    for doc_id in range(1, 81):
+        documents[doc_id] = '.T\n' + ' '.join(rng.choice(WORDS) for i in range(rng.randint(2, 12))) + '\n.W\n' + ' '.join(rng.choice(WORDS) for i in range(rng.randint(0, 30)))
+    return documents
+
+# The doc ids whose terms, listed in order as invert.py indexes them, satisfy matches(terms)
+def scan(documents, stemming, matches):
+    analyzer = get_analyzer(stemming == 'Yes')
+    return sorted(doc_id for doc_id, text in documents.items() if matches(analyzer.tokens(text)))
+
+def has_phrase(terms, phrase):
+    return any(terms[start:start + len(phrase)] == phrase for start in range(len(terms) - len(phrase) + 1))
+
+def within(terms, term, other_term, distance):
+    return any(abs(i - j) <= distance for i, a in enumerate(terms) if a == term for j, b in enumerate(terms) if b == other_term)
+
+def matched_doc_ids(index, query, stemming):
+    words, clauses = parse_query(query)
+    doc_ids = None
+    for clause in clauses:
+        matches = set(clause_matches(index, clause, stemming).tolist())
+        doc_ids = matches if doc_ids is None else doc_ids & matches
+    return sorted(doc_ids)
+
+@pytest.mark.parametrize('stemming, invert_stemming', [('Yes', 'stemOn'), ('No', 'stemOff')])
+def test_phrase_and_near_match_position_scan(build_index, stemming, invert_stemming):
+    documents = random_documents()
+    build_index(documents, invert_stemming)
+    index = PostingsIndex('lexicon.bin', 'postings.bin')
+    analyzer = get_analyzer(stemming == 'Yes')
+    content_words = [word for word in WORDS if analyzer.tokens(word)]
+
+    for phrase in itertools.chain(itertools.permutations(content_words, 2), itertools.permutations(content_words[:4], 3)):
+        terms = [analyzer.tokens(word)[0] for word in phrase]
+        expected = scan(documents, stemming, lambda doc_terms: has_phrase(doc_terms, terms))
+        assert matched_doc_ids(index, '"' + ' '.join(phrase) + '"', stemming) == expected, phrase
+
+    for (word, other_word), distance in itertools.product(itertools.combinations(content_words, 2), [1, 2, 5]):
+        term, other_term = analyzer.tokens(word)[0], analyzer.tokens(other_word)[0]
+        expected = scan(documents, stemming, lambda doc_terms: within(doc_terms, term, other_term, distance))
+        assert matched_doc_ids(index, f'{word} NEAR/{distance} {other_word}', stemming) == expected, (word, other_word, distance)
+
+    # A chain needs every neighbouring pair within its distance, and a phrase and a NEAR clause must both match
+    a, b, c = [analyzer.tokens(word)[0] for word in content_words[:3]]
+    expected = scan(documents, stemming, lambda doc_terms: within(doc_terms, a, b, 1) and within(doc_terms, b, c, 3))
+    assert matched_doc_ids(index, f'{content_words[0]} NEAR/1 {content_words[1]} NEAR/3 {content_words[2]}', stemming) == expected
+
+    expected = scan(documents, stemming, lambda doc_terms: has_phrase(doc_terms, [a, b]) and within(doc_terms, b, c, 2))
+    assert matched_doc_ids(index, f'"{content_words[0]} {content_words[1]}" {content_words[1]} NEAR/2 {content_words[2]}', stemming) == expected
+
+    index.close()
+
+def test_search_keeps_only_matching_documents(build_index):
+    documents = random_documents()
+    build_index(documents, 'stemOn')
+    analyzer = get_analyzer(True)
+    parallel, sorting, matrix = [analyzer.tokens(word)[0] for word in ('parallel', 'sorting', 'matrix')]
+
+    expected = scan(documents, 'Yes', lambda doc_terms: has_phrase(doc_terms, [parallel, sorting]) and within(doc_terms, sorting, matrix, 3))
+    results = SearchEngine().search('"parallel sorting" sorting NEAR/3 matrix', 'Yes', k=len(documents))
+    assert sorted(int(doc_id) for doc_id in results) == expected
@@ -0,0 +1,92 @@
+import math
+import numpy as np
+import pytest
+from search import SearchEngine
+
+# The pruned top-k scorers of scoring.py, checked against scoring every document that contains a query term
+#
+#   python -m pytest test_scoring.py
+
+# Returns the engine's cosine scorer for its only segment, and each query's (term_ids, query_weights, idfs)
+def scorer_queries(engine, queries):
+    segment = engine.segments[0]
+    return engine.scorer(segment, 'cosine'), [engine.segment_queries(query, 'Yes')[1][0] for query in queries]
+
+# Zero boosts rank every document containing a query term, with the same scores and no pruning
+def exhaustive_top_k(scorer, query, k):
+    return scorer.score(*query, k, doc_boosts=np.zeros(len(scorer.doc_ids)))
+
+def assert_same_ranking(results, expected):
+    assert [doc_id for doc_id, score in results] == [doc_id for doc_id, score in expected]
+    assert [score for doc_id, score in results] == pytest.approx([score for doc_id, score in expected], rel=1e-9)
+
+def test_impact_ordered_matches_exhaustive(build_index, collection):
+    documents, queries = collection
+    build_index(documents, 'stemOn', 'impactOrdered')
+    scorer, term_queries = scorer_queries(SearchEngine(result_cache_size=0), queries)
+    assert scorer.impact_index is not None
+
+    for query in term_queries:
+        for k in (1, 10, 20, 100):
+            assert_same_ranking(scorer.score(*query, k), exhaustive_top_k(scorer, query, k))
+            assert_same_ranking(scorer.score_maxscore(query[0], np.asarray(query[1]) * query[2], k), exhaustive_top_k(scorer, query, k))
+
+# With champion lists, only documents in the champion list of a query term are ranked, each with its exact
+# score; when fewer than k of them are live, the query is answered from the full postings
+def test_champions_rank_only_champion_documents(build_index, collection):
+    documents, queries = collection
+    build_index(documents, 'stemOn', 'champions=3')
+    scorer, term_queries = scorer_queries(SearchEngine(result_cache_size=0), queries)
+    assert scorer.tier_index is not None
+
+    k = 10
+    tiered = approximate = 0
+    for query in term_queries:
+        if len(query[0]) == 0:
+            continue
+        champions = np.unique(np.concatenate([scorer.tier_index.champions(term_id) for term_id in query[0]]))
+        results = scorer.score(*query, k)
+
+        if len(champions) < k:
+            assert_same_ranking(results, exhaustive_top_k(scorer, query, k))
+            continue
+
+        tiered += 1
+        assert set(doc_id for doc_id, score in results) <= set(scorer.doc_ids[champions].tolist())
+        assert_same_ranking(results, scorer.score(*query, k, doc_filter=scorer.doc_mask(scorer.doc_ids[champions]), doc_boosts=np.zeros(len(scorer.doc_ids))))
+        approximate += [doc_id for doc_id, score in results] != [doc_id for doc_id, score in exhaustive_top_k(scorer, query, k)]
+
+    # Three champions per term are few enough that some queries miss documents of the exact top k
+    assert tiered > 0 and approximate > 0
+
+# Three documents whose title (.T) and abstract (.W) lengths are 2 and 3, 1 and 4, and 1 and 1 terms, so N = 3,
+# the average length is 12 / 3 = 4, the average title length 4 / 3 and the average abstract length 8 / 3
+BM25_DOCUMENTS = {
+    1: ".T\nSort graph\n.W\nGraph tree tree",
+    2: ".T\nTree\n.W\nSort sort sort graph",
+    3: ".T\nNetwork\n.W\nNetwork",
+}
+
+# BM25 and BM25F scores worked out by hand with k1 = 1.2 and b = 0.75: sort and graph have df = 2, so
+# idf = ln(1 + (3 - 2 + 0.5) / (2 + 0.5)) = ln(1.6); graph occurs in the title and the abstract of doc 1
+def test_bm25_and_bm25f_match_hand_computed_scores(build_index):
+    build_index(BM25_DOCUMENTS, 'stemOn')
+    engine = SearchEngine(result_cache_size=0)
+    idf = math.log(1.6)
+
+    # BM25: f * 2.2 / (f + 1.2 * (0.25 + 0.75 * length / 4)), and both docs are 5 terms long
+    def bm25(f):
+        return f * 2.2 / (f + 1.2 * (0.25 + 0.75 * 5 / 4))
+
+    assert list(engine.search('sort', 'Yes', ranking='bm25')) == ['2', '1']
+    assert engine.search('sort', 'Yes', ranking='bm25') == pytest.approx({'2': idf * bm25(3), '1': idf * bm25(1)})
+    assert engine.search('sort graph', 'Yes', ranking='bm25') == pytest.approx({'1': idf * (bm25(1) + bm25(2)), '2': idf * (bm25(3) + bm25(1))})
+
+    # BM25F: the title counts twice; the title of doc 1 and the abstract of doc 2 are both 1.5 times their
+    # average length, so each field count is divided by 0.25 + 0.75 * 1.5 = 1.375, and the doc 1 abstract of
+    # 3 terms is 9 / 8 of the average, so its counts are divided by 0.25 + 0.75 * 9 / 8 = 1.09375
+    def saturate(pseudo_f):
+        return pseudo_f * 2.2 / (pseudo_f + 1.2)
+
+    assert engine.search('sort', 'Yes', ranking='bm25f') == pytest.approx({'1': idf * saturate(2 / 1.375), '2': idf * saturate(3 / 1.375)})
+    assert engine.search('graph', 'Yes', ranking='bm25f') == pytest.approx({'1': idf * saturate(2 / 1.375 + 1 / 1.09375), '2': idf * saturate(1 / 1.375)})
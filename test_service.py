@@ -0,0 +1,66 @@
+import asyncio
+import json
+import multiprocessing
+from urllib.parse import urlencode
+from search import SearchEngine, RANKINGS
+from service import QueryService, handle_connection
+
+# Runs the asyncio service (see service.py) with its worker processes on a small index, sends it concurrent
+# HTTP queries, and checks that they get SearchEngine's results and that it shuts down cleanly
+#
+#   python -m pytest test_service.py
+
+# Sends one GET request on a new connection and returns the response status and JSON payload
+async def get(port, target):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+
+    header, body = response.split(b'\r\n\r\n', 1)
+    return int(header.split()[1]), json.loads(body)
+
+async def run_service(requests):
+    service = QueryService(workers=2)
+    await service.start()
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(service, reader, writer), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    try:
+        responses = await asyncio.gather(*(get(port, target) for target in requests))
+        status = await get(port, '/status')
+    finally:
+        server.close()
+        await server.wait_closed()
+        await asyncio.wait_for(service.close(), 30)
+
+    return responses, status
+
+def test_concurrent_queries_match_search_engine(build_index, collection):
+    documents, queries = collection
+    build_index(documents, 'stemOn')
+
+    # Every query is sent twice at once, so some of the copies share a result
+    searches = [(query, ranking) for query in queries[:10] for ranking in RANKINGS] * 2
+    requests = ['/search?' + urlencode({'q': query, 'stemming': 'Yes', 'ranking': ranking}) for query, ranking in searches]
+    requests += ['/search?q=parallel&k=-1', '/doc?id=' + next(iter(documents)), '/doc?id=999999']
+
+    responses, (status_code, status) = asyncio.run(run_service(requests))
+
+    engine = SearchEngine(result_cache_size=0)
+    for (query, ranking), (code, payload) in zip(searches, responses):
+        assert code == 200
+        assert [(result['Document ID'], result['Score']) for result in payload['results']] == list(engine.search(query, 'Yes', ranking=ranking).items())
+
+    assert [code for code, payload in responses[len(searches):]] == [400, 200, 404]
+    assert responses[len(searches) + 1][1] == engine.retrieve_doc(next(iter(documents)))
+
+    assert status_code == 200
+    assert status['requests'] == len(requests) - 1 and status['errors'] == 0 and status['timeouts'] == 0
+    assert status['queued'] == 0 and status['in_flight'] == 0
+
+    # service.close shut the worker processes down
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,27 @@
+import pytest
+from search import SearchEngine, RANKINGS
+from shards import ShardedSearchEngine
+
+# A document-partitioned index (see shards.py) scores every document with the global statistics in stats.bin,
+# so its merged top k must be the single index's
+#
+#   python -m pytest test_shards.py
+
+# The shards only take plain text, so the CACM queries, which quote titles, are searched as plain text in both
+def test_sharded_search_matches_single_index(build_index, collection):
+    documents, queries = collection
+    build_index(documents, 'stemOn', 'shards=3')
+    engine = SearchEngine(result_cache_size=0)
+    sharded_engine = ShardedSearchEngine()
+
+    try:
+        for ranking in RANKINGS:
+            for query in queries:
+                expected = engine.search(query, 'Yes', query_operators=False, ranking=ranking)
+                results = sharded_engine.search(query, 'Yes', ranking=ranking)
+                assert list(results) == list(expected), (ranking, query)
+                assert results == pytest.approx(expected, rel=1e-9)
+
+            assert sharded_engine.search_batch(queries, 'Yes', ranking=ranking) == pytest.approx(engine.search_batch(queries, 'Yes', query_operators=False, ranking=ranking), rel=1e-9)
+    finally:
+        sharded_engine.close()
@@ -0,0 +1,118 @@
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+from postings import PostingsIndex
+from docstore import DocStore
+from scoring import CosineScorer
+
+# Optional champion lists of a segment's terms, the high tier of a two-tier index
+#
+#   tiers.bin (next to postings.bin, written by invert.py champions=<r>)
+#       header: magic, version, number of terms, total number of champions, r, crc32 of the postings file it was built from
+#       indptr:   int64[V + 1]    the champions of term t are at [indptr[t], indptr[t + 1])
+#       columns:  uint32[C]       position of each champion's doc in the segment's sorted doc ids, ascending
+#
+# A term's champions are the r documents with its highest normalised tf (tf / doc norm), i.e. the highest
+# tf-idf weight in the length-normalised document vectors, ties broken by doc id. The rest of its postings,
+# in postings.bin, are the lower tier. CosineScorer.score_tiered only scores the documents in the champion
+# lists of the query terms, and falls back to the full postings when fewer than k of them are live. Unlike
+# the other top-k scorers this is approximate: a document in no champion list can be missed even if it
+# would have made the top k, in exchange for scanning at most r postings per term (the longer terms'
+# postings are still probed for the candidates)
+#
+# The postings file's checksum ties the lists to the index they were built from; a stale tiers.bin is ignored
+
+TIERS_MAGIC = b'IRTR'
+TIERS_VERSION = 1
+
+TIERS_HEADER = struct.Struct('<4sIQQII')
+
+DEFAULT_CHAMPIONS = 50
+
+# Returns the champion lists file that goes with a postings file
+def tiers_file_for(postings_file):
+    directory, name = os.path.split(postings_file)
+    return os.path.join(directory, name.replace('postings', 'tiers'))
+
+# Writes the champion lists of an index already written to the lexicon, postings and doc store files
+def write_tier_index(champions=DEFAULT_CHAMPIONS, lexicon_file='lexicon.bin', postings_file='postings.bin', docstore_file='docstore.bin', tiers_file=None):
+
+    if tiers_file is None:
+        tiers_file = tiers_file_for(postings_file)
+
+    index = PostingsIndex(lexicon_file, postings_file)
+    docstore = DocStore(docstore_file)
+    scorer = CosineScorer(index, docstore.doc_ids, docstore.norms)
+
+    indptr = scorer.indptr.astype(np.int64)
+    columns = scorer.columns.astype(np.int64)
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+    # Rank every posting within its term by normalised tf, and keep the first r of each term, by doc
+    order = np.lexsort((columns, -scorer.normalized_tfs, rows))
+    ranks = np.arange(len(order)) - indptr[rows[order]]
+    kept = np.sort(order[ranks < champions])
+    champion_indptr = np.zeros(len(indptr), dtype=np.int64)
+    np.cumsum(np.minimum(np.diff(indptr), champions), out=champion_indptr[1:])
+
+    checksum = zlib.crc32(index.postings_map)
+
+    # The scorer's arrays are views of the mappings, so drop them before closing
+    scorer = None
+    index.close()
+    docstore.close()
+
+    with open(tiers_file, 'wb') as tiers_output:
+        tiers_output.write(TIERS_HEADER.pack(TIERS_MAGIC, TIERS_VERSION, len(indptr) - 1, len(kept), champions, checksum))
+        for values in (champion_indptr, columns[kept].astype(np.uint32)):
+            tiers_output.write(values.tobytes())
+
+# Returns the number of champions per term of a champion lists file, or None if there is no such file
+def read_champions(tiers_file):
+    if not os.path.exists(tiers_file):
+        return None
+
+    with open(tiers_file, 'rb') as tiers_input:
+        magic, version, num_terms, num_champions, champions, checksum = TIERS_HEADER.unpack(tiers_input.read(TIERS_HEADER.size))
+    return champions
+
+# Returns the champion lists of the index, or None if there are none or they are out of date
+def load_tier_index(index, tiers_file):
+    if not os.path.exists(tiers_file):
+        return None
+
+    tier_index = TierIndex(tiers_file)
+    if tier_index.checksum != zlib.crc32(index.postings_map) or tier_index.num_terms != index.num_terms:
+        tier_index.close()
+        return None
+
+    return tier_index
+
+# Read-only, memory-mapped champion lists written by write_tier_index
+class TierIndex:
+
+    def __init__(self, tiers_file):
+
+        with open(tiers_file, 'rb') as tiers_input:
+            self.tiers_map = mmap.mmap(tiers_input.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_terms, num_champions, self.champions_per_term, self.checksum = TIERS_HEADER.unpack_from(self.tiers_map, 0)
+        if magic != TIERS_MAGIC or version != TIERS_VERSION:
+            raise ValueError(f"{tiers_file} is not a version {TIERS_VERSION} champion lists file")
+
+        self.num_terms = num_terms
+
+        start = TIERS_HEADER.size
+        self.indptr = np.frombuffer(self.tiers_map, dtype=np.int64, count=num_terms + 1, offset=start)
+        start += 8 * (num_terms + 1)
+        self.columns = np.frombuffer(self.tiers_map, dtype=np.uint32, count=num_champions, offset=start)
+
+    # Returns the positions of the term's champion docs in the segment's sorted doc ids, ascending
+    def champions(self, term_id):
+        return self.columns[self.indptr[term_id]:self.indptr[term_id + 1]]
+
+    def close(self):
+        self.indptr = self.columns = None
+        self.tiers_map.close()
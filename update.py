@@ -0,0 +1,224 @@
+import math
+import os
+import sys
+import threading
+import numpy as np
+from postings import write_index, PostingsIndex
+from docstore import DocStoreWriter, DocStore
+from corpus import iter_raw_docs
+from invert import build_inverted_index, merge_shard_indexes, doc_items
+from segments import MANIFEST_FILE, BASE_FILES, SEGMENT_DIR, load_manifest, save_manifest, manifest_lock, segment_files, remove_segment_files, has_impact_index, tier_champions, index_checksum
+from impacts import impacts_file_for, write_impact_index
+from tiers import tiers_file_for, write_tier_index
+
+# Incremental updates to the index built by invert.py, without rebuilding it
+#
+# New documents are indexed on their own into a small segment (see segments.py), so adding them costs time
+# proportional to the new documents rather than the whole collection. Deleted documents are only tombstoned
+# in the manifest. merge_segments folds every segment into the base index and drops the tombstoned documents;
+# it does the heavy work without holding the manifest lock, so it can run in a background thread while
+# documents keep being added and deleted
+#
+# Only one process should update the index at a time; threads of that process are serialized by the locks
+
+# Only one merge runs at a time
+merge_lock = threading.Lock()
+
+# Returns the manifest, which invert.py must have written first
+def current_manifest(manifest_file=MANIFEST_FILE):
+    manifest = load_manifest(manifest_file)
+    if manifest is None:
+        raise FileNotFoundError(f"{manifest_file} not found, run invert.py to build the index first")
+    return manifest
+
+# Indexes the documents ({doc_id: text} or (doc_id, text) pairs) into a new segment and returns its name
+# Documents that are already in the index are replaced: their older copies are tombstoned
+def add_documents(documents, manifest_file=MANIFEST_FILE):
+
+    documents = dict(doc_items(documents))
+    if not documents:
+        return None
+
+    with manifest_lock:
+        manifest = current_manifest(manifest_file)
+        name = f"segment_{manifest['next_segment']}"
+
+        inverted_index, doc_stats = build_inverted_index(documents, manifest['stemming'])
+
+        # Only the lexicons and doc ids of the existing segments are read, for the dfs, N and the replaced documents
+        segments = []
+        for segment in manifest['segments']:
+            lexicon_file, postings_file, docstore_file = segment_files(segment)
+            segments.append((segment, PostingsIndex(lexicon_file, postings_file), DocStore(docstore_file)))
+
+        # Norms use the dfs and N of the whole index including the new documents, like the idfs at search time
+        N = len(doc_stats) + sum(len(docstore) for segment, index, docstore in segments)
+        norms = np.zeros(len(doc_stats))
+        for term in inverted_index:
+            df = inverted_index.df(term)
+            for segment, index, docstore in segments:
+                term_id = index.term_id(term)
+                if term_id is not None:
+                    df += index.df(term_id)
+
+            term_idf = math.log((N/df),10)
+            inverted_index.add_squared_weights(norms, term, term_idf)
+
+        # Norms are by doc number, the order of doc_stats (see invert.preprocess_and_inverted_index)
+        for stats, norm in zip(doc_stats.values(), norms.tolist()):
+            stats['norm'] = math.sqrt(norm)
+
+        os.makedirs(SEGMENT_DIR, exist_ok=True)
+        lexicon_file, postings_file, docstore_file = segment_files(name)
+        write_index(inverted_index, doc_stats, lexicon_file, postings_file)
+
+        docstore_writer = DocStoreWriter(docstore_file)
+        for doc_id, content in documents.items():
+            docstore_writer.add(doc_id, content)
+        docstore_writer.close(doc_stats)
+
+        if has_impact_index():
+            write_impact_index(lexicon_file, postings_file, docstore_file)
+        if tier_champions() is not None:
+            write_tier_index(tier_champions(), lexicon_file, postings_file, docstore_file)
+
+        for segment, index, docstore in segments:
+            replaced = [int(doc_id) for doc_id in documents if doc_id in docstore]
+            if replaced:
+                manifest['deleted'][segment] = sorted(set(manifest['deleted'].get(segment, [])) | set(replaced))
+            index.close()
+            docstore.close()
+
+        manifest['segments'].append(name)
+        manifest['next_segment'] += 1
+        manifest['generation'] += 1
+        save_manifest(manifest, manifest_file)
+
+    return name
+
+# Tombstones the documents wherever they are live and returns how many were deleted
+def delete_documents(doc_ids, manifest_file=MANIFEST_FILE):
+
+    doc_ids = {int(doc_id) for doc_id in doc_ids}
+    deleted_count = 0
+
+    with manifest_lock:
+        manifest = current_manifest(manifest_file)
+
+        for segment in manifest['segments']:
+            docstore = DocStore(segment_files(segment)[2])
+            deleted = set(manifest['deleted'].get(segment, []))
+
+            found = {doc_id for doc_id in doc_ids if doc_id in docstore and doc_id not in deleted}
+            if found:
+                manifest['deleted'][segment] = sorted(deleted | found)
+                deleted_count += len(found)
+
+            docstore.close()
+
+        if deleted_count:
+            manifest['generation'] += 1
+            save_manifest(manifest, manifest_file)
+
+    return deleted_count
+
+# Merges all segments into a new base index without the deleted documents; returns False if there was nothing to merge
+# Segments added and documents deleted while the merge runs are kept in the manifest after it
+def merge_segments(manifest_file=MANIFEST_FILE):
+    with merge_lock:
+        return merge_all_segments(manifest_file)
+
+def merge_all_segments(manifest_file):
+
+    with manifest_lock:
+        manifest = current_manifest(manifest_file)
+
+    segments = manifest['segments']
+    deleted = [set(manifest['deleted'].get(segment, [])) for segment in segments]
+    if segments == ['base'] and not deleted[0]:
+        return False
+
+    # The live documents' lengths, in segment order, and their stored text for the new doc store
+    merged_files = tuple(f'{base_file}.merge' for base_file in BASE_FILES)
+    docstore_writer = DocStoreWriter(merged_files[2])
+    doc_stats = {}
+
+    for segment, segment_deleted in zip(segments, deleted):
+        docstore = DocStore(segment_files(segment)[2])
+        for i, doc_id in enumerate(docstore.doc_ids.tolist()):
+            if doc_id not in segment_deleted:
+                doc_stats[str(doc_id)] = {'length': docstore.lengths[i], 'fields': docstore.field_ranges[4 * i:4 * i + 4].tolist(), 'norm': 0.0}
+                docstore_writer.add(str(doc_id), docstore.field(i, 2))
+        docstore.close()
+
+    merge_shard_indexes([segment_files(segment)[:2] for segment in segments], doc_stats, merged_files[0], merged_files[1], [sorted(segment_deleted) for segment_deleted in deleted])
+    docstore_writer.close(doc_stats)
+
+    base_files = BASE_FILES
+    if has_impact_index():
+        write_impact_index(*merged_files, impacts_file_for(BASE_FILES[1]) + '.merge')
+        merged_files += (impacts_file_for(BASE_FILES[1]) + '.merge',)
+        base_files += (impacts_file_for(BASE_FILES[1]),)
+    if tier_champions() is not None:
+        write_tier_index(tier_champions(), *merged_files[:3], tiers_file_for(BASE_FILES[1]) + '.merge')
+        merged_files += (tiers_file_for(BASE_FILES[1]) + '.merge',)
+        base_files += (tiers_file_for(BASE_FILES[1]),)
+
+    with manifest_lock:
+        manifest = current_manifest(manifest_file)
+
+        # Documents of the merged segments deleted during the merge are now deleted from the new base
+        base_deleted = set()
+        for segment, segment_deleted in zip(segments, deleted):
+            base_deleted |= set(manifest['deleted'].get(segment, [])) - segment_deleted
+
+        for merged_file, base_file in zip(merged_files, base_files):
+            os.replace(merged_file, base_file)
+
+        manifest['deleted'] = {segment: doc_ids for segment, doc_ids in manifest['deleted'].items() if segment not in segments}
+        if base_deleted:
+            manifest['deleted']['base'] = sorted(base_deleted)
+        manifest['segments'] = ['base'] + [segment for segment in manifest['segments'] if segment not in segments]
+        manifest['merges'] += 1
+        manifest['checksum'] = index_checksum()
+        manifest['generation'] += 1
+        save_manifest(manifest, manifest_file)
+
+        for segment in segments:
+            if segment != 'base':
+                remove_segment_files(segment)
+
+    return True
+
+# Runs merge_segments in a background thread and returns the thread
+def start_background_merge(manifest_file=MANIFEST_FILE):
+    merge_thread = threading.Thread(target=merge_segments, args=(manifest_file,))
+    merge_thread.start()
+    return merge_thread
+
+def main():
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('add', 'delete', 'merge'):
+        print(f"Usage: update.py add <collection tar file> [merge] | update.py delete <doc id> [<doc id> ...] | update.py merge")
+
+    elif sys.argv[1] == 'add':
+        name = add_documents(iter_raw_docs(sys.argv[2]))
+        print(f"Added the documents as {name}")
+
+        # Optionally fold the new segment into the base index in the background
+        if 'merge' in sys.argv[3:]:
+            print(f"Merging segments in the background...")
+            start_background_merge().join()
+            print(f"All segments were merged into the base index!")
+
+    elif sys.argv[1] == 'delete':
+        print(f"Deleted {delete_documents(sys.argv[2:])} documents")
+
+    else:
+        if merge_segments():
+            print(f"All segments were merged into the base index!")
+        else:
+            print(f"There is nothing to merge.")
+
+if __name__ == "__main__":
+    main()